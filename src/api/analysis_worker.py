@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Analysis worker: claims jobs from the durable `analysis_jobs` queue and runs the CNN on them.
+
+Usage (from the backend folder, one command per worker process):
+    python analysis_worker.py [--poll 1.0] [--once] [--metrics-port 9101]
+
+Run as many processes as the hardware allows; they coordinate through the database. The API
+also runs ANALYSIS_INPROCESS_WORKERS worker threads (default 1, set 0 when dedicated worker
+processes are deployed). With --metrics-port (or ANALYSIS_METRICS_PORT) the worker exposes its
+own Prometheus metrics, e.g. the per-stage analysis histograms.
+"""
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+import uuid
+
+import database
+import job_queue
+import cnn_predictor
+import metrics
+
+POLL_SECONDS = float(os.getenv("ANALYSIS_POLL_SECONDS", "1"))
+METRICS_PORT = int(os.getenv("ANALYSIS_METRICS_PORT", "0"))
+
+JOB_RUN_SECONDS = metrics.histogram("analysis_job_run_seconds", "Analysis job execution time", labelnames=("result",))
+
+
+def _worker_id(suffix: str = "") -> str:
+    return f"{socket.gethostname()}:{os.getpid()}{suffix}:{uuid.uuid4().hex[:6]}"
+
+
+def _keep_lease(job_id: str, worker_id: str, attempt: int, done: threading.Event):
+    """Renew the job's lease every HEARTBEAT_SECONDS until `done`, so a long analysis is not re-claimed."""
+    while not done.wait(job_queue.HEARTBEAT_SECONDS):
+        db = database.SessionLocal()
+        try:
+            if not job_queue.heartbeat(db, job_id, worker_id, attempt):
+                print(f"[analysis_worker] {worker_id} lost the lease on job {job_id}")
+                return
+        except Exception as e:
+            print(f"[analysis_worker] heartbeat for job {job_id} failed: {e}")
+        finally:
+            db.close()
+
+
+def run_one(worker_id: str) -> bool:
+    """Claim and run a single job. Returns False when the queue had nothing runnable."""
+    db = database.SessionLocal()
+    try:
+        job = job_queue.claim(db, worker_id)
+        if job is None:
+            return False
+        print(f"[analysis_worker] {worker_id} running job {job.id} (case {job.case_id}, attempt {job.attempts})")
+        t0 = time.perf_counter()
+        done = threading.Event()
+        threading.Thread(
+            target=_keep_lease, args=(job.id, worker_id, job.attempts, done), name=f"lease-{job.id[:8]}", daemon=True,
+        ).start()
+        try:
+            cnn_predictor.analyze_case(job.case_id, raise_errors=True)
+        except Exception as e:
+            traceback.print_exc()
+            JOB_RUN_SECONDS.observe(time.perf_counter() - t0, result="error")
+            job_queue.fail(db, job, f"{type(e).__name__}: {e}")
+            print(f"[analysis_worker] job {job.id} failed -> {job.status}")
+        else:
+            JOB_RUN_SECONDS.observe(time.perf_counter() - t0, result="ok")
+            job_queue.complete(db, job)
+        finally:
+            done.set()
+        return True
+    finally:
+        db.close()
+
+
+def run_worker(stop: threading.Event, worker_id: str = None, poll_seconds: float = POLL_SECONDS):
+    """Process jobs until `stop` is set, sleeping `poll_seconds` whenever the queue is empty."""
+    worker_id = worker_id or _worker_id()
+    while not stop.is_set():
+        try:
+            if run_one(worker_id):
+                continue
+        except Exception as e:
+            # DB hiccup (e.g. SQLite busy): back off and retry
+            print(f"[analysis_worker] {worker_id} error: {e}")
+        job_queue.wait_for_work(poll_seconds)
+
+
+def start_background_workers(count: int) -> threading.Event:
+    """Start `count` daemon worker threads in this process; set the returned event to stop them."""
+    stop = threading.Event()
+    for i in range(max(0, count)):
+        threading.Thread(
+            target=run_worker, args=(stop, _worker_id(f"-t{i}")), name=f"analysis-worker-{i}", daemon=True,
+        ).start()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CNN analysis worker")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="seconds between polls when idle")
+    parser.add_argument("--once", action="store_true", help="drain runnable jobs then exit")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT, help="serve Prometheus metrics on this port (0 = off)")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    database.init_db()
+    cnn_predictor.startup()
+    worker_id = _worker_id()
+
+    if args.once:
+        while run_one(worker_id):
+            pass
+        return
+
+    stop = threading.Event()
+    # finish the current job, then exit, on SIGTERM/SIGINT (deploys)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    print(f"[analysis_worker] {worker_id} started")
+    run_worker(stop, worker_id, args.poll)
+    print(f"[analysis_worker] {worker_id} stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# backend/blob_store.py
+"""Content-addressed storage for uploaded MRI files.
+
+Blobs live under `uploads/blobs/<aa>/<bb>/<sha256><ext>` (two levels of 256-way sharding), so
+identical uploads share one file and no directory grows unbounded. `MRIImage.content_hash`
+is the reference: a blob is garbage-collected once no MRIImage row points at it any more.
+Derived files keyed by the same hash (previews, `uploads/previews/<sha256>.<size>.r<version>.webp`) go with it.
+
+Blobs touched within GC_GRACE_SECONDS are never collected, so an upload that has placed (or
+reused) a blob but not yet committed its MRIImage row cannot lose it to a concurrent delete;
+`sweep()` picks up anything left behind; the API runs it every STORAGE_GC_INTERVAL_SECONDS
+(see main.py), so such blobs are collected once their grace period is over.
+"""
+import os
+import re
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+import models
+import preview_cache
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+BLOBS_DIRNAME = "blobs"
+PREVIEWS_DIRNAME = "previews"
+# where uploads are written before being moved into the store (same filesystem, so moves are atomic)
+INCOMING_DIRNAME = ".incoming"
+GC_GRACE_SECONDS = float(os.getenv("BLOB_GC_GRACE_SECONDS", "60"))
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_hash(value: str) -> bool:
+    return bool(value) and bool(_HASH_RE.match(value))
+
+
+def relpath_for(sha256: str, ext: str = "") -> str:
+    """Path of a blob relative to the uploads root, e.g. 'blobs/ab/cd/abcd...ef.dcm'."""
+    return "/".join((BLOBS_DIRNAME, sha256[:2], sha256[2:4], f"{sha256}{ext.lower()}"))
+
+
+def url_for(relpath: str) -> str:
+    """Value stored in MRIImage.file_path (served by the /uploads static mount)."""
+    return f"/uploads/{relpath}"
+
+
+def hash_for_path(path: str) -> Optional[str]:
+    """Content hash encoded in a blob path or URL, without reading the file; None otherwise."""
+    if not path:
+        return None
+    parts = path.replace("\\", "/").split("/")
+    if len(parts) < 4 or parts[-4] != BLOBS_DIRNAME:
+        return None
+    stem = os.path.splitext(parts[-1])[0]
+    return stem if is_hash(stem) else None
+
+
+def find_blob(sha256: str, root: str = None) -> Optional[str]:
+    """Absolute path of the stored blob for `sha256` (whatever its extension), or None."""
+    if not is_hash(sha256):
+        return None
+    shard = os.path.join(root or UPLOAD_DIR, BLOBS_DIRNAME, sha256[:2], sha256[2:4])
+    try:
+        names = os.listdir(shard)
+    except OSError:
+        return None
+    for name in names:
+        if os.path.splitext(name)[0] == sha256:
+            return os.path.join(shard, name)
+    return None
+
+
+def put_file(tmp_path: str, sha256: str, ext: str = "", root: str = None) -> Tuple[str, bool]:
+    """
+    Move a fully written temp file into the store under its hash. If the blob already exists the
+    temp file is dropped and the blob's mtime refreshed (GC grace). Returns (relpath, created).
+    """
+    root = root or UPLOAD_DIR
+    existing = find_blob(sha256, root)
+    if existing is not None:
+        os.remove(tmp_path)
+        os.utime(existing)
+        return os.path.relpath(existing, root).replace(os.sep, "/"), False
+    relpath = relpath_for(sha256, ext)
+    final_path = os.path.join(root, *relpath.split("/"))
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+    os.replace(tmp_path, final_path)
+    return relpath, True
+
+
+def _remove_blob(sha256: str, root: str) -> bool:
+    path = find_blob(sha256, root)
+    if path is None:
+        return False
+    try:
+        if time.time() - os.path.getmtime(path) < GC_GRACE_SECONDS:
+            return False
+        os.remove(path)
+    except OSError:
+        return False
+    # derived artifacts keyed by the same hash
+    previews_dir = os.path.join(root, PREVIEWS_DIRNAME)
+    try:
+        for name in os.listdir(previews_dir):
+            if name.startswith(sha256):
+                os.remove(os.path.join(previews_dir, name))
+    except OSError:
+        pass
+    preview_cache.CACHE.discard(root, sha256)
+    return True
+
+
+def _referenced(db: Session, hashes: Iterable[str]) -> set:
+    wanted = list(hashes)
+    found = set()
+    for i in range(0, len(wanted), 500):
+        rows = db.query(models.MRIImage.content_hash).filter(
+            models.MRIImage.content_hash.in_(wanted[i:i + 500])
+        ).distinct().all()
+        found.update(r[0] for r in rows)
+    return found
+
+
+def release(db: Session, hashes: Iterable[str], root: str = None) -> List[str]:
+    """
+    Garbage-collect the blobs among `hashes` that no MRIImage row references any more.
+    Call after the deleting transaction has committed. Returns the hashes removed.
+    """
+    root = root or UPLOAD_DIR
+    candidates = {h for h in hashes if is_hash(h)}
+    if not candidates:
+        return []
+    unreferenced = candidates - _referenced(db, candidates)
+    return [h for h in sorted(unreferenced) if _remove_blob(h, root)]
+
+
+def sweep(db: Session, root: str = None) -> dict:
+    """Collect every unreferenced blob and stale partial upload (e.g. left by a crash)."""
+    root = root or UPLOAD_DIR
+    blobs_dir = os.path.join(root, BLOBS_DIRNAME)
+    on_disk = set()
+    for dirpath, _, names in os.walk(blobs_dir):
+        on_disk.update(h for h in (os.path.splitext(n)[0] for n in names) if is_hash(h))
+    removed = release(db, on_disk, root)
+
+    stale_parts = 0
+    incoming = os.path.join(root, INCOMING_DIRNAME)
+    try:
+        for name in os.listdir(incoming):
+            path = os.path.join(incoming, name)
+            if time.time() - os.path.getmtime(path) >= GC_GRACE_SECONDS:
+                os.remove(path)
+                stale_parts += 1
+    except OSError:
+        pass
+    return {"blobs_scanned": len(on_disk), "blobs_removed": len(removed), "partials_removed": stale_parts}
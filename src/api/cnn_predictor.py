@@ -2,15 +2,23 @@
 import os
 import json
 import time
+import hashlib
+import threading
 import traceback
 from typing import Optional, List
 
 import numpy as np
-import pydicom
-import cv2
-from tensorflow.keras.models import load_model
 
 import database
+import preprocessing
+from preprocessing import TARGET_SHAPE
+from inference_scheduler import InferenceScheduler, SchedulerClosed
+from tflite_model import TFLiteModel
+from model_registry import ModelRegistry, ModelVersion
+import model_deployment
+import prediction_cache
+import series
+import metrics
 from sqlalchemy.orm import Session
 
 # --- Config ---
@@ -21,53 +29,394 @@ MODEL_CANDIDATE_PATHS = [
     "/kaggle/working/cnn_parkinson_model.h5",
     os.path.join(BASE_DIR, "cnn_parkinson_model.h5"),
 ]
+# Quantized variant to serve ("float16" or "int8", produced by src/models/quantization.py).
+# Empty means the float32 export.
+MODEL_VARIANT = os.getenv("CNN_MODEL_VARIANT", "").lower() or None
+# Exported lightweight artifacts (see src/models/export.py). Preferred over the .h5 when present;
+# the requested quantized variant comes first, the float32 export is the fallback.
+TFLITE_CANDIDATE_PATHS = (
+    [os.path.splitext(p)[0] + f".{MODEL_VARIANT}.tflite" for p in MODEL_CANDIDATE_PATHS] if MODEL_VARIANT else []
+) + [os.path.splitext(p)[0] + ".tflite" for p in MODEL_CANDIDATE_PATHS]
+# "auto" (TFLite if an artifact exists, else Keras), "tflite" or "keras"
+MODEL_RUNTIME = os.getenv("CNN_MODEL_RUNTIME", "auto").lower()
+TFLITE_NUM_THREADS = int(os.getenv("CNN_TFLITE_NUM_THREADS", "0")) or None
 
-TARGET_SHAPE = (128, 128)
+# Maximum number of slices stacked into a single forward pass. Large series are split into
+# chunks of this size so memory stays bounded.
+MAX_BATCH_SIZE = int(os.getenv("CNN_MAX_BATCH_SIZE", "32"))
+# Cross-request micro-batching: concurrent analyses share forward passes through one worker.
+SCHEDULER_ENABLED = os.getenv("CNN_SCHEDULER_ENABLED", "1") not in ("0", "false", "False")
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("CNN_SCHEDULER_MAX_BATCH_SIZE", str(MAX_BATCH_SIZE * 2)))
+SCHEDULER_MAX_WAIT_MS = float(os.getenv("CNN_SCHEDULER_MAX_WAIT_MS", "5"))
+
+# "slices": every image scored independently and combined with series.AGGREGATION (default mean).
+# "series": slices grouped per DICOM series, ordered, multi-frame files expanded and sampled
+# (see series.py); each series is aggregated, then the series are averaged.
+INFERENCE_MODE = os.getenv("CNN_INFERENCE_MODE", "slices").lower()
+# Adaptive early exit: score slices in batches (spread over the volume) and stop once the running
+# mean P(class 0) is at least EARLY_EXIT_MARGIN + EARLY_EXIT_Z standard errors from 0.5
+EARLY_EXIT_ENABLED = os.getenv("CNN_EARLY_EXIT", "0") not in ("0", "false", "False")
+EARLY_EXIT_BATCH = int(os.getenv("CNN_EARLY_EXIT_BATCH", "16"))
+EARLY_EXIT_MIN_SLICES = int(os.getenv("CNN_EARLY_EXIT_MIN_SLICES", "16"))
+EARLY_EXIT_MARGIN = float(os.getenv("CNN_EARLY_EXIT_MARGIN", "0.1"))
+EARLY_EXIT_Z = float(os.getenv("CNN_EARLY_EXIT_Z", "3.0"))
+
+# Also store each case's per-stage timings (JSON) in MedicalCase.cnn_timings
+STORE_TIMINGS = os.getenv("CNN_STORE_TIMINGS", "0") not in ("0", "false", "False")
+
+# Poll the candidate paths every N seconds and hot-swap to a changed artifact (0 = off)
+MODEL_WATCH_SECONDS = float(os.getenv("CNN_MODEL_WATCH_SECONDS", "0"))
+# Poll the shared model routing (active / canary / retired, see model_deployment.py) every N seconds (0 = off)
+ROUTING_POLL_SECONDS = float(os.getenv("CNN_ROUTING_POLL_SECONDS", "10"))
 
 # --- Load model (attempt several locations) ---
-_model = None
-_model_path_used = None
-for p in MODEL_CANDIDATE_PATHS:
-    if os.path.exists(p):
-        _model = load_model(p)
-        _model_path_used = p
-        break
-
-if _model is None:
-    # Model not found at import time. We'll lazily load later in analyze_case.
-    pass
-else:
-    print(f"[cnn_predictor] loaded model from: {_model_path_used}")
+def _find_candidate_path() -> Optional[str]:
+    """First existing model artifact, honouring MODEL_RUNTIME (TFLite before .h5 in auto mode)."""
+    candidates = []
+    if MODEL_RUNTIME in ("auto", "tflite"):
+        candidates += TFLITE_CANDIDATE_PATHS
+    if MODEL_RUNTIME in ("auto", "keras"):
+        candidates += MODEL_CANDIDATE_PATHS
+    for p in candidates:
+        if os.path.exists(p):
+            return p
+    return None
+
+def _load_path(path: str):
+    """Return (model, runtime) for a .tflite or Keras artifact."""
+    if path.endswith(".tflite"):
+        return TFLiteModel(path, num_threads=TFLITE_NUM_THREADS), "tflite"
+    # import TensorFlow only when we actually have to serve the Keras model
+    from tensorflow.keras.models import load_model
+    return load_model(path), "keras"
+
+def _compute_model_version(path: str, runtime: Optional[str]) -> str:
+    """Content hash of the model artifact; cached predictions are only valid for this version."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return f"{runtime}:{h.hexdigest()[:16]}"
+
+# The model is loaded by startup() (API) or lazily on first analysis (scripts), not at import.
+registry = ModelRegistry()
+_load_lock = threading.Lock()
+
+# --- Startup / readiness ---
+# Batch sizes traced during warm-up so the first real request doesn't pay for it.
+WARMUP_BATCH_SIZES = sorted({
+    int(b) for b in os.getenv("CNN_WARMUP_BATCH_SIZES", "").split(",") if b.strip()
+} or {1, MAX_BATCH_SIZE, SCHEDULER_MAX_BATCH_SIZE})
+
+def _warm_up(model, batch_sizes: Optional[List[int]] = None):
+    for b in (batch_sizes or WARMUP_BATCH_SIZES):
+        dummy = np.zeros((int(b), *TARGET_SHAPE, 3), dtype=np.float32)
+        model.predict(dummy, batch_size=int(b), verbose=0)
+
+def load_version(path: str, activate: bool = False, warm_up: bool = True) -> ModelVersion:
+    """
+    Load the artifact at `path` into the registry (a no-op if that exact content is already
+    loaded), optionally warm it up and make it the active version.
+    """
+    runtime = "tflite" if path.endswith(".tflite") else "keras"
+    version = _compute_model_version(path, runtime)
+    entry = registry.get(version)
+    if entry is None:
+        model, runtime = _load_path(path)
+        if warm_up:
+            _warm_up(model)
+        entry = registry.register(ModelVersion(version, model, path=path, runtime=runtime))
+        print(f"[cnn_predictor] loaded {runtime} model {version} from: {path}")
+    if activate and (registry.active is None or registry.active.version != version):
+        registry.activate(version)
+        print(f"[cnn_predictor] active model is now {version}")
+    return entry
+
+def reload_model(path: Optional[str] = None, activate: bool = True) -> ModelVersion:
+    """Hot-load `path` (default: the first candidate artifact) without dropping the current model."""
+    path = path or _find_candidate_path()
+    if path is None or not os.path.exists(path):
+        raise FileNotFoundError(f"Model artifact not found: {path}")
+    with _load_lock:
+        return load_version(path, activate=activate)
+
+def _unload_local(version: str):
+    registry.unload(version)
+    sched = _schedulers.pop(version, None)
+    if sched is not None:
+        sched.stop()
+
+def unload_version(version: str, retire: bool = True):
+    """
+    Drop a non-active version and stop its scheduler. With retire=True it is also marked retired
+    in the shared routing, so every other process unloads it too.
+    """
+    _unload_local(version)
+    if retire:
+        db = database.SessionLocal()
+        try:
+            model_deployment.retire(db, version)
+        finally:
+            db.close()
+
+def _ensure_loaded(version: str, path: Optional[str]) -> bool:
+    """Load `version` from `path` unless resident; False (logged) when that artifact is not it."""
+    if version in registry:
+        return True
+    if not path or not os.path.exists(path):
+        print(f"[cnn_predictor] routing: artifact for {version} not found at {path}")
+        return False
+    runtime = "tflite" if path.endswith(".tflite") else "keras"
+    found = _compute_model_version(path, runtime)
+    if found != version:
+        print(f"[cnn_predictor] routing: {path} now holds {found}, not {version}")
+        return False
+    load_version(path)
+    return True
+
+def sync_routing(db: Optional[Session] = None) -> bool:
+    """
+    Apply the shared model routing (model_deployment.py) to this process's registry: load and
+    activate the desired active version, set the canary, unload retired versions. Returns True
+    when something changed.
+    """
+    own = db is None
+    db = db or database.SessionLocal()
+    try:
+        want = model_deployment.desired(db)
+        active = (want["active"].version, want["active"].path) if want["active"] is not None else None
+        canary = want["canary"]
+        canary = (canary.version, canary.path, canary.canary_fraction or 0.0) if canary is not None else None
+        retired = want["retired"]
+    finally:
+        if own:
+            db.close()
+    changed = False
+    with _load_lock:
+        if active and _ensure_loaded(*active) and (registry.active is None or registry.active.version != active[0]):
+            registry.activate(active[0])
+            print(f"[cnn_predictor] routing: active model is now {active[0]}")
+            changed = True
+        current = registry.canary
+        if canary is None:
+            if current is not None:
+                registry.set_canary(None)
+                changed = True
+        elif _ensure_loaded(canary[0], canary[1]) and (
+                current is None or current.version != canary[0] or registry.canary_fraction != canary[2]):
+            registry.set_canary(canary[0], canary[2])
+            print(f"[cnn_predictor] routing: canary {canary[0]} at {canary[2]:.0%}")
+            changed = True
+        for version in retired:
+            if version in registry and registry.active is not None and registry.active.version != version:
+                _unload_local(version)
+                print(f"[cnn_predictor] routing: unloaded retired model {version}")
+                changed = True
+    return changed
+
+def _publish_startup_model():
+    """First process up records its model as the shared active version, then every process follows the routing."""
+    entry = registry.active
+    db = database.SessionLocal()
+    try:
+        if model_deployment.desired(db)["active"] is None and entry is not None:
+            model_deployment.record(db, entry.version, os.path.abspath(entry.path) if entry.path else None, entry.runtime)
+            model_deployment.set_active(db, entry.version)
+        sync_routing(db)
+    finally:
+        db.close()
+
+def _routing_loop():
+    while True:
+        time.sleep(ROUTING_POLL_SECONDS)
+        try:
+            sync_routing()
+        except Exception as e:
+            print(f"[cnn_predictor] routing sync: {e}")
 
 def _lazy_load_model():
-    global _model, _model_path_used
-    if _model is not None:
-        return _model
-    for p in MODEL_CANDIDATE_PATHS:
-        if os.path.exists(p):
-            _model = load_model(p)
-            _model_path_used = p
-            print(f"[cnn_predictor] lazy-loaded model from: {_model_path_used}")
-            return _model
-    raise FileNotFoundError("Model .h5 not found in candidate paths. Put cnn_parkinson_model.h5 in backend/models/")
-
-def _preprocess_from_path(filepath: str):
-    """
-    Read DICOM from disk and return np.array shaped (1,128,128,3) as float32.
-    """
-    dcm = pydicom.dcmread(filepath)
-    img = dcm.pixel_array.astype(np.float32)
-    # min-max normalization
-    img = (img - img.min()) / (img.max() - img.min() + 1e-5)
-    # resize
-    img = cv2.resize(img, TARGET_SHAPE, interpolation=cv2.INTER_AREA)
-    # add channel
-    if img.ndim == 2:
-        img = img[..., np.newaxis]
-    # convert to 3 channels (RGB) by repeating
-    img = np.repeat(img, 3, axis=-1)
-    img = np.expand_dims(img, axis=0).astype(np.float32)
-    return img
+    entry = registry.active
+    if entry is not None:
+        return entry.model
+    with _load_lock:
+        if registry.active is not None:
+            return registry.active.model
+        path = _find_candidate_path()
+        if path is not None:
+            return load_version(path, activate=True, warm_up=False).model
+    raise FileNotFoundError("Model .h5/.tflite not found in candidate paths. Put cnn_parkinson_model.h5 in backend/models/")
+
+def choose_model() -> ModelVersion:
+    """Version that should score the next case: the active one, or the canary for its share."""
+    _lazy_load_model()
+    return registry.choose()
+
+def _swap_to_artifact(path: str) -> ModelVersion:
+    """
+    Watcher hot-swap: load and activate `path`, publish it as the shared active version and
+    retire the version it replaces (unless that is the canary), so frequent retrains do not keep
+    every old model, its scheduler thread and its cache rows resident.
+    """
+    previous = registry.active.version if registry.active is not None else None
+    entry = reload_model(path)
+    if previous is None or previous == entry.version:
+        return entry
+    keep = registry.canary is not None and registry.canary.version == previous
+    db = database.SessionLocal()
+    try:
+        model_deployment.record(db, entry.version, os.path.abspath(path), entry.runtime)
+        model_deployment.set_active(db, entry.version)
+        if not keep:
+            model_deployment.retire(db, previous)
+        sync_routing(db)
+    except Exception as e:
+        print(f"[cnn_predictor] model watcher: could not publish {entry.version}: {e}")
+        if not keep and previous in registry:
+            _unload_local(previous)
+    finally:
+        db.close()
+    return entry
+
+def _watch_loop():
+    last = None
+    while True:
+        time.sleep(MODEL_WATCH_SECONDS)
+        try:
+            path = _find_candidate_path()
+            if path is None:
+                continue
+            st = os.stat(path)
+            sig = (path, st.st_mtime, st.st_size)
+            if last is not None and sig != last:
+                _swap_to_artifact(path)
+            last = sig
+        except Exception as e:
+            print(f"[cnn_predictor] model watcher: {e}")
+
+_ready = threading.Event()
+_readiness = {"state": "not_started", "error": None, "warmup_seconds": None}
+
+def startup(batch_sizes: Optional[List[int]] = None) -> bool:
+    """
+    Load the model and run one dummy forward pass per warm-up batch size, then mark the
+    predictor ready. Returns True when ready; failures are recorded in readiness().
+    """
+    _readiness.update(state="loading", error=None)
+    t0 = time.perf_counter()
+    try:
+        _lazy_load_model()
+        try:
+            _publish_startup_model()
+        except Exception as e:
+            print(f"[cnn_predictor] model routing unavailable, serving the local model: {e}")
+        model = registry.active.model
+        _readiness["state"] = "warming_up"
+        _warm_up(model, batch_sizes)
+        if SCHEDULER_ENABLED:
+            get_scheduler()
+    except Exception as e:
+        _ready.clear()
+        _readiness.update(state="failed", error=str(e))
+        print(f"[cnn_predictor] startup failed: {e}")
+        return False
+    _readiness.update(state="ready", warmup_seconds=round(time.perf_counter() - t0, 3))
+    _ready.set()
+    print(f"[cnn_predictor] ready ({registry.active.runtime}) after {_readiness['warmup_seconds']}s")
+    if MODEL_WATCH_SECONDS > 0:
+        threading.Thread(target=_watch_loop, name="cnn-model-watch", daemon=True).start()
+    if ROUTING_POLL_SECONDS > 0:
+        threading.Thread(target=_routing_loop, name="cnn-model-routing", daemon=True).start()
+    return True
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+def readiness() -> dict:
+    """Snapshot of the predictor state for health/readiness endpoints."""
+    active = registry.active
+    return {
+        **_readiness,
+        "ready": is_ready(),
+        "runtime": active.runtime if active else None,
+        "model_path": active.path if active else None,
+        "model_version": active.version if active else None,
+    }
+
+# one scheduler per loaded model version, so batches never mix versions
+_schedulers = {}
+
+def get_scheduler(entry: Optional[ModelVersion] = None) -> InferenceScheduler:
+    """Return the inference scheduler for `entry` (default: active version), starting it on first use."""
+    if entry is None:
+        _lazy_load_model()
+        entry = registry.active
+    sched = _schedulers.get(entry.version)
+    if sched is None:
+        model = entry.model
+        sched = _schedulers.setdefault(entry.version, InferenceScheduler(
+            lambda batch: model.predict(batch, batch_size=len(batch), verbose=0),
+            max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+            max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+            name=f"cnn-inference-{entry.version}",
+        ))
+    sched.start()
+    return sched
+
+def shutdown_scheduler():
+    for sched in list(_schedulers.values()):
+        sched.stop()
+
+# --- Metrics (exported by GET /metrics, see metrics.py) ---
+# discovery, cache, decode, preprocess (decode/preprocess summed over pool workers), inference,
+# aggregation, db_write
+STAGE_SECONDS = metrics.histogram(
+    "cnn_analysis_stage_seconds", "Time spent per analysis pipeline stage", labelnames=("stage",))
+ANALYSIS_SECONDS = metrics.histogram(
+    "cnn_analysis_seconds", "End-to-end analyze_case duration", labelnames=("outcome",))
+SLICES_SCORED = metrics.counter("cnn_slices_scored_total", "Slices whose CNN output was used")
+
+# kept under its historical name; the implementation lives in preprocessing.py
+_preprocess_from_path = preprocessing.preprocess_from_path
+
+def _predict_filepaths(model, filepaths: List[str], max_batch_size: Optional[int] = None,
+                       timings: Optional[metrics.Timings] = None):
+    """
+    Preprocess `filepaths` (in parallel, see preprocessing.iter_preprocessed) and score them
+    with batched forward passes. Slices are stacked into tensors of at most `max_batch_size`
+    images (defaults to MAX_BATCH_SIZE). Returns a list of (filepath, probs) tuples in input
+    order; files that cannot be read or preprocessed are skipped. Stage times go to `timings`.
+    """
+    timings = timings or metrics.Timings()
+    batch_size = max(1, int(max_batch_size or MAX_BATCH_SIZE))
+    results = []
+    # one preallocated buffer per call, reused for every chunk of the series
+    buf = preprocessing.BatchBuffer(min(batch_size, max(1, len(filepaths))))
+
+    def _flush():
+        if not len(buf):
+            return
+        try:
+            with timings.timed("inference"):
+                try:
+                    preds = model.predict(buf.view(), batch_size=len(buf), verbose=0)
+                except SchedulerClosed:
+                    # the version was unloaded mid-analysis: finish on its model, unbatched
+                    preds = model.predict_fn(buf.view())
+            # preds shape (batch, num_classes)
+            preds = np.asarray(preds).reshape(len(buf), -1)
+            results.extend(zip(buf.paths, preds))
+        except Exception as e:
+            print(f"[cnn_predictor] failed to predict batch of {len(buf)} images: {e}")
+            traceback.print_exc()
+        buf.reset()
+
+    # decoding runs ahead on the preprocessing pool while batches are being scored
+    for fp, slice_2d in preprocessing.iter_preprocessed(filepaths, buffer=buf, timings=timings.seconds):
+        buf.add(fp, slice_2d)
+        if buf.full():
+            _flush()
+    _flush()
+    return results
 
 def _get_image_filepaths_for_case(db: Session, case_id: str) -> List[str]:
     """
@@ -79,7 +428,9 @@ def _get_image_filepaths_for_case(db: Session, case_id: str) -> List[str]:
     filepaths = []
     for im in imgs:
         # im.file_path is like '/uploads/<filename>' or may be None; fallback to filename
-        if getattr(im, "file_path", None):
+        if getattr(im, "file_path", None) and im.file_path.startswith("/uploads/"):
+            abs_path = os.path.join(UPLOAD_DIR, *im.file_path[len("/uploads/"):].split("/"))
+        elif getattr(im, "file_path", None):
             rel = im.file_path.lstrip("/")
             abs_path = os.path.join(os.path.dirname(__file__), rel)
         else:
@@ -88,13 +439,85 @@ def _get_image_filepaths_for_case(db: Session, case_id: str) -> List[str]:
             filepaths.append(abs_path)
     return filepaths
 
-def analyze_case(case_id: str, provided_db: Optional[Session] = None):
+def _score_slices(db: Session, model, model_version: str, keys: List[str],
+                  timings: Optional[metrics.Timings] = None) -> dict:
+    """
+    Return {slice key: probs} for `keys`, reusing cached per-slice outputs of `model_version`
+    and scoring only the misses (then caching them). Unreadable slices are left out.
+    """
+    timings = timings or metrics.Timings()
+    use_cache = prediction_cache.ENABLED
+    hashes = {}
+    cached = {}
+    if use_cache:
+        try:
+            with timings.timed("cache"):
+                hashes = prediction_cache.pixel_hashes(keys)
+                cached = prediction_cache.get_many(db, hashes.values(), model_version)
+        except Exception as e:
+            print(f"[cnn_predictor] prediction cache lookup failed: {e}")
+            hashes, cached = {}, {}
+    to_score = [k for k in keys if hashes.get(k) not in cached]
+    if use_cache:
+        print(f"[cnn_predictor] cache: {len(keys) - len(to_score)} hits, {len(to_score)} misses")
+
+    # Predict remaining images with batched forward passes
+    scored = dict(_predict_filepaths(model, to_score, timings=timings)) if to_score else {}
+
+    out = {}
+    for k in keys:
+        if k in scored:
+            out[k] = scored[k]
+        elif hashes.get(k) in cached:
+            out[k] = np.asarray(cached[hashes[k]], dtype=np.float32)
+
+    if use_cache and scored:
+        try:
+            with timings.timed("db_write"):
+                prediction_cache.put_many(db, {hashes.get(k): pred for k, pred in scored.items()}, model_version)
+                if prediction_cache.prune_due():
+                    prediction_cache.prune(db, model_deployment.retired(db))
+                db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"[cnn_predictor] prediction cache update failed: {e}")
+    return out
+
+def _verdict_stable(p0: List[float]) -> bool:
+    """True when the running mean of P(class 0) is confidently on one side of 0.5."""
+    n = len(p0)
+    if n < max(2, EARLY_EXIT_MIN_SLICES):
+        return False
+    mean = float(np.mean(p0))
+    sem = float(np.std(p0, ddof=1)) / np.sqrt(n)
+    return abs(mean - 0.5) - EARLY_EXIT_Z * sem >= EARLY_EXIT_MARGIN
+
+def _score_adaptive(db: Session, model, model_version: str, groups: List[List[str]],
+                    timings: Optional[metrics.Timings] = None) -> dict:
+    """
+    Like _score_slices over all keys of `groups`, but in batches of EARLY_EXIT_BATCH visited
+    in series.interleave order, stopping as soon as _verdict_stable holds.
+    """
+    order = series.interleave(groups)
+    step = max(1, EARLY_EXIT_BATCH)
+    preds = {}
+    for i in range(0, len(order), step):
+        preds.update(_score_slices(db, model, model_version, order[i:i + step], timings))
+        if i + step < len(order) and _verdict_stable([float(p[0]) for p in preds.values()]):
+            print(f"[cnn_predictor] early exit after {len(preds)}/{len(order)} slices")
+            break
+    return preds
+
+def analyze_case(case_id: str, provided_db: Optional[Session] = None, raise_errors: bool = False):
     """
     Analyze a case: load images, run model, update case.cnn_prediction and case.status.
     This function can be scheduled as a background task. It will open its OWN DB session
-    if provided_db is None or is not usable.
+    if provided_db is None or is not usable. With raise_errors=True unexpected exceptions are
+    re-raised after logging (used by analysis_worker to retry the job).
     """
     start_time = time.time()
+    timings = metrics.Timings()
+    outcome = "error"
     print(f"[cnn_predictor] analyze_case started for case {case_id}")
 
     # Obtain a DB session: prefer creating a new session rather than reusing web-request session
@@ -134,7 +557,8 @@ def analyze_case(case_id: str, provided_db: Optional[Session] = None):
         import models as models_module
 
         # Fetch image filepaths
-        filepaths = _get_image_filepaths_for_case(db, case_id)
+        with timings.timed("discovery"):
+            filepaths = _get_image_filepaths_for_case(db, case_id)
         if not filepaths:
             print(f"[cnn_predictor] No image files found for case {case_id}. Marking as analyzed=no_images.")
             case = db.query(models_module.MedicalCase).filter(models_module.MedicalCase.id == case_id).first()
@@ -142,26 +566,37 @@ def analyze_case(case_id: str, provided_db: Optional[Session] = None):
                 case.cnn_prediction = "no_images"
                 case.status = "analyzed"
                 db.commit()
+            outcome = "no_images"
             return
 
-        # load model
-        model = _lazy_load_model()
+        # pick the model version for this case (active, or the canary for its share of traffic);
+        # when enabled, route forward passes through that version's shared scheduler so
+        # concurrent cases are batched together instead of contending for the runtime
+        model_entry = choose_model()
+        model_version = model_entry.version
+        model = get_scheduler(model_entry) if SCHEDULER_ENABLED else model_entry.model
 
-        # Predict per image
-        probs_list = []
-        labels_list = []
-        for fp in filepaths:
-            try:
-                x = _preprocess_from_path(fp)
-                pred = model.predict(x)
-                # pred shape (1, num_classes)
-                pred = np.asarray(pred).reshape(-1)
-                probs_list.append(pred.tolist())
-                labels_list.append(int(np.argmax(pred)))
-            except Exception as e:
-                print(f"[cnn_predictor] failed to predict {fp}: {e}")
-                traceback.print_exc()
-                continue
+        # Which slices to score, grouped so that aggregation can weigh each series equally
+        if INFERENCE_MODE == "series":
+            with timings.timed("discovery"):
+                volumes = series.discover(filepaths)
+            groups = [[s.key for s in series.sample(v.slices)] for v in volumes]
+            n_slices_total = sum(len(v.slices) for v in volumes)
+            print(f"[cnn_predictor] {len(volumes)} series, scoring "
+                  f"{sum(len(g) for g in groups)}/{n_slices_total} slices")
+        else:
+            # every slice of the case; multi-frame files are expanded to their frames
+            with timings.timed("discovery"):
+                groups = [series.slice_keys(filepaths)]
+            n_slices_total = len(groups[0])
+        keys = [k for g in groups for k in g]
+
+        if EARLY_EXIT_ENABLED:
+            preds = _score_adaptive(db, model, model_version, groups, timings)
+        else:
+            preds = _score_slices(db, model, model_version, keys, timings)
+        probs_by_group = [[preds[k] for k in g if k in preds] for g in groups]
+        probs_list = [p for g in probs_by_group for p in g]
 
         if not probs_list:
             print(f"[cnn_predictor] Could not compute predictions for any image in case {case_id}")
@@ -170,10 +605,12 @@ def analyze_case(case_id: str, provided_db: Optional[Session] = None):
                 case.cnn_prediction = "pred_failed"
                 case.status = "analyzed"
                 db.commit()
+            outcome = "pred_failed"
             return
 
-        # average probabilities across images
-        avg_probs = np.mean(np.array(probs_list), axis=0)  # e.g. [p_malade, p_sain]
+        # combine probabilities across images (per series first in series mode)
+        with timings.timed("aggregation"):
+            avg_probs = series.aggregate_groups(probs_by_group)  # e.g. [p_malade, p_sain]
         predicted_index = int(np.argmax(avg_probs))
         # Map index to label consistent with your training mapping: earlier you used ["Malade","Sain"]
         label_map = ["Malade", "Sain"]
@@ -185,6 +622,9 @@ def analyze_case(case_id: str, provided_db: Optional[Session] = None):
         case = db.query(models_module.MedicalCase).filter(models_module.MedicalCase.id == case_id).first()
         if case:
             case.cnn_prediction = predicted_label
+            case.cnn_model_version = model_version
+            case.cnn_slices_scored = len(probs_list)
+            case.cnn_slices_total = n_slices_total
             # numeric fields (may require migration to exist)
             try:
                 case.cnn_prediction_num = predicted_prob
@@ -196,16 +636,27 @@ def analyze_case(case_id: str, provided_db: Optional[Session] = None):
                 pass
             case.status = "analyzed"
             case.updated_at = database.datetime.utcnow() if hasattr(database, "datetime") else None
-            db.commit()
+            if STORE_TIMINGS:
+                # db_write of this very commit cannot be included
+                case.cnn_timings = json.dumps(timings.as_dict())
+            with timings.timed("db_write"):
+                db.commit()
             print(f"[cnn_predictor] case {case_id} updated: {case.cnn_prediction}:{predicted_prob:.4f}")
 
+        outcome = "ok"
+        SLICES_SCORED.inc(len(probs_list))
         elapsed = time.time() - start_time
-        print(f"[cnn_predictor] analyze_case finished for {case_id} in {elapsed:.1f}s")
+        stages = ", ".join(f"{k}={v:.2f}s" for k, v in timings.as_dict(2).items())
+        print(f"[cnn_predictor] analyze_case finished for {case_id} in {elapsed:.1f}s ({stages})")
 
     except Exception as e:
         print("[cnn_predictor] Exception in analyze_case:", e)
         traceback.print_exc()
+        if raise_errors:
+            raise
     finally:
+        timings.observe_into(STAGE_SECONDS)
+        ANALYSIS_SECONDS.observe(time.time() - start_time, outcome=outcome)
         # close session if we created one here
         try:
             if new_session_created and db is not None:
@@ -0,0 +1,92 @@
+# backend/http_cache.py
+"""HTTP caching for uploaded DICOMs and their previews.
+
+Content-addressed blobs (/uploads/blobs/.../<sha256>.dcm) never change, so they get their hash
+as a strong ETag and an immutable, year-long Cache-Control. Previews are keyed by the same hash
+plus size, window preset, format and previews.RENDER_VERSION; they may be re-rendered when the rendering
+changes, so browsers keep them for PREVIEW_CACHE_SECONDS and then revalidate (a 304 costs no
+disk read). Anything else (legacy flat uploads) is revalidated on every use against
+Starlette's mtime/size ETag. `If-None-Match` is answered with 304, and Range / If-Range
+requests (resuming or seeking in large DICOM downloads) are served by Starlette's FileResponse.
+Patient data: caching is `private`, never in shared proxies. Dot-directories of the uploads
+folder (partial uploads in `.incoming`, resumable-upload chunks in `.sessions`) are never served.
+"""
+import os
+from typing import Optional
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+
+import blob_store
+import previews
+
+IMMUTABLE = "private, max-age=31536000, immutable"
+REVALIDATE = "private, no-cache"
+PREVIEW_CACHE_SECONDS = int(os.getenv("PREVIEW_CACHE_SECONDS", "86400"))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 9110 weak comparison of If-None-Match against our ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+
+
+def blob_headers(path: str) -> dict:
+    sha = blob_store.hash_for_path(path)
+    if not sha:
+        return {"cache-control": REVALIDATE}
+    return {"etag": f'"{sha}"', "cache-control": IMMUTABLE}
+
+
+def preview_headers(path: str, key: str, size: str, exact: bool, preset: str = previews.DEFAULT_PRESET) -> dict:
+    if not exact:
+        # a stand-in size while the requested one renders: do not let it stick
+        return {"cache-control": "no-store"}
+    if not blob_store.is_hash(key):
+        return {"cache-control": REVALIDATE}
+    fmt = os.path.splitext(path)[1].lstrip(".")
+    return {
+        "etag": f'"{key}.{size}.{preset}.{fmt}.r{previews.RENDER_VERSION}"',
+        "cache-control": f"private, max-age={PREVIEW_CACHE_SECONDS}",
+    }
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers={k: v for k, v in headers.items() if k in ("etag", "cache-control")})
+
+
+def bytes_response(request_headers, data: bytes, headers: dict, media_type: Optional[str] = None) -> Response:
+    """file_response for content already in memory (preview_cache.py)."""
+    etag = headers.get("etag")
+    if etag and etag_matches(request_headers.get("if-none-match"), etag):
+        return not_modified(headers)
+    return Response(content=data, media_type=media_type, headers=headers)
+
+
+def file_response(request_headers, path: str, headers: dict, media_type: Optional[str] = None) -> Response:
+    """FileResponse with our caching headers, or 304 when the client already has this version."""
+    etag = headers.get("etag")
+    if etag and etag_matches(request_headers.get("if-none-match"), etag):
+        return not_modified(headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles for the uploads folder with the caching headers above."""
+
+    def lookup_path(self, path: str):
+        # private working areas (and any other dot-file) answer 404, like a missing file
+        if any(part.startswith(".") for part in path.replace("\\", "/").split("/")):
+            return "", None
+        return super().lookup_path(path)
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        headers = blob_headers(str(full_path))
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return not_modified(dict(response.headers))
+        return response
@@ -0,0 +1,172 @@
+# backend/inference_scheduler.py
+"""In-process micro-batching scheduler for CNN inference.
+
+Concurrent analyses (each running `cnn_predictor.analyze_case` in its own thread) submit their
+preprocessed slices here instead of calling the Keras model directly. A single worker thread
+drains the queue, waits up to `max_wait_ms` for more work or until `max_batch_size` slices are
+pending, runs ONE forward pass over everything it collected and hands each caller back its rows.
+
+A stopped scheduler is closed for good: requests queued before `stop` are still run, later
+submits raise SchedulerClosed (callers fall back to `predict_fn`), and nothing is left pending.
+"""
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+import numpy as np
+
+
+class SchedulerClosed(RuntimeError):
+    """Raised by `submit` once the scheduler has been stopped."""
+
+
+class _Request:
+    __slots__ = ("x", "future", "enqueued_at")
+
+    def __init__(self, x: np.ndarray):
+        self.x = x
+        self.future: Future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Collect pending inference requests from many callers and run them as shared batches.
+
+    `predict_fn` receives a float32 array shaped (n, H, W, C) and must return an array shaped
+    (n, num_classes). It is only called from the scheduler's worker thread while the scheduler
+    is open.
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray], max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "cnn-inference"):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._carry: Optional[_Request] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        # simple counters, handy for logs and health checks
+        self.batches_run = 0
+        self.items_run = 0
+
+    # --- lifecycle ---
+    def start(self):
+        with self._lock:
+            self._start_locked()
+
+    def _start_locked(self):
+        if self._closed or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        """Close the scheduler: requests already queued are run, later submits are rejected."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                # under the lock, so every accepted request is queued ahead of the sentinel
+                self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def pending(self) -> int:
+        """Approximate number of requests waiting for a forward pass."""
+        return self._queue.qsize() + (1 if self._carry is not None else 0)
+
+    # --- client API ---
+    def submit(self, x: np.ndarray) -> Future:
+        """Queue a (n, H, W, C) batch; the returned future resolves to its (n, num_classes) output."""
+        req = _Request(np.asarray(x, dtype=np.float32))
+        with self._lock:
+            if self._closed:
+                raise SchedulerClosed(f"{self.name} is stopped")
+            self._start_locked()
+            self._queue.put(req)
+        return req.future
+
+    def predict(self, x: np.ndarray, batch_size: Optional[int] = None, verbose: int = 0) -> np.ndarray:
+        """Blocking, Keras-compatible entry point so the scheduler can stand in for the model."""
+        return self.submit(x).result()
+
+    # --- worker ---
+    def _collect(self, first: _Request):
+        batch = [first]
+        count = len(first.x)
+        deadline = time.perf_counter() + self.max_wait
+        while count < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if req is None:
+                # shutdown sentinel: finish this batch, then let the worker exit
+                self._queue.put(None)
+                break
+            if count + len(req.x) > self.max_batch_size:
+                # keep it for the next round rather than overshooting the batch size
+                self._carry = req
+                break
+            batch.append(req)
+            count += len(req.x)
+        return batch
+
+    def _run(self, batch):
+        try:
+            stacked = batch[0].x if len(batch) == 1 else np.concatenate([r.x for r in batch], axis=0)
+            out = np.asarray(self.predict_fn(stacked))
+            out = out.reshape(len(stacked), -1)
+        except Exception as e:
+            print(f"[inference_scheduler] batch of {len(batch)} requests failed: {e}")
+            traceback.print_exc()
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+            return
+        self.batches_run += 1
+        self.items_run += len(stacked)
+        offset = 0
+        for r in batch:
+            n = len(r.x)
+            r.future.set_result(out[offset:offset + n])
+            offset += n
+
+    def _worker(self):
+        while True:
+            if self._carry is not None:
+                first, self._carry = self._carry, None
+            else:
+                first = self._queue.get()
+            if first is None:
+                break
+            self._run(self._collect(first))
+        self._fail_pending()
+
+    def _fail_pending(self):
+        # nothing should be left once the sentinel is read; never leave a caller waiting forever
+        while True:
+            try:
+                req = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if req is not None and not req.future.done():
+                req.future.set_exception(SchedulerClosed(f"{self.name} is stopped"))
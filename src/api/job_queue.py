@@ -0,0 +1,198 @@
+# backend/job_queue.py
+"""Durable analysis job queue stored in the `analysis_jobs` table.
+
+Jobs survive API restarts and can be consumed by any number of worker processes
+(see analysis_worker.py). Claiming is an optimistic conditional UPDATE, so two workers never
+run the same job; a job whose worker died is released once its lease expires and counts as a
+failed attempt (requeued with the same backoff as `fail`, or failed when out of attempts). A worker keeps
+its lease alive with `heartbeat` while it runs, and `complete` / `fail` only write if the job is
+still held under the same claim (worker id and attempt number), so a worker that lost its lease
+never overwrites the outcome of the one that re-claimed the job. Failures are
+retried with exponential backoff until `max_attempts` is reached.
+
+Enqueueing only reuses a job that is still queued: a running job has already listed its case's
+slices, so slices added meanwhile need a new job. That job is not claimed while the running one
+still holds a live lease on the same case, so one case is never analyzed twice concurrently.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import Session, aliased
+
+import metrics
+import models
+
+MAX_ATTEMPTS = int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "3"))
+BACKOFF_SECONDS = float(os.getenv("ANALYSIS_BACKOFF_SECONDS", "5"))
+LEASE_SECONDS = float(os.getenv("ANALYSIS_LEASE_SECONDS", "600"))
+HEARTBEAT_SECONDS = float(os.getenv("ANALYSIS_HEARTBEAT_SECONDS", str(LEASE_SECONDS / 4)))
+
+JOB_WAIT_SECONDS = metrics.histogram("analysis_job_wait_seconds", "Time a job was runnable before a worker claimed it")
+
+# set on enqueue so in-process workers don't wait for their next poll
+_wakeup = threading.Event()
+
+
+def enqueue(db: Session, case_id: str, commit: bool = True) -> models.AnalysisJob:
+    """Queue an analysis for `case_id`, reusing a job that is still queued (not one already running)."""
+    Job = models.AnalysisJob
+    job = db.query(Job).filter(Job.case_id == case_id, Job.status == "queued").first()
+    if job is None:
+        job = Job(case_id=case_id, status="queued", max_attempts=MAX_ATTEMPTS, run_after=datetime.utcnow())
+        db.add(job)
+    if commit:
+        db.commit()
+        notify()
+    return job
+
+
+def notify():
+    """Wake idle in-process workers; call after committing a job enqueued with commit=False."""
+    _wakeup.set()
+
+
+def _claimable(now: datetime):
+    Job = models.AnalysisJob
+    lease_start = now - timedelta(seconds=LEASE_SECONDS)
+    Other = aliased(Job)
+    # another job of the same case is being run under a live lease: wait for it to finish
+    case_busy = exists().where(
+        Other.case_id == Job.case_id, Other.id != Job.id, Other.status == "running", Other.locked_at >= lease_start,
+    )
+    return and_(Job.status == "queued", Job.run_after <= now, ~case_busy)
+
+
+def _retry_values(attempts: int, max_attempts: int, error: str, now: datetime) -> dict:
+    """Columns recording a failed attempt: requeued with exponential backoff, or failed when exhausted."""
+    Job = models.AnalysisJob
+    values = {Job.last_error: (error or "")[:2000], Job.locked_by: None, Job.updated_at: now}
+    if (attempts or 0) >= (max_attempts or MAX_ATTEMPTS):
+        values[Job.status] = "failed"
+    else:
+        values[Job.status] = "queued"
+        values[Job.run_after] = now + timedelta(seconds=BACKOFF_SECONDS * 2 ** max(0, (attempts or 1) - 1))
+    return values
+
+
+def release_expired(db: Session, now: Optional[datetime] = None) -> int:
+    """Treat running jobs whose lease expired (their worker is gone) as failed attempts."""
+    Job = models.AnalysisJob
+    now = now or datetime.utcnow()
+    lease_start = now - timedelta(seconds=LEASE_SECONDS)
+    expired = db.query(Job.id, Job.locked_by, Job.attempts, Job.max_attempts).filter(
+        Job.status == "running", Job.locked_at < lease_start,
+    ).all()
+    released = 0
+    for job_id, worker_id, attempts, max_attempts in expired:
+        error = f"lease of worker {worker_id} expired (attempt {attempts})"
+        # still expired under the same claim: a late heartbeat or result wins over the release
+        released += db.query(Job).filter(_held(job_id, worker_id, attempts), Job.locked_at < lease_start).update(
+            _retry_values(attempts, max_attempts, error, now), synchronize_session=False,
+        )
+    if expired:
+        db.commit()
+    if released:
+        print(f"[job_queue] released {released} job(s) with an expired lease")
+    return released
+
+
+def claim(db: Session, worker_id: str) -> Optional[models.AnalysisJob]:
+    """Atomically take the next runnable job for `worker_id`, or return None."""
+    Job = models.AnalysisJob
+    now = datetime.utcnow()
+    release_expired(db, now)
+    candidates = db.query(Job.id).filter(_claimable(now)).order_by(Job.run_after, Job.created_at).limit(5).all()
+    for (job_id,) in candidates:
+        claimed = db.query(Job).filter(Job.id == job_id, _claimable(now)).update(
+            {
+                Job.status: "running",
+                Job.locked_by: worker_id,
+                Job.locked_at: now,
+                Job.attempts: Job.attempts + 1,
+                Job.updated_at: now,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        if claimed == 1:
+            job = db.query(Job).filter(Job.id == job_id).first()
+            # plain (unmapped) attribute: survives the session expiring the row, unlike locked_by
+            job.claim = (worker_id, job.attempts)
+            if job.run_after is not None:
+                JOB_WAIT_SECONDS.observe(max(0.0, (now - job.run_after).total_seconds()))
+            return job
+    return None
+
+
+def _held(job_id: str, worker_id: str, attempt: int):
+    """Filter matching the job only while it is still running under this claim."""
+    Job = models.AnalysisJob
+    return and_(Job.id == job_id, Job.status == "running", Job.locked_by == worker_id, Job.attempts == attempt)
+
+
+def _update_held(db: Session, job: models.AnalysisJob, values: dict) -> bool:
+    Job = models.AnalysisJob
+    worker_id, attempt = getattr(job, "claim", None) or (job.locked_by, job.attempts)
+    updated = db.query(Job).filter(_held(job.id, worker_id, attempt)).update(values, synchronize_session=False)
+    db.commit()  # expires `job`, so it reflects the row as written (or as the new owner left it)
+    if updated != 1:
+        print(f"[job_queue] job {job.id} is no longer held by this worker (lease lost), result not recorded")
+    return updated == 1
+
+
+def heartbeat(db: Session, job_id: str, worker_id: str, attempt: int) -> bool:
+    """Renew the lease of a running job; False when it was lost (re-claimed or finished elsewhere)."""
+    Job = models.AnalysisJob
+    updated = db.query(Job).filter(_held(job_id, worker_id, attempt)).update(
+        {Job.locked_at: datetime.utcnow()}, synchronize_session=False,
+    )
+    db.commit()
+    return updated == 1
+
+
+def complete(db: Session, job: models.AnalysisJob) -> bool:
+    Job = models.AnalysisJob
+    return _update_held(db, job, {
+        Job.status: "done",
+        Job.last_error: None,
+        Job.locked_by: None,
+        Job.updated_at: datetime.utcnow(),
+    })
+
+
+def fail(db: Session, job: models.AnalysisJob, error: str) -> bool:
+    """Record a failure; requeue with exponential backoff unless attempts are exhausted."""
+    return _update_held(db, job, _retry_values(job.attempts, job.max_attempts, error, datetime.utcnow()))
+
+
+def queue_depth(db: Session) -> int:
+    Job = models.AnalysisJob
+    return db.query(Job).filter(Job.status.in_(["queued", "running"])).count()
+
+
+def latest_for_case(db: Session, case_id: str) -> Optional[models.AnalysisJob]:
+    Job = models.AnalysisJob
+    return db.query(Job).filter(Job.case_id == case_id).order_by(Job.created_at.desc()).first()
+
+
+def describe(job: models.AnalysisJob) -> dict:
+    return {
+        "job_id": job.id,
+        "case_id": job.case_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "last_error": job.last_error,
+        "run_after": job.run_after,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
+
+
+def wait_for_work(timeout: float):
+    """Sleep until something is enqueued in this process or `timeout` elapses."""
+    _wakeup.wait(timeout)
+    _wakeup.clear()
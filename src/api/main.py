@@ -1,10 +1,10 @@
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form
-from fastapi.staticfiles import StaticFiles
-import shutil
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Form, Request
+from starlette.routing import Mount
 import uuid as _uuid
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from fastapi.responses import FileResponse, RedirectResponse
+from fastapi.responses import JSONResponse, Response
+from fastapi.responses import RedirectResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
 from datetime import date as _date
@@ -12,6 +12,8 @@ import jwt
 import os
 from typing import List, Optional
 import asyncio
+import threading
+import time
 from pydantic import BaseModel, EmailStr
 import database
 import models
@@ -19,6 +21,16 @@ import schemas
 import auth
 
 import cnn_predictor as cnn_predictor
+import job_queue
+import analysis_worker
+import upload_ingest
+import blob_store
+import upload_sessions
+import metrics
+import previews
+import preview_cache
+import model_deployment
+import http_cache
 import sys
 import os
 import logging
@@ -52,6 +64,80 @@ database.init_db()
 app = FastAPI(title="MediDiagnose API", version="1.0.0")
 
 
+@app.on_event("startup")
+def _start_cnn_predictor():
+    # Load + warm up the CNN off the event loop; /ready reports progress until it is done.
+    threading.Thread(target=cnn_predictor.startup, name="cnn-startup", daemon=True).start()
+
+
+# Worker threads consuming the durable analysis queue inside the API process. Set to 0 when
+# dedicated `python analysis_worker.py` processes are deployed.
+ANALYSIS_INPROCESS_WORKERS = int(os.getenv("ANALYSIS_INPROCESS_WORKERS", "1"))
+_analysis_workers_stop = None
+
+
+@app.on_event("startup")
+def _start_preview_backfill():
+    # render previews of uploads that predate them (or whose render was lost) without an operator step
+    if previews.PREVIEW_BACKFILL_ON_STARTUP:
+        threading.Thread(target=previews.backfill, args=(UPLOAD_DIR,), name="preview-backfill", daemon=True).start()
+
+
+@app.on_event("startup")
+def _start_analysis_workers():
+    global _analysis_workers_stop
+    _analysis_workers_stop = analysis_worker.start_background_workers(ANALYSIS_INPROCESS_WORKERS)
+
+
+# Blobs of rejected uploads and deleted images that were still inside GC_GRACE_SECONDS when
+# released, crash leftovers and expired upload sessions are collected this often (0 = only
+# through POST /admin/storage/gc).
+STORAGE_GC_INTERVAL_SECONDS = float(os.getenv("STORAGE_GC_INTERVAL_SECONDS", "900"))
+_storage_gc_stop = threading.Event()
+
+
+def _collect_storage(db: Session) -> dict:
+    result = blob_store.sweep(db, UPLOAD_DIR)
+    result["upload_sessions_expired"] = upload_sessions.expire(db, UPLOAD_DIR)
+    return result
+
+
+def _storage_gc_loop(stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        db = database.SessionLocal()
+        try:
+            result = _collect_storage(db)
+            if result["blobs_removed"] or result["partials_removed"] or result["upload_sessions_expired"]:
+                print(f"[storage] periodic GC: {result}")
+        except Exception as e:
+            print(f"[storage] periodic GC failed: {e}")
+        finally:
+            db.close()
+
+
+@app.on_event("startup")
+def _start_storage_gc():
+    if STORAGE_GC_INTERVAL_SECONDS > 0:
+        threading.Thread(
+            target=_storage_gc_loop, args=(_storage_gc_stop, STORAGE_GC_INTERVAL_SECONDS), name="storage-gc", daemon=True,
+        ).start()
+
+
+@app.on_event("shutdown")
+def _stop_inference_scheduler():
+    # let the shared CNN worker finish its current batch before the process exits
+    try:
+        _storage_gc_stop.set()
+        if _analysis_workers_stop is not None:
+            _analysis_workers_stop.set()
+        cnn_predictor.shutdown_scheduler()
+        cnn_predictor.preprocessing.shutdown_pool()
+        previews.shutdown()
+        preview_cache.shutdown()
+    except Exception:
+        pass
+
+
 def _coerce_prediction_value(val):
     """Coerce stored prediction value into a float or None.
 
@@ -72,78 +158,98 @@ def _coerce_prediction_value(val):
 # Ensure uploads directory exists and serve it
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 
 @app.get('/uploads/previews/{filename}')
-def preview_png(filename: str):
-    """Return or generate a PNG preview for a .dcm file stored in uploads.
-    Example: GET /uploads/previews/96d789811d1a41c98a06bd95cacff857.png
-    This will look for uploads/96d789811d1a41c98a06bd95cacff857.dcm and generate a PNG under uploads/previews/.
+def preview_png(request: Request, filename: str, size: str = previews.DEFAULT_SIZE,
+                preset: str = previews.DEFAULT_PRESET):
+    """Serve the precomputed preview of a stored slice (see previews.py).
+    Example: GET /uploads/previews/<sha256>.png?size=thumb&preset=brain
+      (the stored name plus .png also works: <sha256>.dcm.png, <legacy>.dcm.png)
+      size: thumb, viewer, full; preset (window, see rendering.py): auto, percentile, full, brain, bone
+    Previews are rendered at ingest (other presets on first request); this never decodes a DICOM.
+    While a preview is still being rendered the nearest available size is served; if there is none
+    yet the render is queued and a placeholder image is returned at once with Cache-Control:
+    no-store (the <img> consumers never retry an error, so this always answers with an image, and
+    a request never holds a worker thread waiting for a render).
+    Conditional requests are answered with 304 (see http_cache.py). Recently served previews
+    come from an in-memory cache; the first slice of a case prefetches the others (preview_cache.py).
     """
     # disallow path traversal
-    if '..' in filename or filename.startswith('/'):
+    if '..' in filename or filename.startswith('/') or '/' in filename:
         raise HTTPException(status_code=400, detail='Invalid filename')
+    if size not in previews.SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {', '.join(previews.SIZES)}")
+    if preset not in previews.PRESETS:
+        raise HTTPException(status_code=400, detail=f"preset must be one of {', '.join(previews.PRESETS)}")
+
+    key = previews.key_for(filename)
+    cache_key = (UPLOAD_DIR, key, size, preset)
+    cached = preview_cache.CACHE.get(cache_key) if preview_cache.enabled() else None
+    if cached:
+        return http_cache.bytes_response(request.headers, cached.data, cached.headers, previews.media_type(cached.path))
+
+    found = previews.find(key, size, UPLOAD_DIR, preset)
+    if found:
+        return _serve_preview(request, key, size, preset, *found)
+
+    # not rendered (yet): queue it on the preview pool rather than decoding here
+    src = previews.source_for(key, UPLOAD_DIR)
+    if not src:
+        raise HTTPException(status_code=404, detail='DICOM file not found')
+    previews.schedule(key, src, UPLOAD_DIR, preset)
+    return Response(content=previews.placeholder(), media_type="image/png",
+                    headers={"cache-control": "no-store", "retry-after": "1"})
 
-    previews_dir = os.path.join(UPLOAD_DIR, 'previews')
-    os.makedirs(previews_dir, exist_ok=True)
-
-    # normalize requested png filename
-    if filename.lower().endswith('.png'):
-        png_name = filename
-        base_name = filename[:-4]
-    else:
-        png_name = f"{filename}.png"
-        base_name = filename
 
-    png_path = os.path.join(previews_dir, png_name)
+def _serve_preview(request: Request, key: str, size: str, preset: str, path: str, exact: bool):
+    headers = http_cache.preview_headers(path, key, size, exact, preset)
+    if exact and preview_cache.enabled():
+        preview_cache.prefetch_case(UPLOAD_DIR, key, size, preset, _case_preview_keys,
+                                    lambda other: _exact_preview(other, size, preset))
+        entry = preview_cache.load((UPLOAD_DIR, key, size, preset), path, headers)
+        if entry:
+            return http_cache.bytes_response(request.headers, entry.data, headers, previews.media_type(path))
+    return http_cache.file_response(request.headers, path, headers, media_type=previews.media_type(path))
 
-    # If preview already exists, return it
-    if os.path.exists(png_path):
-        return FileResponse(png_path, media_type='image/png')
 
-    # Locate the corresponding .dcm file
-    dcm_candidates = [
-        os.path.join(UPLOAD_DIR, base_name + '.dcm'),
-        os.path.join(UPLOAD_DIR, base_name),
-    ]
+def _preview_key(image: models.MRIImage) -> str:
+    """Key of an image's previews: its blob hash, or the file stem of a legacy upload."""
+    return image.content_hash or os.path.splitext(os.path.basename(image.file_path or image.filename or ''))[0]
 
-    dcm_path = None
-    for c in dcm_candidates:
-        if os.path.exists(c):
-            dcm_path = c
-            break
 
-    if not dcm_path:
-        raise HTTPException(status_code=404, detail='DICOM file not found')
-
-    # Generate PNG preview on-demand. Import heavy libs lazily to avoid import-time errors.
+def _case_preview_keys(key: str) -> List[str]:
+    """Preview keys of the case the slice `key` belongs to, in upload order."""
+    db = database.SessionLocal()
     try:
-        from pydicom import dcmread
-        from PIL import Image
-        import numpy as np
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Missing Python imaging dependencies: {e}. Install pydicom, pillow, numpy.")
+        image = db.query(models.MRIImage).filter(models.MRIImage.content_hash == key).first()
+        if image is None:
+            image = db.query(models.MRIImage).filter(models.MRIImage.file_path.endswith(f"/{key}.dcm")).first()
+        if image is None or not image.case_id:
+            return []
+        images = (
+            db.query(models.MRIImage)
+            .filter(models.MRIImage.case_id == image.case_id)
+            .order_by(models.MRIImage.uploaded_at, models.MRIImage.filename)
+            .all()
+        )
+        return [_preview_key(i) for i in images]
+    finally:
+        db.close()
 
-    try:
-        ds = dcmread(dcm_path)
-        arr = ds.pixel_array.astype(float)
-        # normalize to 0-255
-        if arr.max() == arr.min():
-            norm = np.zeros_like(arr, dtype='uint8')
-        else:
-            norm = ((arr - arr.min()) / (arr.max() - arr.min()) * 255.0).astype('uint8')
 
-        img = Image.fromarray(norm)
-        # ensure RGB for compatibility
-        if img.mode != 'RGB':
-            img = img.convert('L')
+def _exact_preview(key: str, size: str, preset: str):
+    """(path, headers) of the precomputed `size`/`preset` preview of `key`, or None."""
+    found = previews.find(key, size, UPLOAD_DIR, preset)
+    if not found or not found[1]:
+        return None
+    return found[0], http_cache.preview_headers(found[0], key, size, True, preset)
 
-        img.save(png_path)
-        return FileResponse(png_path, media_type='image/png')
-    except Exception as e:
-        # don't leak internals
-        raise HTTPException(status_code=500, detail=f"Failed to generate preview: {e}")
+
+# Mounted after the preview route: Starlette matches in registration order, so mounting first
+# would let the static files shadow /uploads/previews/...
+# Blobs are served with their hash as ETag and an immutable Cache-Control; Range is supported.
+app.mount("/uploads", http_cache.CachedStaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 
 # Compatibility fallback: some older frontend bundles request bare filenames like `/abcd1234.png`.
@@ -155,18 +261,21 @@ def redirect_bare_png(name: str):
     if '..' in name or name.startswith('/'):
         raise HTTPException(status_code=400, detail='Invalid filename')
 
-    previews_dir = os.path.join(UPLOAD_DIR, 'previews')
     png_name = f"{name}.png"
-    png_path = os.path.join(previews_dir, png_name)
+    name = previews.key_for(name)
 
     # If preview exists, redirect to it
-    if os.path.exists(png_path):
+    if previews.find(name, previews.DEFAULT_SIZE, UPLOAD_DIR):
         return RedirectResponse(url=f"/uploads/previews/{png_name}", status_code=307)
 
     # If no preview, but underlying .dcm exists, redirect to the original .dcm file
     dcm_path = os.path.join(UPLOAD_DIR, f"{name}.dcm")
     if os.path.exists(dcm_path):
         return RedirectResponse(url=f"/uploads/{name}.dcm", status_code=307)
+    blob_path = blob_store.find_blob(name, UPLOAD_DIR)
+    if blob_path:
+        rel = os.path.relpath(blob_path, UPLOAD_DIR).replace(os.sep, '/')
+        return RedirectResponse(url=blob_store.url_for(rel), status_code=307)
 
     # Not found
     raise HTTPException(status_code=404, detail='Preview not found')
@@ -180,6 +289,83 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ============= METRICS =============
+# Served by GET /metrics (see metrics.py). Routes are labelled by their template (/cases/{case_id}),
+# never by the raw path, to keep the number of series bounded.
+HTTP_REQUESTS = metrics.counter("http_requests_total", "HTTP requests handled", labelnames=("method", "route", "status"))
+HTTP_LATENCY = metrics.histogram("http_request_duration_seconds", "HTTP request latency", labelnames=("method", "route"))
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "HTTP requests being handled")
+QUEUE_JOBS = metrics.gauge("analysis_queue_jobs", "Analysis jobs by status", labelnames=("status",))
+DB_POOL = metrics.gauge("db_pool_connections", "SQLAlchemy connection pool state", labelnames=("state",))
+CHATBOT_SECONDS = metrics.histogram("chatbot_stage_seconds", "Chatbot latency per stage (index, retrieval, llm)", labelnames=("stage",))
+
+
+def _route_label(request: Request) -> str:
+    route = request.scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    # mounts (/uploads static files) do not set scope["route"]
+    for r in app.router.routes:
+        if isinstance(r, Mount) and request.url.path.startswith(r.path + "/"):
+            return r.path
+    return "<unmatched>"
+
+
+@app.middleware("http")
+async def _record_request_metrics(request: Request, call_next):
+    HTTP_IN_FLIGHT.inc()
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - t0
+        HTTP_IN_FLIGHT.dec()
+        route = _route_label(request)
+        HTTP_LATENCY.observe(elapsed, method=request.method, route=route)
+        HTTP_REQUESTS.inc(method=request.method, route=route, status=status_code)
+
+
+def _collect_runtime_metrics():
+    """Refresh the gauges that mirror shared state (queue table, connection pool) on each scrape."""
+    db = database.SessionLocal()
+    try:
+        counts = dict(
+            db.query(models.AnalysisJob.status, func.count(models.AnalysisJob.id))
+            .group_by(models.AnalysisJob.status).all()
+        )
+    finally:
+        db.close()
+    for status_name in ("queued", "running", "done", "failed"):
+        QUEUE_JOBS.set(counts.get(status_name, 0), status=status_name)
+    pool = database.engine.pool
+    for state in ("size", "checkedin", "checkedout", "overflow"):
+        fn = getattr(pool, state, None)
+        if callable(fn):
+            DB_POOL.set(fn(), state=state)
+
+
+metrics.add_collector(_collect_runtime_metrics)
+
+
+def _chatbot_answer(question: str, top_k: int = 5, require_context: bool = False):
+    """
+    Retrieve the chunks relevant to `question` and generate an answer, timing each stage. With
+    require_context=True returns None instead of calling the LLM when nothing matched.
+    """
+    if getattr(chatbot_service, 'faiss_index', None) is None:
+        with CHATBOT_SECONDS.time(stage="index"):
+            chatbot_service.build_faiss_index()
+    with CHATBOT_SECONDS.time(stage="retrieval"):
+        relevant = chatbot_service.search_relevant_chunks(question, top_k=top_k)
+    if require_context and not relevant:
+        return None
+    with CHATBOT_SECONDS.time(stage="llm"):
+        return chatbot_service.generate_chatbot_response(question, relevant)
+
+
 # ============= AUTH ROUTES =============
 
 @app.post("/auth/register")
@@ -222,8 +408,89 @@ def login(credentials: schemas.UserLogin, db: Session = Depends(database.get_db)
 
 # ============= PATIENT ROUTES =============
 
+async def _ingest_files(request: Request, files: List[UploadFile]):
+    """
+    Stream every upload (single DICOM files or zip/tar series archives) into UPLOAD_DIR. Returns
+    (stored, failed) where `failed` lists the files or archive entries that could not be saved;
+    on a size-limit breach 413 is returned and the blobs written are released (upload_ingest.discard).
+    """
+    upload_ingest.check_content_length(request.headers.get("content-length"))
+    budget = upload_ingest.IngestBudget()
+    stored, failed = [], []
+    try:
+        for file in files:
+            try:
+                if upload_ingest.is_archive(getattr(file, 'filename', None)):
+                    # zip/tar of a DICOM series: one slice per valid entry
+                    entries, bad = await upload_ingest.ingest_archive(file, UPLOAD_DIR, budget)
+                    stored.extend(entries)
+                    failed.extend(bad)
+                else:
+                    stored.append(await upload_ingest.ingest_upload(file, UPLOAD_DIR, budget))
+            except upload_ingest.UploadTooLarge:
+                raise
+            except Exception as e:
+                # if saving one file fails, skip it but continue processing others
+                name = getattr(file, 'filename', None) or 'upload'
+                print(f"[upload] failed to save {name}: {e}")
+                failed.append({"filename": name, "error": str(e)})
+    except upload_ingest.UploadTooLarge as e:
+        db = database.SessionLocal()
+        try:
+            upload_ingest.discard(db, stored + e.stored, UPLOAD_DIR)
+        finally:
+            db.close()
+        raise HTTPException(status_code=413, detail=f"Upload too large: {e}")
+    return stored, failed
+
+
+def _add_image_rows(db: Session, case_id: str, stored_files) -> List[dict]:
+    """
+    Insert one MRIImage row per stored file in a single executemany, with ids generated here so
+    no refresh is needed. Does not commit: the caller commits once for the whole upload.
+    """
+    now = datetime.utcnow()
+    rows = [{
+        "id": str(_uuid.uuid4()),
+        "case_id": case_id,
+        "filename": stored.filename,
+        "file_path": stored.url,
+        "content_hash": stored.sha256,
+        "size_bytes": stored.size,
+        "uploaded_at": now,
+    } for stored in stored_files]
+    if rows:
+        db.bulk_insert_mappings(models.MRIImage, rows)
+    return [{"id": r["id"], "filename": r["filename"], "url": r["file_path"]} for r in rows]
+
+
+def _create_case_with_images(db: Session, patient_id: str, description: str, stored_files, commit: bool = True):
+    """
+    Create the case, its images and its analysis job in one transaction, so they become visible
+    together. With commit=False the caller adds its own changes, commits and calls
+    job_queue.notify().
+    """
+    case = models.MedicalCase(
+        id=str(_uuid.uuid4()),
+        patient_id=patient_id,
+        description=description,
+        status="pending",
+    )
+    db.add(case)
+    db.flush()
+    created_images = _add_image_rows(db, case.id, stored_files)
+    # Queue the analysis in the durable job table; a worker picks it up (see analysis_worker.py)
+    job = job_queue.enqueue(db, case.id, commit=False)
+    if commit:
+        db.commit()
+        job_queue.notify()
+        previews.schedule_stored(stored_files, UPLOAD_DIR)
+    return case, created_images, job
+
+
 @app.post("/cases/create")
 async def create_case(
+    request: Request,
     files: List[UploadFile] = File(...),
     description: str = Form(""),
     current_user: models.User = Depends(auth.get_current_user),
@@ -232,81 +499,22 @@ async def create_case(
     """Create a new patient case with MRI images"""
     if current_user.role != "patient":
         raise HTTPException(status_code=403, detail="Only patients can create cases")
-    
-    case = models.MedicalCase(
-        patient_id=current_user.id,
-        description=description,
-        status="pending",
-    )
-    db.add(case)
-    db.commit()
-    db.refresh(case)
-    
-    # Save images to disk and create MRIImage records
-    created_images = []
-    for file in files:
-        try:
-            orig_name = getattr(file, 'filename', 'upload')
-            ext = os.path.splitext(orig_name)[1]
-            unique_name = f"{_uuid.uuid4().hex}{ext}"
-            dest_path = os.path.join(UPLOAD_DIR, unique_name)
-            with open(dest_path, 'wb') as out_file:
-                shutil.copyfileobj(file.file, out_file)
-
-            image = models.MRIImage(case_id=case.id, filename=unique_name, file_path=f"/uploads/{unique_name}")
-            db.add(image)
-            db.commit()
-            db.refresh(image)
-            created_images.append({"id": image.id, "filename": image.filename, "url": image.file_path})
-        except Exception:
-            # if saving one file fails, skip it but continue processing others
-            continue
-    
-    # Decide whether the model is available now. cnn_predictor provides _lazy_load_model()
-    model_ready = False
-    try:
-        if hasattr(cnn_predictor, '_lazy_load_model'):
-            try:
-                # Try to lazy-load model; if it succeeds model is ready.
-                cnn_predictor._lazy_load_model()
-                model_ready = True
-            except Exception:
-                model_ready = False
-    except Exception:
-        model_ready = False
 
-    if model_ready:
-        # Run analysis in a thread and wait so we can return prediction in response.
-        try:
-            await asyncio.to_thread(cnn_predictor.analyze_case, case.id)
-            # refresh case from DB to get updated prediction
-            db.refresh(case)
-            # IMPORTANT: Do NOT return the CNN prediction to the patient. The neurologist should be the
-            # only one to view model outputs. Return case metadata only.
-            return {
-                "case_id": case.id,
-                "message": "Case created and analyzed",
-                "images": created_images,
-                "status": case.status,
-            }
-        except Exception as e:
-            # If synchronous analysis fails, fall back to queuing it and return queued response
-            try:
-                asyncio.create_task(asyncio.to_thread(cnn_predictor.analyze_case, case.id))
-            except Exception:
-                pass
-            return {"case_id": case.id, "message": "Case created (analysis attempted, queued on failure)", "images": created_images}
-    else:
-        # Model not ready: queue background analysis (do NOT pass request DB session)
-        try:
-            asyncio.create_task(asyncio.to_thread(cnn_predictor.analyze_case, case.id))
-        except Exception:
-            # last resort: call synchronously (will run during request)
-            try:
-                cnn_predictor.analyze_case(case.id)
-            except Exception:
-                pass
-        return {"case_id": case.id, "message": "Case created and analysis queued", "images": created_images}
+    # Save images to disk first so an oversized upload does not leave an empty case behind
+    stored_files, failed = await _ingest_files(request, files)
+
+    case, created_images, job = _create_case_with_images(db, current_user.id, description, stored_files)
+
+    # IMPORTANT: Do NOT return the CNN prediction to the patient. The neurologist should be the
+    # only one to view model outputs. Return case metadata only.
+    return {
+        "case_id": case.id,
+        "message": "Case created and analysis queued",
+        "images": created_images,
+        "failed": failed,
+        "status": case.status,
+        "job_id": job.id,
+    }
 
 
 @app.get("/cases")
@@ -330,6 +538,25 @@ def get_patient_cases(
     } for case in cases]
 
 
+@app.get("/cases/{case_id}/analysis")
+def get_case_analysis_status(
+    case_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Return the state of the latest analysis job for a case (no model output)."""
+    case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+    if not case:
+        raise HTTPException(status_code=404, detail="Case not found")
+    if current_user.role == "patient" and case.patient_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    job = job_queue.latest_for_case(db, case_id)
+    if not job:
+        return {"case_id": case_id, "case_status": case.status, "job": None}
+    return {"case_id": case_id, "case_status": case.status, "job": job_queue.describe(job)}
+
+
 @app.patch("/cases/{case_id}")
 def update_case(
     case_id: str,
@@ -354,6 +581,7 @@ def update_case(
 @app.post("/cases/{case_id}/images")
 async def upload_case_images(
     case_id: str,
+    request: Request,
     files: List[UploadFile] = File(...),
     current_user: models.User = Depends(auth.get_current_user),
     db: Session = Depends(database.get_db),
@@ -365,23 +593,172 @@ async def upload_case_images(
     if case.patient_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    created = []
-    for file in files:
-        # save file to disk
-        orig_name = getattr(file, 'filename', 'upload')
-        ext = os.path.splitext(orig_name)[1]
-        unique_name = f"{_uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(UPLOAD_DIR, unique_name)
-        with open(dest_path, 'wb') as out_file:
-            shutil.copyfileobj(file.file, out_file)
-
-        image = models.MRIImage(case_id=case.id, filename=unique_name, file_path=f"/uploads/{unique_name}")
-        db.add(image)
+    stored_files, failed = await _ingest_files(request, files)
+    created = _add_image_rows(db, case.id, stored_files)
+    # the new slices need a (re-)analysis: queue it in the same transaction as the rows
+    job = job_queue.enqueue(db, case.id, commit=False) if created else None
+    db.commit()
+    if job is not None:
+        job_queue.notify()
+    previews.schedule_stored(stored_files, UPLOAD_DIR)
+
+    return {"message": "Images uploaded", "images": created, "failed": failed, "job_id": job.id if job else None}
+
+
+# ============= RESUMABLE UPLOADS =============
+# POST /upload-sessions -> PUT /upload-sessions/{id}/chunks/{n} (any order, retriable) -> POST .../finalize
+
+def _get_upload_session(db: Session, session_id: str, user: models.User) -> models.UploadSession:
+    session = db.query(models.UploadSession).filter(models.UploadSession.id == session_id).first()
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if session.user_id != user.id:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return session
+
+
+@app.post("/upload-sessions")
+def create_upload_session(
+    payload: dict,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Start a resumable upload of one file (DICOM or zip/tar series) for a new or existing case"""
+    if current_user.role != "patient":
+        raise HTTPException(status_code=403, detail="Only patients can upload images")
+    if not payload.get("filename") or payload.get("total_size") is None:
+        raise HTTPException(status_code=400, detail="filename and total_size are required")
+    case_id = payload.get("case_id")
+    if case_id:
+        case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+        if not case:
+            raise HTTPException(status_code=404, detail="Case not found")
+        if case.patient_id != current_user.id:
+            raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        session = upload_sessions.create(
+            db, current_user.id, payload["filename"], payload["total_size"],
+            chunk_size=payload.get("chunk_size"), case_id=case_id, description=payload.get("description", ""),
+        )
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return upload_sessions.describe(db, session, UPLOAD_DIR)
+
+
+@app.get("/upload-sessions/{session_id}")
+def get_upload_session(
+    session_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Session state, including the chunks still missing (used to resume)"""
+    return upload_sessions.describe(db, _get_upload_session(db, session_id, current_user), UPLOAD_DIR)
+
+
+@app.put("/upload-sessions/{session_id}/chunks/{index}")
+async def put_upload_chunk(
+    session_id: str,
+    index: int,
+    request: Request,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Store chunk `index` (raw request body). Optional X-Chunk-SHA256 header is verified."""
+    session = _get_upload_session(db, session_id, current_user)
+    if session.status != "open":
+        raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+    try:
+        expected = upload_sessions.expected_size(session, index)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    body = bytearray()
+    async for piece in request.stream():
+        body.extend(piece)
+        if len(body) > expected:
+            raise HTTPException(status_code=413, detail=f"Chunk {index} must be {expected} bytes")
+    try:
+        digest = await asyncio.to_thread(
+            upload_sessions.write_chunk, session, index, bytes(body), request.headers.get("x-chunk-sha256"), UPLOAD_DIR,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    upload_sessions.record_chunk(db, session, index, len(body), digest)
+    return {"session_id": session.id, "index": index, "size": len(body), "sha256": digest}
+
+
+@app.post("/upload-sessions/{session_id}/finalize")
+async def finalize_upload_session(
+    session_id: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Assemble the chunks into the case's images and queue the analysis"""
+    session = _get_upload_session(db, session_id, current_user)
+    if session.status == "finalized":
+        # retried finalize (e.g. the response was lost): report the earlier result
+        return {"case_id": session.result_case_id, "message": "Upload already finalized", "images": [], "failed": []}
+    if session.status != "open":
+        raise HTTPException(status_code=409, detail=f"Upload session is {session.status}")
+    missing = upload_sessions.missing(db, session, UPLOAD_DIR)
+    if missing:
+        raise HTTPException(status_code=409, detail={"message": "Chunks missing", "missing_chunks": missing})
+    if not upload_sessions.begin_finalize(db, session):
+        raise HTTPException(status_code=409, detail="Upload session is already being finalized")
+
+    try:
+        stored_files, failed = await asyncio.to_thread(
+            upload_sessions.ingest, session, upload_ingest.IngestBudget(), UPLOAD_DIR,
+        )
+        if session.case_id:
+            case_id = session.case_id
+            created = _add_image_rows(db, case_id, stored_files)
+            job = job_queue.enqueue(db, case_id, commit=False)
+        else:
+            case, created, job = _create_case_with_images(
+                db, current_user.id, session.description or "", stored_files, commit=False,
+            )
+            case_id = case.id
+        upload_sessions.complete(db, session, case_id, commit=False)
         db.commit()
-        db.refresh(image)
-        created.append({"id": image.id, "filename": image.filename, "url": image.file_path})
+    except upload_ingest.UploadTooLarge as e:
+        db.rollback()
+        upload_sessions.abort_finalize(db, session)
+        raise HTTPException(status_code=413, detail=f"Upload too large: {e}")
+    except Exception:
+        db.rollback()
+        upload_sessions.abort_finalize(db, session)
+        raise
+    job_queue.notify()
+    previews.schedule_stored(stored_files, UPLOAD_DIR)
+    upload_sessions.discard_chunks(session.id, UPLOAD_DIR)
+
+    return {
+        "case_id": case_id,
+        "message": "Upload finalized and analysis queued",
+        "images": created,
+        "failed": failed,
+        "job_id": job.id,
+    }
 
-    return {"message": "Images uploaded", "images": created}
+
+def _release_image_files(db: Session, file_paths):
+    """Call once the image rows are deleted and committed: garbage-collect blobs that are no
+    longer referenced and remove legacy (non content-addressed) files."""
+    try:
+        blob_store.release(db, [blob_store.hash_for_path(fp) for fp in file_paths], UPLOAD_DIR)
+    except Exception as e:
+        print(f"[storage] blob GC failed: {e}")
+    for file_path in file_paths:
+        if not file_path or blob_store.hash_for_path(file_path):
+            continue
+        try:
+            # legacy file_path expected like '/uploads/<filename>'
+            fp = os.path.join(os.path.dirname(__file__), file_path.lstrip('/'))
+            if os.path.exists(fp):
+                os.remove(fp)
+        except Exception:
+            pass
 
 
 @app.delete("/cases/{case_id}/images/{image_id}")
@@ -401,17 +778,10 @@ def delete_case_image(
     if case.patient_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not authorized")
 
+    file_paths = [image.file_path]
     db.delete(image)
-    # remove file from disk if present
-    try:
-        if image.file_path:
-            # image.file_path expected like '/uploads/<filename>'
-            fp = os.path.join(os.path.dirname(__file__), image.file_path.lstrip('/'))
-            if os.path.exists(fp):
-                os.remove(fp)
-    except Exception:
-        pass
     db.commit()
+    _release_image_files(db, file_paths)
     return {"message": "Image deleted"}
 
 
@@ -430,17 +800,12 @@ def delete_case(
 
     # delete images
     imgs = db.query(models.MRIImage).filter(models.MRIImage.case_id == case.id).all()
+    file_paths = [img.file_path for img in imgs]
     for img in imgs:
-        try:
-            if img.file_path:
-                fp = os.path.join(os.path.dirname(__file__), img.file_path.lstrip('/'))
-                if os.path.exists(fp):
-                    os.remove(fp)
-        except Exception:
-            pass
         db.delete(img)
     db.delete(case)
     db.commit()
+    _release_image_files(db, file_paths)
     return {"message": "Case and images deleted"}
 
 @app.get("/patients/info")
@@ -743,6 +1108,9 @@ def get_case_detail(
         "cnn_prediction": case.cnn_prediction,
         "cnn_prediction_num": (float(getattr(case, 'cnn_prediction_num', None)) if getattr(case, 'cnn_prediction_num', None) is not None else _coerce_prediction_value(case.cnn_prediction)),
         "cnn_confidence": (float(getattr(case, 'cnn_confidence', None)) if getattr(case, 'cnn_confidence', None) is not None else _coerce_prediction_value(case.cnn_prediction)),
+        "cnn_model_version": getattr(case, 'cnn_model_version', None),
+        "cnn_slices_scored": getattr(case, 'cnn_slices_scored', None),
+        "cnn_slices_total": getattr(case, 'cnn_slices_total', None),
         "report_pdf": getattr(case, 'report_pdf', None),
         "patient_info": patient_info,
         "images": [{"id": img.id, "url": (img.file_path if getattr(img, 'file_path', None) else f"/uploads/{img.filename}"), "filename": img.filename} for img in case.images],
@@ -1078,12 +1446,153 @@ def update_user_admin(
     }
 
 
+# ============= MODEL REGISTRY (admin) =============
+
+# Model routing is shared through the database (model_deployment.py): these endpoints record the
+# desired roles and apply them here at once; analysis workers follow within CNN_ROUTING_POLL_SECONDS.
+def _models_state(db: Session) -> dict:
+    return {**cnn_predictor.registry.describe(), "deployments": model_deployment.describe(db)}
+
+
+def _record_loaded(db: Session, version: str):
+    """Make a version loaded in this process known to the shared routing (so it can be routed to)."""
+    entry = cnn_predictor.registry.get(version)
+    if entry is not None:
+        model_deployment.record(db, version, os.path.abspath(entry.path) if entry.path else None, entry.runtime)
+
+
+@app.get('/admin/models')
+def admin_list_models(
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """List the CNN model versions loaded here, the active one, the canary split and the shared routing (admin only)."""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    return _models_state(db)
+
+
+@app.post('/admin/models/reload')
+def admin_reload_model(
+    payload: dict,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Load a model artifact without restarting the API or the workers.
+    Accepts JSON: { "path": optional artifact path (default: first candidate), "activate": true }
+    The path must be readable by the analysis workers too (they load it from there).
+    """
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    try:
+        entry = cnn_predictor.reload_model(payload.get('path'), activate=False)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to load model: {e}")
+    _record_loaded(db, entry.version)
+    if bool(payload.get('activate', True)):
+        model_deployment.set_active(db, entry.version)
+    cnn_predictor.sync_routing(db)
+    return {"loaded": entry.describe(), **_models_state(db)}
+
+
+@app.post('/admin/models/activate')
+def admin_activate_model(
+    payload: dict,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Switch the active model version in the API and every worker. Accepts JSON: { "version": "..." }"""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    version = payload.get('version')
+    _record_loaded(db, version)
+    try:
+        model_deployment.set_active(db, version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    cnn_predictor.sync_routing(db)
+    return _models_state(db)
+
+
+@app.post('/admin/models/canary')
+def admin_set_canary(
+    payload: dict,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Route a fraction of cases to a canary version, in the API and every worker.
+    Accepts JSON: { "version": "..." or null to disable, "fraction": 0.1 }
+    """
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    version = payload.get('version')
+    if version is not None:
+        _record_loaded(db, version)
+    try:
+        model_deployment.set_canary(db, version, payload.get('fraction', 0.0))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cnn_predictor.sync_routing(db)
+    return _models_state(db)
+
+
+@app.delete('/admin/models/{version}')
+def admin_unload_model(
+    version: str,
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Retire a non-active model version: the API and every worker unload it (admin only)."""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    if version not in cnn_predictor.registry and model_deployment.get(db, version) is None:
+        raise HTTPException(status_code=404, detail='Model version not found')
+    if cnn_predictor.registry.active is not None and cnn_predictor.registry.active.version == version:
+        raise HTTPException(status_code=400, detail='cannot unload the active model version')
+    try:
+        model_deployment.retire(db, version)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cnn_predictor.sync_routing(db)
+    return _models_state(db)
+
+
+@app.post('/admin/storage/gc')
+def admin_storage_gc(
+    current_user: models.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db),
+):
+    """Remove unreferenced MRI blobs, stale partial uploads and expired upload sessions (admin only)."""
+    if current_user.role != 'admin':
+        raise HTTPException(status_code=403, detail='Admin access required')
+    return _collect_storage(db)
+
+
 # Health check
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
 
+# Prometheus scrape endpoint (this process only; analysis workers expose their own, see --metrics-port)
+@app.get("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Readiness: 200 once the CNN is loaded and warmed up, 503 before that (or if loading failed)
+@app.get("/ready")
+def readiness_check():
+    state = cnn_predictor.readiness()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "not_ready", **state})
+    return {"status": "ready", **state}
+
+
 @app.get("/auth/me")
 def read_current_user(
     current_user: models.User = Depends(auth.get_current_user),
@@ -1109,13 +1618,8 @@ def chat_endpoint(payload: dict):
         raise HTTPException(status_code=400, detail="Missing 'question' in request body")
 
     try:
-        # Ensure FAISS index is built
-        if getattr(chatbot_service, 'faiss_index', None) is None:
-            chatbot_service.build_faiss_index()
-
         # Optionally use patient-specific context in the future
-        relevant = chatbot_service.search_relevant_chunks(question, top_k=5)
-        response = chatbot_service.generate_chatbot_response(question, relevant)
+        response = _chatbot_answer(question)
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1194,13 +1698,10 @@ def api_chat_field(payload: dict):
 
         # Otherwise, try to run a short generation on the matching chunks
         try:
-            if getattr(chatbot_service, 'faiss_index', None) is None:
-                chatbot_service.build_faiss_index()
-            relevant = chatbot_service.search_relevant_chunks(message, top_k=5)
-            if not relevant:
-                return { 'type': 'not_field', 'message': 'Aucune donnée trouvée' }
             # Ask the model to produce a concise answer for the field query
-            resp = chatbot_service.generate_chatbot_response(message, relevant)
+            resp = _chatbot_answer(message, require_context=True)
+            if resp is None:
+                return { 'type': 'not_field', 'message': 'Aucune donnée trouvée' }
             return { 'type': 'not_field', 'message': resp }
         except Exception as e:
             return { 'type': 'not_field', 'error': str(e) }
@@ -38,11 +38,34 @@ def main():
     else:
         print('cnn_confidence already exists')
 
+    if not column_exists(conn, tbl, 'cnn_model_version'):
+        add_column(conn, tbl, 'cnn_model_version TEXT')
+    else:
+        print('cnn_model_version already exists')
+
+    for col in ('cnn_slices_scored', 'cnn_slices_total'):
+        if not column_exists(conn, tbl, col):
+            add_column(conn, tbl, f'{col} INTEGER')
+        else:
+            print(f'{col} already exists')
+
+    if not column_exists(conn, tbl, 'cnn_timings'):
+        add_column(conn, tbl, 'cnn_timings TEXT')
+    else:
+        print('cnn_timings already exists')
+
     if not column_exists(conn, tbl, 'report_pdf'):
         add_column(conn, tbl, 'report_pdf TEXT')
     else:
         print('report_pdf already exists')
 
+    # mri_images additions
+    for col, typ in {'content_hash': 'TEXT', 'size_bytes': 'INTEGER'}.items():
+        if not column_exists(conn, 'mri_images', col):
+            add_column(conn, 'mri_images', f"{col} {typ}")
+        else:
+            print(f"{col} already exists")
+
     # info_patients additions (many fields)
     tbl2 = 'info_patients'
     info_cols = {
@@ -0,0 +1,108 @@
+# backend/model_deployment.py
+"""Which CNN model version every process should serve, stored in the `model_deployments` table.
+
+Cases are scored by the API's in-process workers and by separate `analysis_worker.py`
+processes, each with its own in-memory ModelRegistry. The admin model endpoints therefore do not
+only change their own registry: they record the desired role of each version here (one
+`active`, at most one `canary` with its fraction, `standby`, or `retired`), and every process
+applies it with cnn_predictor.sync_routing(), which polls it every CNN_ROUTING_POLL_SECONDS.
+A process loads a version it does not have from the recorded artifact path, so that path must
+be readable by all of them (shared volume). Retired versions are unloaded everywhere and their
+prediction cache rows may be dropped.
+"""
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import models
+
+ROLES = ("active", "canary", "standby", "retired")
+
+
+def get(db: Session, version: str) -> Optional[models.ModelDeployment]:
+    return db.query(models.ModelDeployment).filter(models.ModelDeployment.version == version).first()
+
+
+def record(db: Session, version: str, path: Optional[str] = None, runtime: Optional[str] = None,
+           commit: bool = True) -> models.ModelDeployment:
+    """Register a loaded version (as standby; a retired one is revived), keeping its current role otherwise."""
+    row = get(db, version)
+    if row is None:
+        row = models.ModelDeployment(version=version, role="standby", canary_fraction=0.0)
+        db.add(row)
+    elif row.role == "retired":
+        row.role = "standby"
+    if path:
+        row.path = path
+    if runtime:
+        row.runtime = runtime
+    if commit:
+        db.commit()
+    return row
+
+
+def _demote(db: Session, role: str):
+    for row in db.query(models.ModelDeployment).filter(models.ModelDeployment.role == role).all():
+        row.role, row.canary_fraction = "standby", 0.0
+
+
+def set_active(db: Session, version: str) -> models.ModelDeployment:
+    """Make `version` the active one everywhere (the previous active goes to standby)."""
+    row = get(db, version)
+    if row is None:
+        raise KeyError(f"unknown model version: {version}")
+    _demote(db, "active")
+    row.role, row.canary_fraction = "active", 0.0
+    db.commit()
+    return row
+
+
+def set_canary(db: Session, version: Optional[str], fraction: float = 0.0):
+    """Route `fraction` of cases to `version` everywhere; None disables the canary."""
+    row = None
+    if version is not None:
+        row = get(db, version)
+        if row is None:
+            raise KeyError(f"unknown model version: {version}")
+        if row.role == "active":
+            raise ValueError("the active model version cannot be the canary")
+    _demote(db, "canary")
+    if row is not None:
+        row.role, row.canary_fraction = "canary", min(1.0, max(0.0, float(fraction)))
+    db.commit()
+
+
+def retire(db: Session, version: str, commit: bool = True):
+    """Mark `version` retired: every process unloads it. The active version cannot be retired."""
+    row = get(db, version)
+    if row is None:
+        row = models.ModelDeployment(version=version)
+        db.add(row)
+    elif row.role == "active":
+        raise ValueError("cannot unload the active model version")
+    row.role, row.canary_fraction = "retired", 0.0
+    if commit:
+        db.commit()
+
+
+def retired(db: Session) -> List[str]:
+    return [v for (v,) in db.query(models.ModelDeployment.version).filter(models.ModelDeployment.role == "retired")]
+
+
+def desired(db: Session) -> Dict[str, object]:
+    """{"active": row or None, "canary": row or None, "retired": [versions]}."""
+    rows = db.query(models.ModelDeployment).all()
+    by_role = {role: [r for r in rows if r.role == role] for role in ROLES}
+    return {
+        "active": by_role["active"][0] if by_role["active"] else None,
+        "canary": by_role["canary"][0] if by_role["canary"] else None,
+        "retired": [r.version for r in by_role["retired"]],
+    }
+
+
+def describe(db: Session) -> List[dict]:
+    return [
+        {"version": r.version, "role": r.role, "canary_fraction": r.canary_fraction, "path": r.path,
+         "runtime": r.runtime, "updated_at": r.updated_at}
+        for r in db.query(models.ModelDeployment).order_by(models.ModelDeployment.updated_at.desc())
+    ]
@@ -0,0 +1,109 @@
+# backend/model_registry.py
+"""Versioned, hot-swappable registry of loaded CNN models.
+
+Several versions can be resident at once. Exactly one is *active*; an optional *canary*
+version scores a configurable fraction of cases so its outputs can be compared against the
+active one. Swapping the active version is a single reference assignment under a lock, so
+analyses already running keep the model object they started with and new analyses pick up
+the new version without a restart.
+"""
+import random
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+
+class ModelVersion:
+    """A loaded model plus the metadata recorded alongside its predictions."""
+
+    def __init__(self, version: str, model, path: Optional[str] = None, runtime: Optional[str] = None):
+        self.version = version
+        self.model = model
+        self.path = path
+        self.runtime = runtime
+        self.loaded_at = datetime.utcnow()
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "path": self.path,
+            "runtime": self.runtime,
+            "loaded_at": self.loaded_at.isoformat(),
+        }
+
+
+class ModelRegistry:
+    def __init__(self):
+        self._versions: Dict[str, ModelVersion] = {}
+        self._active: Optional[str] = None
+        self._canary: Optional[str] = None
+        self.canary_fraction = 0.0
+        self._lock = threading.Lock()
+
+    # --- registration ---
+    def register(self, entry: ModelVersion, activate: bool = False) -> ModelVersion:
+        """Add a loaded version (keeping an already-registered one with the same id)."""
+        with self._lock:
+            entry = self._versions.setdefault(entry.version, entry)
+            if activate or self._active is None:
+                self._active = entry.version
+        return entry
+
+    def get(self, version: str) -> Optional[ModelVersion]:
+        return self._versions.get(version)
+
+    def __contains__(self, version: str) -> bool:
+        return version in self._versions
+
+    def unload(self, version: str) -> Optional[ModelVersion]:
+        """Forget a version. The active version cannot be unloaded."""
+        with self._lock:
+            if version == self._active:
+                raise ValueError("cannot unload the active model version")
+            if version == self._canary:
+                self._canary, self.canary_fraction = None, 0.0
+            return self._versions.pop(version, None)
+
+    # --- routing ---
+    def activate(self, version: str) -> ModelVersion:
+        with self._lock:
+            if version not in self._versions:
+                raise KeyError(f"unknown model version: {version}")
+            self._active = version
+            if self._canary == version:
+                self._canary, self.canary_fraction = None, 0.0
+            return self._versions[version]
+
+    def set_canary(self, version: Optional[str], fraction: float = 0.0):
+        """Route `fraction` (0..1) of cases to `version`; None disables the canary."""
+        with self._lock:
+            if version is not None and version not in self._versions:
+                raise KeyError(f"unknown model version: {version}")
+            self._canary = version
+            self.canary_fraction = min(1.0, max(0.0, float(fraction))) if version else 0.0
+
+    @property
+    def active(self) -> Optional[ModelVersion]:
+        return self._versions.get(self._active) if self._active else None
+
+    @property
+    def canary(self) -> Optional[ModelVersion]:
+        return self._versions.get(self._canary) if self._canary else None
+
+    def choose(self) -> Optional[ModelVersion]:
+        """Pick the version that should score the next case (canary with its configured odds)."""
+        canary = self.canary
+        if canary is not None and self.canary_fraction > 0 and random.random() < self.canary_fraction:
+            return canary
+        return self.active
+
+    def version_ids(self) -> List[str]:
+        return list(self._versions)
+
+    def describe(self) -> dict:
+        return {
+            "active": self._active,
+            "canary": self._canary,
+            "canary_fraction": self.canary_fraction,
+            "versions": [v.describe() for v in self._versions.values()],
+        }
@@ -34,6 +34,13 @@ class MedicalCase(Base):
     # numeric prediction and confidence (added for better typing and sorting)
     cnn_prediction_num = Column(Float, nullable=True)
     cnn_confidence = Column(Float, nullable=True)
+    # model registry version that produced the prediction
+    cnn_model_version = Column(String, nullable=True)
+    # slices actually scored vs. available (adaptive early exit / series sampling score fewer)
+    cnn_slices_scored = Column(Integer, nullable=True)
+    cnn_slices_total = Column(Integer, nullable=True)
+    # per-stage seconds of the analysis (JSON), only when CNN_STORE_TIMINGS is set
+    cnn_timings = Column(Text, nullable=True)
     # path to generated PDF report by neurologist
     report_pdf = Column(String, nullable=True)
     neurologist_report = Column(Text, nullable=True)
@@ -52,6 +59,9 @@ class MRIImage(Base):
     case_id = Column(String, ForeignKey("medical_cases.id"))
     filename = Column(String)
     file_path = Column(String, nullable=True)
+    # sha256 of the uploaded bytes, computed while streaming (see upload_ingest.py)
+    content_hash = Column(String, nullable=True, index=True)
+    size_bytes = Column(Integer, nullable=True)
     uploaded_at = Column(DateTime, default=datetime.utcnow)
     
     case = relationship("MedicalCase", back_populates="images")
@@ -110,3 +120,73 @@ class InfoPatient(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     user = relationship("User", back_populates="info")
+
+
+class PredictionCache(Base):
+    """Per-slice CNN output keyed by a hash of the slice (see prediction_cache.py) and the model version."""
+    __tablename__ = "prediction_cache"
+
+    pixel_hash = Column(String, primary_key=True)
+    model_version = Column(String, primary_key=True)
+    probs = Column(Text)  # JSON list of class probabilities
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ModelDeployment(Base):
+    """Desired role of a CNN model version, shared by the API and every analysis worker (see model_deployment.py)."""
+    __tablename__ = "model_deployments"
+
+    version = Column(String, primary_key=True)
+    path = Column(String, nullable=True)  # artifact to load it from (must be readable by the workers)
+    runtime = Column(String, nullable=True)
+    role = Column(String, default="standby", index=True)  # active, canary, standby, retired
+    canary_fraction = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class AnalysisJob(Base):
+    """Durable CNN analysis request, claimed and executed by analysis workers (analysis_worker.py)."""
+    __tablename__ = "analysis_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    case_id = Column(String, ForeignKey("medical_cases.id"), index=True)
+    status = Column(String, default="queued", index=True)  # queued, running, done, failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    last_error = Column(Text, nullable=True)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    locked_by = Column(String, nullable=True)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class UploadSession(Base):
+    """Resumable chunked upload of one file (single DICOM or series archive), see upload_sessions.py."""
+    __tablename__ = "upload_sessions"
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = Column(String, ForeignKey("users.id"), index=True)
+    case_id = Column(String, ForeignKey("medical_cases.id"), nullable=True)  # attach to an existing case
+    description = Column(Text, nullable=True)  # used when finalize creates a new case
+    filename = Column(String)
+    total_size = Column(Integer)
+    chunk_size = Column(Integer)
+    total_chunks = Column(Integer)
+    status = Column(String, default="open", index=True)  # open, finalized, expired
+    result_case_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    expires_at = Column(DateTime, index=True)
+
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+
+    session_id = Column(String, ForeignKey("upload_sessions.id"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    size = Column(Integer)
+    sha256 = Column(String)
+    received_at = Column(DateTime, default=datetime.utcnow)
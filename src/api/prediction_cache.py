@@ -0,0 +1,142 @@
+# backend/prediction_cache.py
+"""Persistent per-slice prediction cache.
+
+Entries are keyed by (slice hash, model version), so re-uploads of the same scan and
+re-analyses of a case only run the CNN on slices it has never scored with the current model.
+The slice hash of a content-addressed upload is its MRIImage.content_hash, read from the blob
+path without opening the file (the CNN decodes it once, in preprocessing); only legacy uploads
+are read here to hash their PixelData. The table is shared by the API and every analysis worker, which may have
+different versions loaded (canary, staggered reloads), so prune only drops the rows of versions
+explicitly retired (model_deployment.retire, e.g. through unload_version), never "whatever this
+process does not know". The table is capped at MAX_ENTRIES with least-recently-used eviction;
+that needs a count of the whole table, so callers prune at most every PRUNE_INTERVAL_SECONDS
+(see `prune_due`).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+import pydicom
+from sqlalchemy.orm import Session
+
+import blob_store
+import models
+import preprocessing
+
+ENABLED = os.getenv("CNN_CACHE_ENABLED", "1") not in ("0", "false", "False")
+MAX_ENTRIES = int(os.getenv("CNN_CACHE_MAX_ENTRIES", "200000"))
+PRUNE_INTERVAL_SECONDS = float(os.getenv("CNN_CACHE_PRUNE_INTERVAL_SECONDS", "300"))
+
+_last_prune: Optional[float] = None
+_prune_lock = threading.Lock()
+
+
+def _file_pixel_hash(path: str) -> Optional[str]:
+    try:
+        ds = pydicom.dcmread(path)
+        data = ds.PixelData
+    except Exception:
+        return None
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_hash(path: str) -> Optional[str]:
+    # content-addressed uploads are named after MRIImage.content_hash: no need to read them
+    return blob_store.hash_for_path(path) or _file_pixel_hash(path)
+
+
+def _frame_hash(file_hash: Optional[str], frame: Optional[int]) -> Optional[str]:
+    if file_hash is None or frame is None:
+        return file_hash
+    return hashlib.sha256(f"{file_hash}{preprocessing.FRAME_SEP}{frame}".encode()).hexdigest()
+
+
+def pixel_hash(filepath: str) -> Optional[str]:
+    """
+    Return the content hash of a blob-stored file, else the sha256 of its raw PixelData element
+    (no decompression), or None if unreadable. A frame key (see preprocessing.frame_key) gets a
+    per-frame hash derived from its file's.
+    """
+    path, frame = preprocessing.split_frame_key(filepath)
+    return _frame_hash(_file_hash(path), frame)
+
+
+def pixel_hashes(keys: Iterable[str]) -> Dict[str, Optional[str]]:
+    """pixel_hash for many slice keys, reading each underlying file once."""
+    by_file = {}
+    out = {}
+    for key in keys:
+        path, frame = preprocessing.split_frame_key(key)
+        if path not in by_file:
+            by_file[path] = _file_hash(path)
+        out[key] = _frame_hash(by_file[path], frame)
+    return out
+
+
+def get_many(db: Session, hashes: Iterable[str], model_version: str) -> Dict[str, list]:
+    """Return {pixel_hash: probs} for the hashes already scored by `model_version`."""
+    wanted = list({h for h in hashes if h})
+    if not wanted:
+        return {}
+    Entry = models.PredictionCache
+    out = {}
+    now = datetime.utcnow()
+    # stay well under SQLite's bound-parameter limit
+    for i in range(0, len(wanted), 500):
+        rows = db.query(Entry).filter(
+            Entry.model_version == model_version,
+            Entry.pixel_hash.in_(wanted[i:i + 500]),
+        ).all()
+        for row in rows:
+            try:
+                out[row.pixel_hash] = json.loads(row.probs)
+            except Exception:
+                continue
+            row.hits = (row.hits or 0) + 1
+            row.last_used_at = now
+    return out
+
+
+def put_many(db: Session, entries: Dict[str, list], model_version: str):
+    """Stage {pixel_hash: probs} rows for `model_version`; the caller commits."""
+    now = datetime.utcnow()
+    for h, probs in entries.items():
+        if not h:
+            continue
+        db.merge(models.PredictionCache(
+            pixel_hash=h,
+            model_version=model_version,
+            probs=json.dumps([float(p) for p in probs]),
+            hits=0,
+            created_at=now,
+            last_used_at=now,
+        ))
+
+
+def prune_due() -> bool:
+    """True at most once per PRUNE_INTERVAL_SECONDS in this process."""
+    global _last_prune
+    now = time.monotonic()
+    with _prune_lock:
+        if _last_prune is not None and now - _last_prune < PRUNE_INTERVAL_SECONDS:
+            return False
+        _last_prune = now
+        return True
+
+
+def prune(db: Session, retired_versions: Iterable[str], max_entries: int = None):
+    """Drop entries from retired model versions, then evict the least recently used beyond the cap."""
+    Entry = models.PredictionCache
+    max_entries = MAX_ENTRIES if max_entries is None else max_entries
+    retired_versions = list(retired_versions)
+    if retired_versions:
+        db.query(Entry).filter(Entry.model_version.in_(retired_versions)).delete(synchronize_session=False)
+    total = db.query(Entry).count()
+    if total > max_entries:
+        stale = [r[0] for r in db.query(Entry.pixel_hash).order_by(Entry.last_used_at.asc()).limit(total - max_entries)]
+        for i in range(0, len(stale), 500):
+            db.query(Entry).filter(Entry.pixel_hash.in_(stale[i:i + 500])).delete(synchronize_session=False)
@@ -0,0 +1,210 @@
+# backend/preprocessing.py
+"""DICOM decode + preprocessing for the CNN, optionally spread over a worker pool.
+
+Kept free of model/TensorFlow imports so process-pool workers stay lightweight.
+"""
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.pixels import pixel_array
+import cv2
+
+TARGET_SHAPE = (128, 128)
+
+# Number of slices decoded in parallel (1 = serial, in the caller's thread)
+WORKERS = int(os.getenv("CNN_PREPROCESS_WORKERS", "0")) or min(4, os.cpu_count() or 1)
+# "thread" (default; pydicom/numpy/cv2 release the GIL for the heavy parts) or "process"
+EXECUTOR = os.getenv("CNN_PREPROCESS_EXECUTOR", "thread").lower()
+# Back-pressure: at most this many slices are decoded ahead of the consumer
+MAX_INFLIGHT = int(os.getenv("CNN_PREPROCESS_MAX_INFLIGHT", "0")) or WORKERS * 2
+
+_pool = None
+
+
+# Frames of multi-frame files are addressed as "<path>#<frame index>" wherever a slice path is expected
+FRAME_SEP = "#"
+
+
+def frame_key(path: str, frame: Optional[int] = None) -> str:
+    return path if frame is None else f"{path}{FRAME_SEP}{int(frame)}"
+
+
+def split_frame_key(key: str) -> Tuple[str, Optional[int]]:
+    path, sep, frame = key.rpartition(FRAME_SEP)
+    if sep and frame.isdigit():
+        return path, int(frame)
+    return key, None
+
+
+# dtypes cv2.resize handles natively; anything else is converted to float32 first
+_RESIZABLE_DTYPES = (np.uint8, np.uint16, np.int16, np.float32, np.float64)
+
+
+def _add_time(timings: Optional[dict], stage: str, t0: float) -> float:
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + (now - t0)
+    return now
+
+
+def preprocess_into(filepath: str, out: Optional[np.ndarray] = None, timings: Optional[dict] = None) -> np.ndarray:
+    """
+    Decode one DICOM slice into `out`, a float32 (128,128) array (typically a slot of a
+    BatchBuffer), and return it. A new array is allocated when `out` is None.
+
+    The slice is resized first, on its native dtype, and then min-max normalized in place using
+    the full-resolution min/max, so no full-size float copy is ever made. Only grayscale slices
+    are supported; `filepath` may be a frame key (see frame_key), in which case only that frame
+    of the multi-frame file is decoded. Seconds spent are added to `timings["decode"]` and
+    `timings["preprocess"]` when a dict is given.
+    """
+    t0 = time.perf_counter()
+    path, frame = split_frame_key(filepath)
+    if frame is None:
+        pixels = pydicom.dcmread(path).pixel_array
+    else:
+        pixels = pixel_array(path, index=frame)
+    if pixels.ndim != 2:
+        raise ValueError(f"expected a single-frame grayscale slice, got pixel array of shape {pixels.shape}")
+    t0 = _add_time(timings, "decode", t0)
+    if pixels.dtype.type not in _RESIZABLE_DTYPES:
+        pixels = pixels.astype(np.float32)
+    lo = float(pixels.min())
+    hi = float(pixels.max())
+    small = cv2.resize(pixels, TARGET_SHAPE, interpolation=cv2.INTER_AREA)
+    if out is None:
+        out = np.empty(small.shape, dtype=np.float32)
+    np.subtract(small, lo, out=out, casting="unsafe")
+    np.divide(out, hi - lo + 1e-5, out=out)
+    _add_time(timings, "preprocess", t0)
+    return out
+
+
+def as_model_input(slices: np.ndarray) -> np.ndarray:
+    """View a (n,128,128) float32 stack as the (n,128,128,3) RGB input the CNN expects.
+
+    The three channels are a zero-stride broadcast of the same data, not copies.
+    """
+    return np.broadcast_to(slices[..., np.newaxis], slices.shape + (3,))
+
+
+class BatchBuffer:
+    """Preallocated, reusable (capacity,128,128) float32 stack of preprocessed slices."""
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, int(capacity))
+        self._data = np.empty((self.capacity, *TARGET_SHAPE), dtype=np.float32)
+        self.paths = []
+
+    def __len__(self):
+        return len(self.paths)
+
+    def full(self) -> bool:
+        return len(self.paths) >= self.capacity
+
+    def next_slot(self) -> np.ndarray:
+        return self._data[len(self.paths)]
+
+    def commit(self, filepath: str):
+        """Mark the slot returned by next_slot() as filled for `filepath`."""
+        self.paths.append(filepath)
+
+    def add(self, filepath: str, slice_2d: np.ndarray):
+        slot = self.next_slot()
+        # slices decoded straight into the slot (serial path) need no copy
+        if not np.may_share_memory(slot, slice_2d):
+            np.copyto(slot, slice_2d)
+        self.commit(filepath)
+
+    def view(self) -> np.ndarray:
+        """(n,128,128,3) model input over the filled slots (no copy)."""
+        return as_model_input(self._data[:len(self.paths)])
+
+    def reset(self):
+        self.paths = []
+
+
+def preprocess_from_path(filepath: str):
+    """
+    Read DICOM from disk and return np.array shaped (1,128,128,3) as float32.
+    (Read-only broadcast view over a single (128,128) slice.)
+    """
+    return as_model_input(preprocess_into(filepath)[np.newaxis])
+
+
+def _safe_preprocess(filepath: str):
+    """Pool task: never raises, so one bad slice cannot poison the stream."""
+    timings = {}
+    try:
+        return filepath, preprocess_into(filepath, timings=timings), None, timings
+    except Exception as e:
+        return filepath, None, f"{type(e).__name__}: {e}", timings
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        if EXECUTOR == "process":
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        else:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="dicom-preprocess")
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def iter_preprocessed(filepaths: Iterable[str], workers: Optional[int] = None,
+                      max_inflight: Optional[int] = None,
+                      buffer: Optional[BatchBuffer] = None,
+                      timings: Optional[dict] = None) -> Iterator[Tuple[str, np.ndarray]]:
+    """
+    Yield (filepath, (128,128) float32 slice) in input order, decoding up to `max_inflight`
+    slices ahead on the shared pool. Slices that fail to decode are logged and skipped.
+    When serial and a `buffer` is given, each slice is decoded directly into its next slot;
+    the consumer must add() it to the buffer before asking for the next one. Decode and
+    preprocess seconds (summed over workers) are accumulated into `timings` when given.
+    """
+    workers = WORKERS if workers is None else workers
+    if workers <= 1:
+        for fp in filepaths:
+            try:
+                yield fp, preprocess_into(fp, buffer.next_slot() if buffer is not None else None, timings)
+            except Exception as e:
+                print(f"[preprocessing] failed to preprocess {fp}: {e}")
+                traceback.print_exc()
+        return
+
+    pool = _get_pool()
+    max_inflight = max(1, max_inflight or MAX_INFLIGHT)
+    it = iter(filepaths)
+    window = deque(pool.submit(_safe_preprocess, fp) for fp in islice(it, max_inflight))
+    try:
+        while window:
+            fp, arr, err, spent = window.popleft().result()
+            if timings is not None:
+                for stage, seconds in spent.items():
+                    timings[stage] = timings.get(stage, 0.0) + seconds
+            # refill only once the consumer has taken a result
+            nxt = next(it, None)
+            if nxt is not None:
+                window.append(pool.submit(_safe_preprocess, nxt))
+            if err is not None:
+                print(f"[preprocessing] failed to preprocess {fp}: {err}")
+                continue
+            yield fp, arr
+    finally:
+        # consumer stopped early: drop work that has not started yet
+        for fut in window:
+            fut.cancel()
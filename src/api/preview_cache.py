@@ -0,0 +1,170 @@
+# backend/preview_cache.py
+"""In-process cache of hot preview bytes.
+
+A review session requests the same few dozen slices over and over. Preview files never change
+once written (a re-render gets a new RENDER_VERSION, see previews.py), so the preview endpoint
+keeps the bytes of the files it served in a bounded LRU (PREVIEW_CACHE_BYTES, least recently
+used evicted first) keyed by (uploads root, preview key, size, preset). A hit skips the
+candidate-path lookups and the disk read. Only exact renders are cached, never a stand-in size,
+and nothing larger than PREVIEW_CACHE_MAX_ITEM (full-resolution previews usually are).
+
+With PREVIEW_PREFETCH on, requesting the first slice of a case loads the case's other slices
+(same size and preset) in the background, so scrolling through the series hits the cache.
+Set PREVIEW_CACHE_BYTES=0 to disable. Entries are per process; previews removed with their blob
+are dropped via `discard`.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, NamedTuple, Optional, Tuple
+
+import metrics
+
+PREVIEW_CACHE_BYTES = int(os.getenv("PREVIEW_CACHE_BYTES", str(64 * 1024 * 1024)))
+PREVIEW_CACHE_MAX_ITEM = int(os.getenv("PREVIEW_CACHE_MAX_ITEM", str(2 * 1024 * 1024)))
+PREVIEW_PREFETCH = os.getenv("PREVIEW_PREFETCH", "1") not in ("0", "false", "False")
+
+LOOKUPS = metrics.counter("preview_cache_lookups_total", "Preview byte cache lookups", labelnames=("result",))
+EVICTIONS = metrics.counter("preview_cache_evictions_total", "Previews evicted from the byte cache")
+PREFETCHED = metrics.counter("preview_cache_prefetched_total", "Previews loaded ahead of a request")
+CACHE_BYTES = metrics.gauge("preview_cache_bytes", "Bytes held by the preview byte cache")
+CACHE_ENTRIES = metrics.gauge("preview_cache_entries", "Previews held by the preview byte cache")
+
+Key = Tuple[str, str, str, str]  # (root, preview key, size, preset)
+
+
+class Entry(NamedTuple):
+    data: bytes
+    path: str
+    headers: dict
+
+
+class ByteCache:
+    """Thread-safe LRU of Entry values bounded by the total size of their data."""
+
+    def __init__(self, max_bytes: int, max_item: int):
+        self.max_bytes = max_bytes
+        self.max_item = max_item
+        self._entries: "OrderedDict[Key, Entry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Key) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        LOOKUPS.inc(result="hit" if entry is not None else "miss")
+        return entry
+
+    def __contains__(self, key: Key) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key: Key, entry: Entry) -> bool:
+        """Store `entry` unless it is over the per-item limit; evicts the oldest to fit."""
+        n = len(entry.data)
+        if n > self.max_item or n > self.max_bytes:
+            return False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old.data)
+            self._entries[key] = entry
+            self._size += n
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.data)
+                EVICTIONS.inc()
+            self._publish()
+        return True
+
+    def discard(self, root: str, preview_key: str):
+        """Drop every size and preset of `preview_key` (e.g. after its blob was removed)."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == root and k[1] == preview_key]:
+                self._size -= len(self._entries.pop(key).data)
+            self._publish()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self._publish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._size, "max_bytes": self.max_bytes}
+
+    def _publish(self):
+        CACHE_BYTES.set(self._size)
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+CACHE = ByteCache(PREVIEW_CACHE_BYTES, PREVIEW_CACHE_MAX_ITEM)
+
+_prefetcher: Optional[ThreadPoolExecutor] = None
+_prefetcher_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return CACHE.max_bytes > 0
+
+
+def load(key: Key, path: str, headers: dict) -> Optional[Entry]:
+    """Read the preview at `path` into the cache; returns the entry (also when too big to keep)."""
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    entry = Entry(data, path, headers)
+    if enabled():
+        CACHE.put(key, entry)
+    return entry
+
+
+def _get_prefetcher() -> ThreadPoolExecutor:
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="preview-prefetch")
+        return _prefetcher
+
+
+def _prefetch(root: str, first_key: str, size: str, preset: str,
+              case_keys: Callable[[str], Iterable[str]], resolve: Callable[[str], Optional[Tuple[str, dict]]]):
+    try:
+        keys = list(case_keys(first_key))
+        if not keys or keys[0] != first_key:
+            return
+        for other in keys[1:]:
+            key = (root, other, size, preset)
+            if key in CACHE:
+                continue
+            found = resolve(other)
+            if found and load(key, *found):
+                PREFETCHED.inc()
+    except Exception as e:
+        print(f"[preview_cache] prefetch after {first_key} failed: {e}")
+
+
+def prefetch_case(root: str, first_key: str, size: str, preset: str,
+                  case_keys: Callable[[str], Iterable[str]], resolve: Callable[[str], Optional[Tuple[str, dict]]]):
+    """
+    In the background: if `first_key` is the first of `case_keys(first_key)` (the preview keys
+    of its case, in slice order), load the others. `resolve(key)` returns the (path, headers) of
+    an exact precomputed preview, or None to skip it.
+    """
+    if not (PREVIEW_PREFETCH and enabled()):
+        return None
+    return _get_prefetcher().submit(_prefetch, root, first_key, size, preset, case_keys, resolve)
+
+
+def shutdown(wait: bool = False):
+    global _prefetcher
+    with _prefetcher_lock:
+        executor, _prefetcher = _prefetcher, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
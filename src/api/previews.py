@@ -0,0 +1,275 @@
+# backend/previews.py
+"""Precomputed preview images for stored MRI slices.
+
+Previews are an ingest stage: once the image rows of an upload are committed, `schedule` hands
+each new blob to a small background pool that decodes the DICOM once, renders it with
+rendering.py (windowing) and writes every size in SIZES (thumbnail, viewer, full resolution) to
+`uploads/previews/<key>.<size>.r<RENDER_VERSION>.<ext>`, where <key> is the blob's sha256 (or
+the file stem of a legacy upload). Other window presets are rendered on first request, into
+`<key>.<size>.<preset>.r<RENDER_VERSION>.<ext>`, and kept like the default ones. The render
+version in the name means a bump is never answered with a file of the previous rendering: the
+new files are missing, so backfill (default preset) or the next request (other presets)
+re-renders them, and the stale ones are removed once their replacement is written. The preview endpoint serves
+these files and never decodes or waits itself: for a slice not rendered yet it queues the render
+and answers at once with `placeholder()` (uncacheable), so an <img> still gets an image. Uploads from before previews existed are queued by `backfill`, run at API
+startup (PREVIEW_BACKFILL_ON_STARTUP), so no operator step is needed. Files are written to a temp name and
+renamed, so a reader never sees a partial image, and they are removed with their blob
+(blob_store._remove_blob drops every preview starting with the hash).
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import blob_store
+import metrics
+import rendering
+
+UPLOAD_DIR = blob_store.UPLOAD_DIR
+PREVIEWS_DIRNAME = blob_store.PREVIEWS_DIRNAME
+# longest edge in pixels; None keeps the native resolution. Rendered in this order, so the
+# thumbnail a case list needs first is available first.
+SIZES = {"thumb": 128, "viewer": 512, "full": None}
+DEFAULT_SIZE = "viewer"
+PRESETS = rendering.PRESETS
+DEFAULT_PRESET = rendering.DEFAULT_PRESET
+# "webp" (much smaller than PNG) or "png"; "full" is always written losslessly
+PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "webp").lower()
+PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "85"))
+PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+PREVIEW_BACKFILL_ON_STARTUP = os.getenv("PREVIEW_BACKFILL_ON_STARTUP", "1") not in ("0", "false", "False")
+# bump whenever the rendered pixels change: it is part of the preview file names, of their ETag
+# (http_cache.py) and of the backfill manifest, so every preset is re-rendered and caches revalidate
+RENDER_VERSION = 2
+
+MEDIA_TYPES = {".webp": "image/webp", ".png": "image/png"}
+# extensions of the stored DICOM that clients may leave in a preview name (`<stored name>.png`)
+SOURCE_EXTS = (".dcm", ".dicom")
+
+RENDER_SECONDS = metrics.histogram("preview_render_seconds", "Time to decode a slice and write all its preview sizes")
+RENDERED = metrics.counter("previews_rendered_total", "Preview sets rendered", labelnames=("result",))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_pending = {}  # (key, preset) -> Future, so a blob is rendered once even if requested repeatedly
+
+
+def _ext() -> str:
+    return ".webp" if PREVIEW_FORMAT == "webp" else ".png"
+
+
+def previews_dir(root: str = None) -> str:
+    return os.path.join(root or UPLOAD_DIR, PREVIEWS_DIRNAME)
+
+
+def preview_path(key: str, size: str, root: str = None, preset: str = DEFAULT_PRESET) -> str:
+    suffix = "" if preset == DEFAULT_PRESET else f".{preset}"
+    return os.path.join(previews_dir(root), f"{key}.{size}{suffix}.r{RENDER_VERSION}{_ext()}")
+
+
+def _stale_paths(key: str, root: str = None, preset: str = DEFAULT_PRESET) -> List[str]:
+    """Names earlier render versions (or the unversioned naming before them) used for `key`."""
+    suffix = "" if preset == DEFAULT_PRESET else f".{preset}"
+    versions = [""] + [f".r{v}" for v in range(1, RENDER_VERSION)]
+    return [os.path.join(previews_dir(root), f"{key}.{size}{suffix}{v}{ext}")
+            for size in SIZES for v in versions for ext in MEDIA_TYPES]
+
+
+def legacy_path(key: str, root: str = None) -> str:
+    """PNG written on demand by earlier versions (uploads/previews/<key>.png)."""
+    return os.path.join(previews_dir(root), f"{key}.png")
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def key_for(filename: str) -> str:
+    """
+    Preview key from a requested name: drops the image extension, then a DICOM extension, so
+    `<sha>.png`, `<sha>.dcm.png` (the full stored basename plus .png, as the chat view builds it)
+    and `<legacy>.dcm.png` all resolve to the blob hash or legacy file stem.
+    """
+    key = filename
+    for ext in tuple(MEDIA_TYPES) + SOURCE_EXTS:
+        if key.lower().endswith(ext):
+            key = key[:-len(ext)]
+            break
+    for ext in SOURCE_EXTS:
+        if key.lower().endswith(ext):
+            key = key[:-len(ext)]
+            break
+    return key
+
+
+def source_for(key: str, root: str = None) -> Optional[str]:
+    """The stored DICOM a preview key refers to: a blob, or a legacy uploads/<key>.dcm file."""
+    root = root or UPLOAD_DIR
+    if blob_store.is_hash(key):
+        return blob_store.find_blob(key, root)
+    for candidate in (os.path.join(root, key + ".dcm"), os.path.join(root, key)):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def iter_sources(root: str = None):
+    """Yield (key, path) for every stored DICOM: blobs (key = sha256) and legacy uploads/*.dcm."""
+    root = root or UPLOAD_DIR
+    blobs = os.path.join(root, blob_store.BLOBS_DIRNAME)
+    for dirpath, _, names in os.walk(blobs):
+        for name in names:
+            key = os.path.splitext(name)[0]
+            if blob_store.is_hash(key):
+                yield key, os.path.join(dirpath, name)
+    with os.scandir(root) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.lower().endswith('.dcm'):
+                yield entry.name[:-4], entry.path
+
+
+def is_complete(key: str, root: str = None, preset: str = DEFAULT_PRESET) -> bool:
+    return all(os.path.exists(preview_path(key, size, root, preset)) for size in SIZES)
+
+
+def find(key: str, size: str = DEFAULT_SIZE, root: str = None,
+         preset: str = DEFAULT_PRESET) -> Optional[Tuple[str, bool]]:
+    """
+    Path of the best precomputed preview for `key` and whether it is the requested size. Falls
+    back to the nearest other size of the same preset (then, for the default preset, a legacy
+    PNG) while the requested one is not written yet.
+    """
+    exact = preview_path(key, size, root, preset)
+    if os.path.exists(exact):
+        return exact, True
+    names = list(SIZES)
+    at = names.index(size) if size in names else 0
+    for other in sorted(names, key=lambda n: abs(names.index(n) - at)):
+        path = preview_path(key, other, root, preset)
+        if os.path.exists(path):
+            return path, False
+    legacy = legacy_path(key, root)
+    if preset == DEFAULT_PRESET and os.path.exists(legacy):
+        return legacy, False
+    return None
+
+
+@lru_cache(maxsize=1)
+def placeholder() -> bytes:
+    """Small neutral grey PNG served while a slice's preview is still being rendered."""
+    import io
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new("L", (SIZES["thumb"], SIZES["thumb"]), 64).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _save(img, path: str, lossless: bool):
+    tmp = f"{path}.{uuid.uuid4().hex}.part"
+    if PREVIEW_FORMAT == "webp":
+        img.save(tmp, format="WEBP", quality=PREVIEW_QUALITY, lossless=lossless, method=4)
+    else:
+        img.save(tmp, format="PNG", optimize=False)
+    os.replace(tmp, path)
+
+
+def render(key: str, src_path: str, root: str = None, force: bool = False,
+           preset: str = DEFAULT_PRESET) -> List[str]:
+    """
+    Decode `src_path` once and write every missing size, or every size with force=True
+    (blocking). Returns the paths written.
+    """
+    from PIL import Image
+
+    os.makedirs(previews_dir(root), exist_ok=True)
+    todo = [s for s in SIZES if force or not os.path.exists(preview_path(key, s, root, preset))]
+    if not todo:
+        return []
+    base = Image.fromarray(rendering.render(src_path, preset))
+    if base.mode not in ("L", "RGB"):
+        base = base.convert("L")
+    written = []
+    for size in todo:
+        edge = SIZES[size]
+        img = base
+        if edge and max(base.size) > edge:
+            img = base.copy()
+            img.thumbnail((edge, edge), Image.LANCZOS)
+        path = preview_path(key, size, root, preset)
+        _save(img, path, lossless=edge is None)
+        written.append(path)
+    for stale in _stale_paths(key, root, preset):
+        try:
+            os.remove(stale)
+        except OSError:
+            pass
+    return written
+
+
+def _run(key: str, src_path: str, root: str, preset: str):
+    t0 = time.perf_counter()
+    try:
+        render(key, src_path, root, preset=preset)
+        RENDERED.inc(result="ok")
+        RENDER_SECONDS.observe(time.perf_counter() - t0)
+    except Exception as e:
+        RENDERED.inc(result="error")
+        print(f"[previews] failed to render {key}: {e}")
+    finally:
+        with _executor_lock:
+            _pending.pop((key, preset), None)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, PREVIEW_WORKERS), thread_name_prefix="previews")
+        return _executor
+
+
+def schedule(key: str, src_path: Optional[str] = None, root: str = None, preset: str = DEFAULT_PRESET):
+    """Render the previews of `key` in the background unless they exist or are already queued."""
+    if is_complete(key, root, preset):
+        return None
+    src_path = src_path or source_for(key, root)
+    if not src_path:
+        return None
+    executor = _get_executor()
+    with _executor_lock:
+        future = _pending.get((key, preset))
+        if future is None:
+            future = _pending[(key, preset)] = executor.submit(_run, key, src_path, root, preset)
+        return future
+
+
+def schedule_stored(stored_files, root: str = None):
+    """Schedule previews for freshly ingested uploads (upload_ingest.StoredUpload)."""
+    for stored in stored_files:
+        schedule(stored.sha256, stored.path, root)
+
+
+def backfill(root: str = None) -> int:
+    """Queue the default previews of every stored DICOM that is missing some; returns the count."""
+    queued = 0
+    try:
+        for key, path in iter_sources(root):
+            if schedule(key, path, root) is not None:
+                queued += 1
+    except Exception as e:
+        print(f"[previews] backfill stopped: {e}")
+    if queued:
+        print(f"[previews] backfill queued {queued} slice(s) without previews")
+    return queued
+
+
+def shutdown(wait: bool = False):
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
@@ -0,0 +1,200 @@
+# backend/rendering.py
+"""Display rendering of DICOM slices: stored pixel values to 8-bit grey levels.
+
+Applies what a DICOM viewer would, in order: the modality rescale (RescaleSlope/Intercept),
+a VOI transform (the file's VOI LUT Sequence or WindowCenter/WindowWidth with its
+VOILUTFunction, or one of PRESETS) and MONOCHROME1 inversion. Only one frame of a multi-frame
+file is decoded (the middle one unless asked otherwise).
+
+For integer pixel data (the usual 8/16-bit MR and CT) the whole chain is folded into a 256- or
+65536-entry uint8 lookup table over the stored values, so a frame costs one table lookup and no
+float copy; tables are cached per (rescale, window, inversion). Percentile and min/max windows
+come from a histogram of the stored values (np.bincount), not a sort. Other data (float pixels,
+32-bit integers) goes through a float32 path.
+
+This is for display only: the CNN input keeps its own normalization (preprocessing.py).
+"""
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+import pydicom
+from pydicom.multival import MultiValue
+from pydicom.pixels import pixel_array
+
+# kind "voi": the file's own VOI LUT / window, falling back to "percentile" when it has none.
+# "window" presets are in modality units (Hounsfield for CT) and only make sense for such data.
+PRESETS = {
+    "auto": {"kind": "voi"},
+    "percentile": {"kind": "percentile", "low": 0.5, "high": 99.5},
+    "full": {"kind": "minmax"},
+    "brain": {"kind": "window", "center": 40.0, "width": 80.0},
+    "bone": {"kind": "window", "center": 300.0, "width": 1500.0},
+}
+DEFAULT_PRESET = "auto"
+
+
+def _first(value) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return float(value[0]) if isinstance(value, (list, tuple, MultiValue)) else float(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def _rescale(ds) -> Tuple[float, float]:
+    slope = _first(ds.get("RescaleSlope"))
+    intercept = _first(ds.get("RescaleIntercept"))
+    return (slope if slope else 1.0), (intercept or 0.0)
+
+
+def frame_count(ds) -> int:
+    try:
+        return max(1, int(ds.get("NumberOfFrames") or 1))
+    except (TypeError, ValueError):
+        return 1
+
+
+def decode_frame(ds, frame: Optional[int] = None) -> np.ndarray:
+    """Stored values of one frame (default: the middle one); decodes only that frame."""
+    n = frame_count(ds)
+    if n <= 1:
+        return ds.pixel_array
+    index = n // 2 if frame is None else int(frame)
+    if not 0 <= index < n:
+        raise ValueError(f"frame must be between 0 and {n - 1}")
+    return pixel_array(ds, index=index)
+
+
+def _window_lut(x: np.ndarray, center: float, width: float, function: str) -> np.ndarray:
+    """DICOM PS3.3 C.11.2.1.2 VOI window over modality values `x`, to 0..255 floats."""
+    if function == "SIGMOID":
+        return 255.0 / (1.0 + np.exp(-4.0 * (x - center) / max(width, 1e-6)))
+    if function == "LINEAR_EXACT":
+        return ((x - center) / max(width, 1e-6) + 0.5) * 255.0
+    # LINEAR
+    return ((x - (center - 0.5)) / max(width - 1.0, 1e-6) + 0.5) * 255.0
+
+
+@lru_cache(maxsize=64)
+def _lut(n: int, signed: bool, slope: float, intercept: float, center: float, width: float,
+         function: str, invert: bool) -> np.ndarray:
+    """uint8 table indexed by stored value (signed values offset by the sign bit, see _lut_index)."""
+    x = _domain(n, signed) * slope + intercept
+    y = np.clip(np.rint(_window_lut(x, center, width, function)), 0, 255).astype(np.uint8)
+    if invert:
+        y = 255 - y
+    y.setflags(write=False)
+    return y
+
+
+def _domain(n: int, signed: bool) -> np.ndarray:
+    """Stored value at each LUT index."""
+    idx = np.arange(n, dtype=np.int64)
+    return idx - n // 2 if signed else idx
+
+
+def _lut_index(arr: np.ndarray) -> Optional[Tuple[np.ndarray, int, bool]]:
+    """(index array, table size, signed) for 8/16-bit integer data, else None."""
+    if arr.dtype.kind not in "ui" or arr.dtype.itemsize > 2:
+        return None
+    n = 1 << (8 * arr.dtype.itemsize)
+    if arr.dtype.kind == "u":
+        return arr, n, False
+    # two's complement -> offset binary: flipping the sign bit keeps the order
+    unsigned = arr.view(np.uint8 if n == 256 else np.uint16)
+    return unsigned ^ np.array(n // 2, dtype=unsigned.dtype), n, True
+
+
+def _stats_range(idx: np.ndarray, n: int, signed: bool, low: float = 0.0, high: float = 100.0) -> Tuple[float, float]:
+    """Stored values at the `low`/`high` percentiles, from a histogram."""
+    counts = np.bincount(idx.ravel(), minlength=n)
+    cdf = np.cumsum(counts)
+    total = cdf[-1]
+    lo_i = int(np.searchsorted(cdf, total * low / 100.0, side="right")) if low > 0 else int(np.flatnonzero(counts)[0])
+    hi_i = int(np.searchsorted(cdf, total * high / 100.0, side="left")) if high < 100 else int(np.flatnonzero(counts)[-1])
+    domain = _domain(n, signed)
+    return float(domain[min(lo_i, n - 1)]), float(domain[min(hi_i, n - 1)])
+
+
+def _file_window(ds) -> Optional[Tuple[float, float, str]]:
+    center, width = _first(ds.get("WindowCenter")), _first(ds.get("WindowWidth"))
+    if center is None or not width:
+        return None
+    function = str(ds.get("VOILUTFunction") or "LINEAR").upper()
+    return center, width, function
+
+
+def _range_window(lo: float, hi: float) -> Tuple[float, float, str]:
+    """Window mapping [lo, hi] linearly onto 0..255."""
+    return (lo + hi) / 2.0, max(hi - lo, 1e-6), "LINEAR_EXACT"
+
+
+def _render_voi_lut_sequence(ds, arr: np.ndarray) -> Optional[np.ndarray]:
+    if "VOILUTSequence" not in ds:
+        return None
+    try:
+        from pydicom.pixels import apply_modality_lut, apply_voi
+        item = ds.VOILUTSequence[0]
+        bits = int(item.LUTDescriptor[2])
+        out = apply_voi(apply_modality_lut(arr, ds), ds, index=0)
+        return np.clip(out * (255.0 / ((1 << bits) - 1)), 0, 255).astype(np.uint8)
+    except Exception as e:
+        print(f"[rendering] ignoring unusable VOI LUT Sequence: {e}")
+        return None
+
+
+def to_uint8(ds, arr: np.ndarray, preset: str = DEFAULT_PRESET) -> np.ndarray:
+    """Map the stored values `arr` of one frame of `ds` to display grey levels."""
+    if preset not in PRESETS:
+        raise ValueError(f"unknown preset {preset!r}, expected one of {tuple(PRESETS)}")
+    spec = PRESETS[preset]
+    if arr.ndim == 3:
+        # colour (RGB / decoded YBR): already display values
+        return arr if arr.dtype == np.uint8 else np.clip(arr, 0, 255).astype(np.uint8)
+    invert = str(ds.get("PhotometricInterpretation", "")).upper() == "MONOCHROME1"
+    slope, intercept = _rescale(ds)
+
+    if spec["kind"] == "voi":
+        out = _render_voi_lut_sequence(ds, arr)
+        if out is not None:
+            return 255 - out if invert else out
+        window = _file_window(ds)
+        if window is None:
+            spec = PRESETS["percentile"]
+    else:
+        window = None
+    if spec["kind"] == "window":
+        window = (spec["center"], spec["width"], "LINEAR")
+
+    indexed = _lut_index(arr)
+    if indexed is None:
+        return _to_uint8_float(arr, spec, window, slope, intercept, invert)
+    idx, n, signed = indexed
+    if window is None:
+        low, high = (spec["low"], spec["high"]) if spec["kind"] == "percentile" else (0.0, 100.0)
+        lo, hi = _stats_range(idx, n, signed, low, high)
+        window = _range_window(*sorted((lo * slope + intercept, hi * slope + intercept)))
+    lut = _lut(n, signed, slope, intercept, float(window[0]), float(window[1]), window[2], invert)
+    return lut[idx]
+
+
+def _to_uint8_float(arr, spec, window, slope, intercept, invert) -> np.ndarray:
+    x = arr.astype(np.float32)
+    x *= slope
+    x += intercept
+    if window is None:
+        if spec["kind"] == "percentile":
+            lo, hi = np.percentile(x, [spec["low"], spec["high"]])
+        else:
+            lo, hi = float(x.min()), float(x.max())
+        window = _range_window(float(lo), float(hi))
+    y = np.clip(np.rint(_window_lut(x, *window)), 0, 255).astype(np.uint8)
+    return 255 - y if invert else y
+
+
+def render(src, preset: str = DEFAULT_PRESET, frame: Optional[int] = None) -> np.ndarray:
+    """Display image (uint8, 2D grey or HxWx3 colour) of one frame of a DICOM path or dataset."""
+    ds = src if isinstance(src, pydicom.Dataset) else pydicom.dcmread(src)
+    return to_uint8(ds, decode_frame(ds, frame), preset)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Micro-benchmark: legacy per-slice preprocessing vs the buffer-based pipeline.
+
+Usage (from the backend folder):
+    python scripts/bench_preprocessing.py [--slices 64] [--size 512]
+
+Writes synthetic uint16 DICOM slices to a temp dir, then reports, for each implementation,
+the mean time per slice and the peak Python-heap allocation per slice (tracemalloc).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import cv2
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import preprocessing  # noqa: E402
+
+
+def legacy_preprocess(filepath):
+    """The original cnn_predictor._preprocess_from_path, kept here for comparison."""
+    dcm = pydicom.dcmread(filepath)
+    img = dcm.pixel_array.astype(np.float32)
+    img = (img - img.min()) / (img.max() - img.min() + 1e-5)
+    img = cv2.resize(img, preprocessing.TARGET_SHAPE, interpolation=cv2.INTER_AREA)
+    if img.ndim == 2:
+        img = img[..., np.newaxis]
+    img = np.repeat(img, 3, axis=-1)
+    img = np.expand_dims(img, axis=0).astype(np.float32)
+    return img
+
+
+def write_slice(path, size, rng):
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = rng.integers(0, 4096, (size, size), dtype=np.uint16).tobytes()
+    ds.save_as(path, enforce_file_format=True)
+
+
+def run_legacy(paths):
+    batch = [legacy_preprocess(p) for p in paths]
+    return np.concatenate(batch, axis=0)
+
+
+def run_buffered(paths):
+    buf = preprocessing.BatchBuffer(len(paths))
+    for p in paths:
+        preprocessing.preprocess_into(p, buf.next_slot())
+        buf.commit(p)
+    return buf.view()
+
+
+def measure(fn, paths, repeats):
+    fn(paths)  # warm-up (file cache, imports)
+    tracemalloc.start()
+    fn(paths)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn(paths)
+    elapsed = (time.perf_counter() - t0) / (repeats * len(paths))
+    return elapsed, peak / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slices", type=int, default=64)
+    parser.add_argument("--size", type=int, default=512, help="slice width/height in pixels")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(args.slices):
+            p = os.path.join(tmp, f"{i}.dcm")
+            write_slice(p, args.size, rng)
+            paths.append(p)
+
+        diff = np.abs(run_legacy(paths) - run_buffered(paths)).max()
+        print(f"{args.slices} slices of {args.size}x{args.size} uint16, max abs diff vs legacy: {diff:.2e}")
+        for name, fn in (("legacy", run_legacy), ("buffered", run_buffered)):
+            per_slice, peak = measure(fn, paths, args.repeats)
+            print(f"{name:>9}: {per_slice * 1e3:7.3f} ms/slice, peak alloc {peak / 1024:8.1f} KiB/slice")
+
+
+if __name__ == '__main__':
+    main()
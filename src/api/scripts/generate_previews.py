@@ -1,87 +1,215 @@
 #!/usr/bin/env python3
-"""Batch-generate PNG previews for existing DICOM files in backend/uploads.
+"""Backfill the precomputed previews (see previews.py) for DICOM files already in backend/uploads.
 
-Usage:
-  python generate_previews.py
+Usage (from the backend folder):
+  python scripts/generate_previews.py [--workers N] [--check mtime|hash] [--dry-run] [--force]
 
-This will scan the `uploads` directory adjacent to this script's parent package
-and write PNGs into `uploads/previews/` for any `*.dcm` files that don't yet
-have a corresponding PNG.
+Scans both the content-addressed blobs (uploads/blobs/**) and legacy flat uploads
+(uploads/*.dcm) and renders every preview size for the ones that are new or changed, on
+--workers processes (default: all cores). Progress is printed as it goes. The API also queues
+missing previews itself at startup (previews.backfill, on its small thread pool); this script is
+for large or forced re-renders with many processes.
+
+A manifest (--manifest, default preview_manifest.json next to the database) records, per
+preview key, the source file's size and mtime (--check mtime, default) or sha256 (--check hash)
+along with the preview format and sizes. A file is only re-rendered when that signature
+changes or one of its previews is missing, so an interrupted run resumes where it stopped: the
+manifest is saved every --save-every files and on Ctrl-C. Blobs are named by their hash and
+never change, so for them the mtime check is exact.
+
+--dry-run renders nothing: it reports what is pending and estimates the run time from a few
+sample renders into a temporary directory.
 
 Requires: pydicom, pillow, numpy
 Install: pip install pydicom pillow numpy
 """
+import argparse
+import hashlib
+import json
 import os
 import sys
-from pathlib import Path
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-try:
-    from pydicom import dcmread
-    from PIL import Image
-    import numpy as np
-except Exception as e:
-    print("Missing dependencies. Run: pip install pydicom pillow numpy")
-    raise
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import previews  # noqa: E402
 
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+UPLOADS = os.path.join(BACKEND, 'uploads')
+MANIFEST = os.path.join(BACKEND, 'preview_manifest.json')
+MANIFEST_VERSION = 1
 
-def ensure_previews_dir(uploads_dir: Path) -> Path:
-    previews = uploads_dir / "previews"
-    previews.mkdir(parents=True, exist_ok=True)
-    return previews
 
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def generate_preview(dcm_path: Path, png_path: Path) -> bool:
-    try:
-        ds = dcmread(str(dcm_path))
-        arr = ds.pixel_array.astype(float)
-        if arr.max() == arr.min():
-            norm = (arr * 0).astype('uint8')
-        else:
-            norm = ((arr - arr.min()) / (arr.max() - arr.min()) * 255.0).astype('uint8')
 
-        img = Image.fromarray(norm)
-        # convert to a compatible mode
-        if img.mode != 'RGB' and img.mode != 'L':
-            img = img.convert('L')
+def signature(path: str, check: str) -> dict:
+    st = os.stat(path)
+    sig = {'size': st.st_size}
+    if check == 'hash':
+        sig['sha256'] = file_sha256(path)
+    else:
+        sig['mtime'] = st.st_mtime
+    return sig
+
 
-        img.save(str(png_path))
-        return True
-    except Exception as e:
-        print(f"Failed to generate preview for {dcm_path.name}: {e}")
-        return False
+def render_settings() -> dict:
+    return {'format': previews.PREVIEW_FORMAT, 'sizes': previews.SIZES, 'version': previews.RENDER_VERSION}
+
+
+def load_manifest(path: str) -> dict:
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') == MANIFEST_VERSION:
+            return data
+    except (OSError, ValueError):
+        pass
+    return {'version': MANIFEST_VERSION, 'entries': {}}
+
+
+def save_manifest(path: str, manifest: dict):
+    tmp = f"{path}.part"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def plan(uploads: str, manifest: dict, check: str, force: bool):
+    """
+    Split the sources into (pending, up_to_date); pending items are (key, path, signature,
+    reason). Manifest entries of files that no longer exist are dropped.
+    """
+    settings = render_settings()
+    entries = manifest['entries']
+    pending, up_to_date, seen = [], 0, set()
+    for key, path in previews.iter_sources(uploads):
+        seen.add(key)
+        try:
+            sig = signature(path, check)
+        except OSError:
+            continue
+        known = entries.get(key)
+        if force:
+            reason = 'forced'
+        elif known is None:
+            reason = 'new'
+        elif known.get('source') != sig or known.get('settings') != settings:
+            reason = 'changed'
+        elif not previews.is_complete(key, uploads):
+            reason = 'missing'
+        else:
+            up_to_date += 1
+            continue
+        pending.append((key, path, sig, reason))
+    for key in set(entries) - seen:
+        del entries[key]
+    return pending, up_to_date
+
+
+def render_one(key: str, path: str, uploads: str, force: bool):
+    """Worker entry point (runs in a child process)."""
+    t0 = time.perf_counter()
+    previews.render(key, path, uploads, force=force)
+    return time.perf_counter() - t0
+
+
+def estimate(pending, workers: int, samples: int) -> float:
+    """Seconds the backfill should take, from `samples` renders into a throw-away directory."""
+    if not pending or samples <= 0:
+        return 0.0
+    step = max(1, len(pending) // samples)
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for key, path, _, _ in pending[::step][:samples]:
+            try:
+                timings.append(render_one(key, path, tmp, True))
+            except Exception as e:
+                print(f"  sample {key} failed: {e}")
+    if not timings:
+        return 0.0
+    return sum(timings) / len(timings) * len(pending) / max(1, workers)
 
 
 def main():
-    base = Path(__file__).resolve().parents[1]  # project backend/.. parent
-    uploads = base / 'uploads'
-    if not uploads.exists():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', default=UPLOADS, help='uploads folder to scan')
+    parser.add_argument('--manifest', default=MANIFEST, help='resumable manifest (JSON)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='render processes')
+    parser.add_argument('--check', choices=('mtime', 'hash'), default='mtime',
+                        help='how a changed source is detected (hash reads every file)')
+    parser.add_argument('--force', action='store_true', help='re-render everything')
+    parser.add_argument('--dry-run', action='store_true', help='report and estimate pending work only')
+    parser.add_argument('--samples', type=int, default=5, help='sample renders for the --dry-run estimate')
+    parser.add_argument('--save-every', type=int, default=100, help='save the manifest every N files')
+    args = parser.parse_args()
+
+    uploads = os.path.abspath(args.uploads)
+    if not os.path.isdir(uploads):
         print(f"Uploads directory not found: {uploads}")
         sys.exit(1)
 
-    previews = ensure_previews_dir(uploads)
-
-    dcm_files = sorted([p for p in uploads.iterdir() if p.is_file() and p.suffix.lower() == '.dcm'])
-    if not dcm_files:
-        print("No .dcm files found in uploads/")
+    manifest = load_manifest(args.manifest)
+    t0 = time.perf_counter()
+    pending, up_to_date = plan(uploads, manifest, args.check, args.force)
+    reasons = {}
+    for *_, reason in pending:
+        reasons[reason] = reasons.get(reason, 0) + 1
+    pending_bytes = sum(sig['size'] for _, _, sig, _ in pending)
+    print(f"Scanned {len(pending) + up_to_date} DICOM files in {time.perf_counter() - t0:.1f}s: "
+          f"{up_to_date} up to date, {len(pending)} pending {reasons or ''} ({pending_bytes / 1e6:.1f} MB)")
+
+    if args.dry_run:
+        seconds = estimate(pending, args.workers, args.samples)
+        if seconds:
+            print(f"Estimated time with {args.workers} worker(s): {seconds / 60:.1f} min (dry run, nothing written)")
+        return
+    if not pending:
         return
 
-    print(f"Found {len(dcm_files)} DICOM files. Generating previews into {previews}")
-    created = 0
-    skipped = 0
-    failed = 0
-    for d in dcm_files:
-        png_name = d.stem + '.png'
-        png_path = previews / png_name
-        if png_path.exists():
-            skipped += 1
-            continue
-        ok = generate_preview(d, png_path)
-        if ok:
-            created += 1
-        else:
-            failed += 1
-
-    print(f"Done. created={created}, skipped={skipped}, failed={failed}")
+    settings = render_settings()
+    entries = manifest['entries']
+    done = failed = 0
+    started = last_report = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=max(1, args.workers))
+    try:
+        futures = {
+            executor.submit(render_one, key, path, uploads, reason in ('changed', 'forced')): (key, path, sig)
+            for key, path, sig, reason in pending
+        }
+        for future in as_completed(futures):
+            key, path, sig = futures[future]
+            try:
+                future.result()
+                entries[key] = {'source': sig, 'settings': settings, 'path': os.path.relpath(path, uploads)}
+                done += 1
+            except Exception as e:
+                failed += 1
+                print(f"Failed to generate previews for {key}: {e}")
+            finished = done + failed
+            if finished % max(1, args.save_every) == 0:
+                save_manifest(args.manifest, manifest)
+            now = time.perf_counter()
+            if now - last_report >= 2 or finished == len(pending):
+                last_report = now
+                rate = finished / (now - started)
+                eta = (len(pending) - finished) / rate if rate else 0
+                print(f"[{finished}/{len(pending)}] {rate:.1f} files/s, eta {eta:.0f}s, failed={failed}")
+    except KeyboardInterrupt:
+        print("Interrupted, saving progress (re-run to resume)")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        save_manifest(args.manifest, manifest)
+        executor.shutdown(wait=True)
+
+    print(f"Done. created={done}, skipped={up_to_date}, failed={failed} in {time.perf_counter() - started:.1f}s")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""Load test: drive the API in-process with concurrent requests and report latency per route.
+
+Usage (from the backend folder):
+    python scripts/load_test.py [--requests 500] [--concurrency 16] \
+        [--mix create_case=1,neurologist_cases=4,patients_archive=1,chat=2] [--out report.json]
+
+Everything runs against a throw-away workspace (temp SQLite database and uploads folder), so
+the real medidiagnose.db and uploads/ are never touched:
+  * the database is seeded with --patients/--neurologists users, --cases-per-patient cases and
+    --slices-per-case synthetic DICOM slices each (drawn from --distinct-slices blobs);
+  * the CNN is a tiny random-weight Keras model registered as the active version, and
+    --analysis-workers in-process workers analyse the cases that create_case enqueues;
+  * the chatbot is a stub: retrieval returns fixed chunks and the LLM sleeps --llm-latency-ms.
+Requests go through httpx's ASGI transport (no server, no network). The JSON report holds the
+run configuration, throughput and p50/p95/p99 latencies per route; run it on two branches with
+the same arguments and --seed to compare them.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+DEFAULT_MIX = "create_case=1,neurologist_cases=4,patients_archive=1,chat=2"
+ROUTES = ("create_case", "neurologist_cases", "patients_archive", "chat")
+CHAT_QUESTIONS = (
+    "Quels sont les symptômes moteurs les plus fréquents ?",
+    "Combien de patients présentent des tremblements ?",
+    "Résume le dernier cas analysé.",
+)
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ROUTES:
+            raise SystemExit(f"unknown route {name!r} in --mix, expected one of {ROUTES}")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise SystemExit("--mix must give at least one route a positive weight")
+    return mix
+
+
+def dicom_bytes(size: int, rng: np.random.Generator) -> bytes:
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.SeriesInstanceUID = generate_uid()
+    ds.Modality = "MR"
+    ds.Rows = ds.Columns = size
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = rng.integers(0, 4096, (size, size), dtype=np.uint16).tobytes()
+    buf = io.BytesIO()
+    ds.save_as(buf, enforce_file_format=True)
+    return buf.getvalue()
+
+
+def setup_workspace(workdir: str):
+    """Point the database and every upload root at `workdir`; must run before importing main."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import database
+
+    database.engine = create_engine(f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+                                    connect_args={"check_same_thread": False})
+    database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+    database.init_db()
+
+    uploads = os.path.join(workdir, "uploads")
+    os.makedirs(uploads, exist_ok=True)
+    import blob_store
+    import cnn_predictor
+    import previews
+    import upload_sessions
+    import main
+    for module in (main, blob_store, cnn_predictor, previews, upload_sessions):
+        module.UPLOAD_DIR = uploads
+    return main, uploads
+
+
+def install_tiny_model(seed: int):
+    """Register a random-weight two-class CNN (same input shape as the real one) as the active version."""
+    import tensorflow as tf
+    import cnn_predictor
+    from model_registry import ModelVersion
+    from preprocessing import TARGET_SHAPE
+
+    tf.random.set_seed(seed)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(*TARGET_SHAPE, 3)),
+        tf.keras.layers.Conv2D(4, 3, strides=4, activation="relu"),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(2, activation="softmax"),
+    ])
+    cnn_predictor.registry.register(ModelVersion("loadtest-random", model), activate=True)
+    cnn_predictor._warm_up(model)
+
+
+def install_stub_chatbot(main, latency_ms: float):
+    def search_relevant_chunks(query, top_k=5):
+        return [f"Patient {i}: tremblements, rigidité, bradykinésie." for i in range(top_k)]
+
+    def generate_chatbot_response(query, context_chunks):
+        time.sleep(latency_ms / 1000.0)
+        return f"Réponse simulée ({len(context_chunks)} extraits)."
+
+    main.chatbot_service = types.SimpleNamespace(
+        faiss_index=object(),
+        build_faiss_index=lambda: None,
+        search_relevant_chunks=search_relevant_chunks,
+        generate_chatbot_response=generate_chatbot_response,
+    )
+
+
+def seed_database(args, uploads: str, slice_pool: list) -> dict:
+    """Bulk-insert users, patient info, cases and images; returns the ids used to pick callers."""
+    import auth
+    import blob_store
+    import database
+    import models
+
+    rng = random.Random(args.seed)
+    blobs = []
+    incoming = os.path.join(uploads, blob_store.INCOMING_DIRNAME)
+    os.makedirs(incoming, exist_ok=True)
+    for data in slice_pool[:args.distinct_slices]:
+        tmp = os.path.join(incoming, f"{uuid.uuid4().hex}.part")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        sha = hashlib.sha256(data).hexdigest()
+        relpath, _ = blob_store.put_file(tmp, sha, ".dcm", root=uploads)
+        blobs.append((relpath, sha, len(data)))
+
+    now = datetime.utcnow()
+    users, infos, cases, images = [], [], [], []
+    ids = {"patient": [], "neurologist": [], "admin": []}
+
+    def add_user(role, i):
+        user_id = str(uuid.uuid4())
+        users.append(dict(id=user_id, email=f"{role}{i}@loadtest.local", hashed_password="x", role=role,
+                          first_name=role.capitalize(), last_name=str(i), created_at=now))
+        ids[role].append(user_id)
+        return user_id
+
+    add_user("admin", 0)
+    for i in range(args.neurologists):
+        add_user("neurologist", i)
+    for i in range(args.patients):
+        patient_id = add_user("patient", i)
+        infos.append(dict(id=str(uuid.uuid4()), user_id=patient_id, first_name="Patient", last_name=str(i),
+                          age=rng.randint(40, 90), gender=rng.choice(["M", "F"]),
+                          tremblements=rng.random() < 0.5, rigidite=rng.random() < 0.4))
+        for _ in range(args.cases_per_patient):
+            case_id = str(uuid.uuid4())
+            created = now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))
+            cases.append(dict(id=case_id, patient_id=patient_id, description="synthetic case",
+                              status=rng.choice(["pending", "analyzed", "completed"]),
+                              created_at=created, updated_at=created))
+            for _ in range(args.slices_per_case):
+                relpath, sha, size = rng.choice(blobs)
+                images.append(dict(id=str(uuid.uuid4()), case_id=case_id, filename=os.path.basename(relpath),
+                                   file_path=blob_store.url_for(relpath), content_hash=sha,
+                                   size_bytes=size, uploaded_at=created))
+
+    db = database.SessionLocal()
+    try:
+        db.bulk_insert_mappings(models.User, users)
+        db.bulk_insert_mappings(models.InfoPatient, infos)
+        db.bulk_insert_mappings(models.MedicalCase, cases)
+        db.bulk_insert_mappings(models.MRIImage, images)
+        db.commit()
+    finally:
+        db.close()
+
+    tokens = {role: [auth.create_access_token({"sub": uid}, timedelta(hours=12)) for uid in user_ids]
+              for role, user_ids in ids.items()}
+    return {"tokens": tokens, "users": len(users), "cases": len(cases), "images": len(images)}
+
+
+def build_request(route: str, seeded: dict, slice_pool: list, args, rng: random.Random) -> dict:
+    tokens = seeded["tokens"]
+    if route == "create_case":
+        picks = rng.sample(range(len(slice_pool)), min(args.upload_slices, len(slice_pool)))
+        files = [("files", (f"slice{i}.dcm", slice_pool[i], "application/dicom")) for i in picks]
+        return dict(method="POST", url="/cases/create", files=files, data={"description": "load test"},
+                    headers={"Authorization": f"Bearer {rng.choice(tokens['patient'])}"})
+    if route == "neurologist_cases":
+        return dict(method="GET", url="/neurologist/cases",
+                    headers={"Authorization": f"Bearer {rng.choice(tokens['neurologist'])}"})
+    if route == "patients_archive":
+        return dict(method="GET", url="/admin/patients_archive",
+                    headers={"Authorization": f"Bearer {tokens['admin'][0]}"})
+    return dict(method="POST", url="/chat", json={"question": rng.choice(CHAT_QUESTIONS)})
+
+
+async def drive(app, seeded: dict, slice_pool: list, args, mix: dict) -> dict:
+    import httpx
+
+    rng = random.Random(args.seed)
+    names, weights = list(mix), list(mix.values())
+    plan = rng.choices(names, weights=weights, k=args.warmup + args.requests)
+    samples = {name: [] for name in names}
+    statuses = {name: {} for name in names}
+    next_index = 0
+    deadline = time.perf_counter() + args.duration if args.duration > 0 else None
+
+    async def worker(client, worker_rng):
+        nonlocal next_index
+        while True:
+            i = next_index
+            if (deadline is None and i >= len(plan)) or (deadline is not None and time.perf_counter() >= deadline):
+                return
+            next_index += 1
+            route = plan[i % len(plan)]
+            req = build_request(route, seeded, slice_pool, args, worker_rng)
+            t0 = time.perf_counter()
+            try:
+                resp = await client.request(**req)
+                status = str(resp.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - t0
+            if i >= args.warmup:
+                samples[route].append(elapsed)
+                statuses[route][status] = statuses[route].get(status, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(client, random.Random(args.seed + 1 + w)) for w in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+    return {"samples": samples, "statuses": statuses, "wall": wall}
+
+
+def summarize(latencies: list, statuses: dict, wall: float) -> dict:
+    arr = np.asarray(latencies, dtype=np.float64) * 1000.0
+    ok = sum(n for s, n in statuses.items() if s.isdigit() and int(s) < 400)
+    out = {
+        "requests": int(arr.size),
+        "errors": int(arr.size - ok),
+        "status_codes": dict(sorted(statuses.items())),
+        "throughput_rps": round(arr.size / wall, 2) if wall > 0 else None,
+    }
+    if arr.size:
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        out.update(mean_ms=round(float(arr.mean()), 2), p50_ms=round(float(p50), 2),
+                   p95_ms=round(float(p95), 2), p99_ms=round(float(p99), 2), max_ms=round(float(arr.max()), 2))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500, help="measured requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=0, help="run for this many seconds instead")
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent first and left out of the report")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"route=weight list, routes: {', '.join(ROUTES)}")
+    parser.add_argument("--patients", type=int, default=200)
+    parser.add_argument("--neurologists", type=int, default=10)
+    parser.add_argument("--cases-per-patient", type=int, default=2)
+    parser.add_argument("--slices-per-case", type=int, default=16)
+    parser.add_argument("--distinct-slices", type=int, default=64, help="distinct DICOM blobs the seeded images share")
+    parser.add_argument("--slice-size", type=int, default=128, help="synthetic slice width/height in pixels")
+    parser.add_argument("--upload-slices", type=int, default=8, help="DICOM files per create_case request")
+    parser.add_argument("--analysis-workers", type=int, default=1, help="in-process workers analysing new cases")
+    parser.add_argument("--llm-latency-ms", type=float, default=50.0, help="stub LLM response time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="keep the temp workspace and print its path")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    # the API logs to stdout; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        main_module, uploads = setup_workspace(workdir)
+        import analysis_worker
+        import preprocessing
+        import previews
+
+        np_rng = np.random.default_rng(args.seed)
+        pool_size = max(args.distinct_slices, args.upload_slices)
+        slice_pool = [dicom_bytes(args.slice_size, np_rng) for _ in range(pool_size)]
+        t0 = time.perf_counter()
+        seeded = seed_database(args, uploads, slice_pool)
+        seed_seconds = time.perf_counter() - t0
+        install_tiny_model(args.seed)
+        install_stub_chatbot(main_module, args.llm_latency_ms)
+        stop = analysis_worker.start_background_workers(args.analysis_workers)
+
+        try:
+            result = asyncio.run(drive(main_module.app, seeded, slice_pool, args, mix))
+        finally:
+            stop.set()
+            preprocessing.shutdown_pool()
+            # previews of the uploaded slices render in the background; let them finish
+            previews.shutdown(wait=True)
+
+    all_latencies = [x for s in result["samples"].values() for x in s]
+    all_statuses = {}
+    for st in result["statuses"].values():
+        for code, n in st.items():
+            all_statuses[code] = all_statuses.get(code, 0) + n
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "keep")},
+        "seeded": {k: seeded[k] for k in ("users", "cases", "images")},
+        "seed_seconds": round(seed_seconds, 2),
+        "wall_seconds": round(result["wall"], 2),
+        "routes": {name: summarize(result["samples"][name], result["statuses"][name], result["wall"])
+                   for name in mix},
+        "total": summarize(all_latencies, all_statuses, result["wall"]),
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.keep:
+        print(f"workspace kept in {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
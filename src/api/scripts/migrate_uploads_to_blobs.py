@@ -0,0 +1,81 @@
+"""Move legacy flat uploads (uploads/<uuid>.dcm) into the content-addressed blob store.
+
+Run from the `backend` folder in the venv:
+    python scripts/migrate_uploads_to_blobs.py [--dry-run]
+
+For every mri_images row whose file_path is not yet under /uploads/blobs/, the file is hashed,
+moved to uploads/blobs/<aa>/<bb>/<sha256><ext> (or dropped if identical content is already
+stored) and the row's filename, file_path, content_hash and size_bytes are updated. An existing
+preview PNG is renamed after the hash. Safe to run multiple times.
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import blob_store  # noqa: E402
+
+DB = os.path.join(os.path.dirname(__file__), '..', 'medidiagnose.db')
+UPLOADS = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='report what would be moved without changing anything')
+    args = parser.parse_args()
+
+    db = os.path.abspath(DB)
+    uploads = os.path.abspath(UPLOADS)
+    if not os.path.exists(db):
+        print("Database file not found:", db)
+        return
+
+    con = sqlite3.connect(db)
+    cur = con.cursor()
+    cur.execute("SELECT id, filename, file_path FROM mri_images WHERE file_path IS NULL OR file_path NOT LIKE '/uploads/blobs/%'")
+    rows = cur.fetchall()
+    moved = deduplicated = missing = 0
+    for image_id, filename, file_path in rows:
+        rel = file_path[len('/uploads/'):] if file_path and file_path.startswith('/uploads/') else filename
+        src = os.path.join(uploads, rel or '')
+        if not rel or not os.path.isfile(src):
+            missing += 1
+            continue
+        sha = file_sha256(src)
+        ext = os.path.splitext(src)[1]
+        if args.dry_run:
+            print(f"{src} -> {blob_store.relpath_for(sha, ext)}")
+            moved += 1
+            continue
+
+        size = os.path.getsize(src)
+        relpath, created = blob_store.put_file(src, sha, ext, root=uploads)
+        moved += created
+        deduplicated += not created
+        cur.execute(
+            "UPDATE mri_images SET filename = ?, file_path = ?, content_hash = ?, size_bytes = ? WHERE id = ?",
+            (os.path.basename(relpath), blob_store.url_for(relpath), sha, size, image_id),
+        )
+        con.commit()
+
+        old_preview = os.path.join(uploads, blob_store.PREVIEWS_DIRNAME, os.path.splitext(os.path.basename(src))[0] + '.png')
+        new_preview = os.path.join(uploads, blob_store.PREVIEWS_DIRNAME, sha + '.png')
+        if os.path.exists(old_preview):
+            os.replace(old_preview, new_preview)
+
+    con.close()
+    print(f"Done. moved={moved}, deduplicated={deduplicated}, missing={missing}{' (dry run)' if args.dry_run else ''}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+# backend/series.py
+"""Series-aware (volumetric) view of a case's DICOM files.
+
+`discover` reads headers only (no pixel data): files are grouped by SeriesInstanceUID, multi-frame
+files are expanded into one slice per frame, and slices are ordered along the acquisition axis
+(ImagePositionPatient projected on the slice normal, then SliceLocation, InstanceNumber, file
+name). `sample` picks the slices worth scoring and `aggregate_groups` turns per-slice softmax
+outputs into one case-level probability vector.
+"""
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pydicom
+
+import preprocessing
+
+# "all", "uniform" (evenly spaced over the volume) or "center" (evenly spaced over the central
+# SERIES_CENTER_FRACTION of the volume: the first and last slices are mostly skull/neck)
+SERIES_SAMPLING = os.getenv("CNN_SERIES_SAMPLING", "center").lower()
+SERIES_CENTER_FRACTION = float(os.getenv("CNN_SERIES_CENTER_FRACTION", "0.6"))
+# Slices scored per series at most (0 = no cap)
+SERIES_MAX_SLICES = int(os.getenv("CNN_SERIES_MAX_SLICES", "32"))
+# How slice outputs are combined: "mean", "median", "trimmed_mean" or "vote"
+AGGREGATION = os.getenv("CNN_AGGREGATION", "mean").lower()
+TRIM_FRACTION = float(os.getenv("CNN_AGGREGATION_TRIM", "0.1"))
+
+SAMPLING_STRATEGIES = ("all", "uniform", "center")
+AGGREGATION_STRATEGIES = ("mean", "median", "trimmed_mean", "vote")
+
+
+class SliceRef:
+    """One 2D slice: a file, or one frame of a multi-frame file (see preprocessing.frame_key)."""
+
+    def __init__(self, path: str, frame: Optional[int] = None, position: Optional[float] = None,
+                 instance_number: Optional[int] = None):
+        self.path = path
+        self.frame = frame
+        self.position = position
+        self.instance_number = instance_number
+
+    @property
+    def key(self) -> str:
+        return preprocessing.frame_key(self.path, self.frame)
+
+    def sort_key(self):
+        return (
+            self.position is None, self.position or 0.0,
+            self.instance_number is None, self.instance_number or 0,
+            os.path.basename(self.path), self.frame or 0,
+        )
+
+
+class Series:
+    def __init__(self, uid: str, number: Optional[int] = None):
+        self.uid = uid
+        self.number = number
+        self.slices: List[SliceRef] = []
+
+    def keys(self) -> List[str]:
+        return [s.key for s in self.slices]
+
+
+def _float_list(value) -> Optional[List[float]]:
+    try:
+        return [float(v) for v in value]
+    except Exception:
+        return None
+
+
+def _projected(position, orientation) -> Optional[float]:
+    """Distance along the slice normal (cross product of the row and column direction cosines)."""
+    pos, ori = _float_list(position), _float_list(orientation)
+    if not pos or len(pos) != 3:
+        return None
+    if not ori or len(ori) != 6:
+        return pos[2]
+    normal = np.cross(ori[:3], ori[3:])
+    return float(np.dot(normal, pos))
+
+
+def _int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except Exception:
+        return None
+
+
+def _slices_for_file(path: str, ds) -> List[SliceRef]:
+    orientation = ds.get("ImageOrientationPatient")
+    instance = _int_or_none(ds.get("InstanceNumber"))
+    n_frames = _int_or_none(ds.get("NumberOfFrames")) or 1
+    if n_frames <= 1:
+        position = _projected(ds.get("ImagePositionPatient"), orientation)
+        if position is None and ds.get("SliceLocation") is not None:
+            position = float(ds.SliceLocation)
+        return [SliceRef(path, None, position, instance)]
+
+    # enhanced multi-frame: per-frame positions live in the functional groups
+    if orientation is None:
+        try:
+            orientation = ds.SharedFunctionalGroupsSequence[0].PlaneOrientationSequence[0].ImageOrientationPatient
+        except Exception:
+            orientation = None
+    per_frame = ds.get("PerFrameFunctionalGroupsSequence")
+    out = []
+    for i in range(n_frames):
+        position = None
+        try:
+            position = _projected(per_frame[i].PlanePositionSequence[0].ImagePositionPatient, orientation)
+        except Exception:
+            pass
+        # no geometry: frames are stored in acquisition order
+        out.append(SliceRef(path, i, position if position is not None else float(i), instance))
+    return out
+
+
+def slice_keys(filepaths: Sequence[str]) -> List[str]:
+    """Slice keys of `filepaths` in input order; a multi-frame file gives one key per frame."""
+    keys = []
+    for fp in filepaths:
+        try:
+            ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        except Exception:
+            keys.append(fp)  # reported when its pixels fail to decode
+            continue
+        keys.extend(s.key for s in _slices_for_file(fp, ds))
+    return keys
+
+
+def discover(filepaths: Sequence[str]) -> List[Series]:
+    """Group and order the slices of `filepaths` by series. Unreadable files are skipped."""
+    by_uid: Dict[str, Series] = {}
+    for fp in filepaths:
+        try:
+            ds = pydicom.dcmread(fp, stop_before_pixels=True)
+        except Exception as e:
+            print(f"[series] cannot read header of {fp}: {e}")
+            continue
+        uid = str(ds.get("SeriesInstanceUID") or "unknown")
+        series = by_uid.get(uid)
+        if series is None:
+            series = by_uid[uid] = Series(uid, _int_or_none(ds.get("SeriesNumber")))
+        series.slices.extend(_slices_for_file(fp, ds))
+    for series in by_uid.values():
+        series.slices.sort(key=SliceRef.sort_key)
+    return sorted(by_uid.values(), key=lambda s: (s.number is None, s.number or 0, s.uid))
+
+
+def sample(slices: Sequence, max_slices: Optional[int] = None, strategy: Optional[str] = None,
+           center_fraction: Optional[float] = None) -> list:
+    """Ordered subset of `slices` to score, per `strategy` (see SERIES_SAMPLING)."""
+    strategy = (strategy or SERIES_SAMPLING).lower()
+    max_slices = SERIES_MAX_SLICES if max_slices is None else max_slices
+    center_fraction = SERIES_CENTER_FRACTION if center_fraction is None else center_fraction
+    if strategy not in SAMPLING_STRATEGIES:
+        raise ValueError(f"unknown sampling strategy {strategy!r}, expected one of {SAMPLING_STRATEGIES}")
+    items = list(slices)
+    if strategy == "center" and len(items) > 2:
+        keep = max(1, int(round(len(items) * min(1.0, max(0.0, center_fraction)))))
+        start = (len(items) - keep) // 2
+        items = items[start:start + keep]
+    if strategy == "all" or max_slices <= 0 or len(items) <= max_slices:
+        return items
+    idx = np.unique(np.linspace(0, len(items) - 1, max_slices).round().astype(int))
+    return [items[i] for i in idx]
+
+
+def spread_order(n: int) -> List[int]:
+    """
+    Permutation of range(n) in van der Corput order (0, n/2, n/4, 3n/4, ...), so any prefix
+    covers the whole volume roughly evenly instead of one end of it.
+    """
+    if n <= 0:
+        return []
+    m = 1 << max(0, (n - 1).bit_length())
+    bits = max(1, m.bit_length() - 1)
+    seen, order = set(), []
+    for k in range(m):
+        rev = int(format(k, f"0{bits}b")[::-1], 2) if m > 1 else 0
+        i = rev * n // m
+        if i not in seen:
+            seen.add(i)
+            order.append(i)
+    return order
+
+
+def interleave(groups: Sequence[Sequence[str]]) -> List[str]:
+    """Round-robin over the groups, each visited in spread_order."""
+    ordered = [[g[i] for i in spread_order(len(g))] for g in groups]
+    out = []
+    for rank in range(max((len(g) for g in ordered), default=0)):
+        out.extend(g[rank] for g in ordered if rank < len(g))
+    return out
+
+
+def aggregate(probs: Sequence, strategy: Optional[str] = None) -> np.ndarray:
+    """Combine (n, num_classes) slice outputs into one probability vector."""
+    strategy = (strategy or AGGREGATION).lower()
+    arr = np.asarray(probs, dtype=np.float64)
+    if strategy == "mean":
+        return arr.mean(axis=0)
+    if strategy == "median":
+        return np.median(arr, axis=0)
+    if strategy == "trimmed_mean":
+        cut = int(len(arr) * TRIM_FRACTION)
+        if cut == 0 or len(arr) - 2 * cut < 1:
+            return arr.mean(axis=0)
+        return np.sort(arr, axis=0)[cut:len(arr) - cut].mean(axis=0)
+    if strategy == "vote":
+        votes = np.bincount(arr.argmax(axis=1), minlength=arr.shape[1])
+        return votes / votes.sum()
+    raise ValueError(f"unknown aggregation {strategy!r}, expected one of {AGGREGATION_STRATEGIES}")
+
+
+def aggregate_groups(groups: Sequence[Sequence], strategy: Optional[str] = None) -> np.ndarray:
+    """Aggregate each non-empty group (series) of slice outputs, then average the groups equally."""
+    per_group = [aggregate(g, strategy) for g in groups if len(g)]
+    if not per_group:
+        raise ValueError("no predictions to aggregate")
+    return np.mean(per_group, axis=0)
@@ -0,0 +1,76 @@
+# backend/tflite_model.py
+"""Lightweight TFLite runtime wrapper used by cnn_predictor.
+
+The wrapper exposes the small subset of the Keras API that the predictor relies on
+(`predict(x, batch_size=None, verbose=0)`), so a `.tflite` artifact exported with
+`src/models/export.py` can be served without importing the whole of TensorFlow.
+"""
+import threading
+
+import numpy as np
+
+
+def _load_interpreter_class():
+    """Return the first available TFLite Interpreter class, lightest runtime first."""
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except Exception:
+        pass
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except Exception:
+        pass
+    # full TensorFlow ships an interpreter too; only used when nothing lighter is installed
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+def tflite_available() -> bool:
+    try:
+        _load_interpreter_class()
+        return True
+    except Exception:
+        return False
+
+
+class TFLiteModel:
+    """Keras-like predictor backed by a TFLite interpreter."""
+
+    def __init__(self, model_path: str, num_threads: int = None):
+        Interpreter = _load_interpreter_class()
+        kwargs = {"model_path": model_path}
+        if num_threads:
+            kwargs["num_threads"] = int(num_threads)
+        self.model_path = model_path
+        self._interpreter = Interpreter(**kwargs)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = int(self._input["shape"][0])
+        # the interpreter is not thread-safe; serialize invocations
+        self._lock = threading.Lock()
+
+    @property
+    def input_shape(self):
+        return tuple(int(d) for d in self._input["shape"][1:])
+
+    def _resize(self, batch: int):
+        if batch == self._batch:
+            return
+        self._interpreter.resize_tensor_input(self._input["index"], [batch, *self.input_shape])
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch = batch
+
+    def predict(self, x, batch_size=None, verbose=0):
+        x = np.asarray(x)
+        with self._lock:
+            self._resize(len(x))
+            # inputs may be zero-stride channel views (see preprocessing.as_model_input)
+            self._interpreter.set_tensor(self._input["index"], np.ascontiguousarray(x, dtype=np.float32))
+            self._interpreter.invoke()
+            # copy: get_tensor returns a view into the interpreter's buffers
+            return np.array(self._interpreter.get_tensor(self._output["index"]), dtype=np.float32)
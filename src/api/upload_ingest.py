@@ -0,0 +1,224 @@
+# backend/upload_ingest.py
+"""Non-blocking upload ingestion for MRI files.
+
+Each `UploadFile` is copied to disk in fixed-size chunks on a worker thread (never on the
+event loop), hashed with sha256 as it streams, checked against per-file and per-request size
+limits, written to a temporary `.part` file and atomically renamed into the content-addressed
+blob store (see blob_store.py) once complete.
+
+A zip or tar archive of a DICOM series is extracted one entry at a time through the same path
+(nothing is unpacked up front). A single file and each archive entry must parse as a DICOM
+image or it is reported as failed and dropped. Size limits apply to the uncompressed entries.
+
+When a request is rejected (413) its blobs are not deleted outright: another upload may have
+deduplicated against one of them meanwhile. `discard` hands them to blob_store.release, the
+same reference and GC_GRACE_SECONDS checks as garbage collection, so a fresh blob is left for
+the periodic blob_store.sweep to collect.
+"""
+import asyncio
+import hashlib
+import os
+import tarfile
+import uuid
+import zipfile
+from typing import Iterable, List, Optional, Tuple
+
+import pydicom
+from fastapi import HTTPException, UploadFile
+from sqlalchemy.orm import Session
+
+import blob_store
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+MAX_FILE_BYTES = int(float(os.getenv("UPLOAD_MAX_FILE_MB", "512")) * 1024 * 1024)
+MAX_REQUEST_BYTES = int(float(os.getenv("UPLOAD_MAX_REQUEST_MB", "4096")) * 1024 * 1024)
+INCOMING_DIRNAME = blob_store.INCOMING_DIRNAME
+MAX_ARCHIVE_ENTRIES = int(os.getenv("UPLOAD_MAX_ARCHIVE_ENTRIES", "5000"))
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Bytes of MRI files ingested")
+UPLOAD_FILE_BYTES = metrics.histogram(
+    "upload_file_bytes", "Size of each ingested MRI file",
+    buckets=tuple(2 ** p for p in range(14, 33, 2)))  # 16 KiB .. 4 GiB
+UPLOAD_FILES = metrics.counter("upload_files_total", "MRI files ingested (deduplicated = blob already stored)",
+                               labelnames=("result",))
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, *args):
+        super().__init__(*args)
+        # what the failing call had already stored (e.g. earlier archive entries), for discard()
+        self.stored: List["StoredUpload"] = []
+
+
+class IngestBudget:
+    """Byte accounting shared by all files of one request."""
+
+    def __init__(self, max_file_bytes: int = None, max_request_bytes: int = None):
+        self.max_file_bytes = MAX_FILE_BYTES if max_file_bytes is None else max_file_bytes
+        self.max_request_bytes = MAX_REQUEST_BYTES if max_request_bytes is None else max_request_bytes
+        self.total = 0
+
+    def consume(self, n: int, file_total: int):
+        self.total += n
+        if file_total > self.max_file_bytes:
+            raise UploadTooLarge(f"file exceeds {self.max_file_bytes} bytes")
+        if self.total > self.max_request_bytes:
+            raise UploadTooLarge(f"request exceeds {self.max_request_bytes} bytes")
+
+
+class StoredUpload:
+    def __init__(self, relpath: str, path: str, sha256: str, size: int, original_name: str, created: bool):
+        self.relpath = relpath
+        self.filename = os.path.basename(relpath)
+        self.url = blob_store.url_for(relpath)
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.original_name = original_name
+        # False when identical content was already stored (deduplicated)
+        self.created = created
+
+
+def check_content_length(content_length: Optional[str]):
+    """Reject a request up front when its declared body is already over the request limit."""
+    try:
+        declared = int(content_length) if content_length else None
+    except ValueError:
+        declared = None
+    if declared is not None and declared > MAX_REQUEST_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload too large (max {MAX_REQUEST_BYTES} bytes)")
+
+
+def is_archive(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def validate_dicom(path: str):
+    """Raise unless `path` is a DICOM file carrying an image (header only, pixels not decoded)."""
+    ds = pydicom.dcmread(path, stop_before_pixels=True)
+    if "Rows" not in ds or "Columns" not in ds:
+        raise ValueError("DICOM file has no image")
+
+
+def _copy_to_disk(src, dest_dir: str, ext: str, original_name: str, budget: IngestBudget,
+                  validate=None) -> StoredUpload:
+    incoming = os.path.join(dest_dir, INCOMING_DIRNAME)
+    os.makedirs(incoming, exist_ok=True)
+    tmp_path = os.path.join(incoming, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = src.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                budget.consume(len(chunk), size)
+                digest.update(chunk)
+                out.write(chunk)
+        if validate is not None:
+            validate(tmp_path)
+        sha256 = digest.hexdigest()
+        relpath, created = blob_store.put_file(tmp_path, sha256, ext, root=dest_dir)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    UPLOAD_BYTES.inc(size)
+    UPLOAD_FILE_BYTES.observe(size)
+    UPLOAD_FILES.inc(result="stored" if created else "deduplicated")
+    return StoredUpload(relpath, os.path.join(dest_dir, *relpath.split("/")), sha256, size, original_name, created)
+
+
+async def ingest_upload(file: UploadFile, dest_dir: str, budget: IngestBudget,
+                        validate=validate_dicom) -> StoredUpload:
+    """
+    Stream `file` into the blob store rooted at `dest_dir` without blocking the event loop.
+    `validate(path)` runs on the complete temp file and rejects it by raising.
+    """
+    original_name = getattr(file, "filename", None) or "upload"
+    ext = os.path.splitext(original_name)[1]
+    return await asyncio.to_thread(_copy_to_disk, file.file, dest_dir, ext, original_name, budget, validate)
+
+
+def _skip_entry(name: str) -> bool:
+    base = os.path.basename(name.rstrip("/"))
+    return not base or base.startswith(".") or base.upper() == "DICOMDIR" or "__MACOSX" in name
+
+
+def _iter_archive(src, archive_name: str):
+    """Yield (entry name, readable file object) for the regular files of a zip/tar, in order."""
+    if archive_name.lower().endswith(".zip"):
+        with zipfile.ZipFile(src) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or _skip_entry(info.filename):
+                    continue
+                with zf.open(info) as entry:
+                    yield info.filename, entry
+    else:
+        # streaming mode: members are read sequentially, without seeking
+        with tarfile.open(fileobj=src, mode="r|*") as tf:
+            for member in tf:
+                if not member.isfile() or _skip_entry(member.name):
+                    continue
+                yield member.name, tf.extractfile(member)
+
+
+def _extract_archive(src, dest_dir: str, archive_name: str,
+                     budget: IngestBudget) -> Tuple[List[StoredUpload], List[dict]]:
+    stored, failed = [], []
+    try:
+        for count, (name, entry) in enumerate(_iter_archive(src, archive_name), start=1):
+            if count > MAX_ARCHIVE_ENTRIES:
+                raise UploadTooLarge(f"archive has more than {MAX_ARCHIVE_ENTRIES} entries")
+            label = f"{archive_name}:{name}"
+            try:
+                stored.append(_copy_to_disk(entry, dest_dir, ".dcm", label, budget, validate=validate_dicom))
+            except UploadTooLarge:
+                raise
+            except Exception as e:
+                failed.append({"filename": label, "error": f"{type(e).__name__}: {e}"})
+    except UploadTooLarge as e:
+        e.stored.extend(stored)
+        raise
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        # corrupt/truncated archive: keep what was extracted before the damage
+        failed.append({"filename": archive_name, "error": f"{type(e).__name__}: {e}"})
+    return stored, failed
+
+
+def ingest_fileobj(src, dest_dir: str, filename: str,
+                   budget: IngestBudget) -> Tuple[List[StoredUpload], List[dict]]:
+    """
+    Blocking ingest of one readable stream named `filename` (an archive is extracted; zip archives
+    need a seekable stream). Returns (stored, failed). Run it off the event loop.
+    """
+    if is_archive(filename):
+        return _extract_archive(src, dest_dir, filename, budget)
+    ext = os.path.splitext(filename)[1]
+    try:
+        return [_copy_to_disk(src, dest_dir, ext, filename, budget, validate=validate_dicom)], []
+    except UploadTooLarge:
+        raise
+    except Exception as e:
+        return [], [{"filename": filename, "error": f"{type(e).__name__}: {e}"}]
+
+
+async def ingest_archive(file: UploadFile, dest_dir: str,
+                         budget: IngestBudget) -> Tuple[List[StoredUpload], List[dict]]:
+    """Extract a zip/tar DICOM series entry by entry into the blob store. Returns (stored, failed)."""
+    archive_name = getattr(file, "filename", None) or "upload"
+    return await asyncio.to_thread(_extract_archive, file.file, dest_dir, archive_name, budget)
+
+
+def discard(db: Session, stored_files: Iterable[StoredUpload], root: str = None) -> List[str]:
+    """
+    Release the blobs created by a rejected ingest. Only blobs that no MRIImage row references
+    and that are past the GC grace period go (blob_store.release); returns the hashes removed.
+    """
+    return blob_store.release(db, [s.sha256 for s in stored_files if s.created], root)
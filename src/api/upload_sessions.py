@@ -0,0 +1,246 @@
+# backend/upload_sessions.py
+"""Resumable chunked uploads.
+
+A client creates a session for one file (a DICOM slice or a zip/tar series archive) of known
+size, PUTs its fixed-size numbered chunks in any order (retries and parallel PUTs are fine: a
+chunk is written to a temp file and atomically renamed, so re-sending it simply replaces it),
+then finalizes. Session and chunk state live in the database and the chunks under
+`uploads/.sessions/<session_id>/`, so an API restart loses nothing: the client asks which chunks
+are missing and resumes. Finalizing streams the chunks, in order, through the normal ingest
+path (upload_ingest.py).
+"""
+import hashlib
+import math
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+import models
+import upload_ingest
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
+SESSIONS_DIRNAME = ".sessions"
+DEFAULT_CHUNK_BYTES = int(float(os.getenv("UPLOAD_CHUNK_MB", "8")) * 1024 * 1024)
+MAX_CHUNK_BYTES = int(float(os.getenv("UPLOAD_MAX_CHUNK_MB", "64")) * 1024 * 1024)
+SESSION_TTL_HOURS = float(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+# a finalize that has not finished after this long (API crashed mid-way) can be retried
+FINALIZE_LEASE_SECONDS = float(os.getenv("UPLOAD_FINALIZE_LEASE_SECONDS", "600"))
+
+
+class _ChunkReader:
+    """Read-only stream over the chunk files of a session, in order."""
+
+    def __init__(self, paths: List[str]):
+        self._paths = iter(paths)
+        self._f = None
+
+    def read(self, n: int = -1) -> bytes:
+        while True:
+            if self._f is None:
+                path = next(self._paths, None)
+                if path is None:
+                    return b""
+                self._f = open(path, "rb")
+            data = self._f.read(n)
+            if data:
+                return data
+            self._f.close()
+            self._f = None
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+def session_dir(session_id: str, root: str = None) -> str:
+    return os.path.join(root or UPLOAD_DIR, SESSIONS_DIRNAME, session_id)
+
+
+def _chunk_path(session_id: str, index: int, root: str = None) -> str:
+    return os.path.join(session_dir(session_id, root), f"{index:06d}.chunk")
+
+
+def create(db: Session, user_id: str, filename: str, total_size: int, chunk_size: Optional[int] = None,
+           case_id: Optional[str] = None, description: Optional[str] = None) -> models.UploadSession:
+    """Open a session. Raises ValueError for sizes outside the upload limits."""
+    total_size = int(total_size)
+    chunk_size = int(chunk_size or DEFAULT_CHUNK_BYTES)
+    if total_size <= 0:
+        raise ValueError("total_size must be positive")
+    if not 0 < chunk_size <= MAX_CHUNK_BYTES:
+        raise ValueError(f"chunk_size must be between 1 and {MAX_CHUNK_BYTES} bytes")
+    limit = upload_ingest.MAX_REQUEST_BYTES if upload_ingest.is_archive(filename) else upload_ingest.MAX_FILE_BYTES
+    if total_size > limit:
+        raise ValueError(f"total_size exceeds {limit} bytes")
+    now = datetime.utcnow()
+    session = models.UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        case_id=case_id,
+        description=description,
+        filename=os.path.basename(filename or "upload"),
+        total_size=total_size,
+        chunk_size=chunk_size,
+        total_chunks=math.ceil(total_size / chunk_size),
+        status="open",
+        created_at=now,
+        expires_at=now + timedelta(hours=SESSION_TTL_HOURS),
+    )
+    db.add(session)
+    db.commit()
+    return session
+
+
+def expected_size(session: models.UploadSession, index: int) -> int:
+    if not 0 <= index < session.total_chunks:
+        raise ValueError(f"chunk index must be between 0 and {session.total_chunks - 1}")
+    if index == session.total_chunks - 1:
+        return session.total_size - session.chunk_size * (session.total_chunks - 1)
+    return session.chunk_size
+
+
+def write_chunk(session: models.UploadSession, index: int, data: bytes,
+                sha256: Optional[str] = None, root: str = None) -> str:
+    """
+    Persist one chunk (blocking; run off the event loop). The size must match the chunk's slot
+    and, when given, the sha256 must match the data. Returns the chunk's sha256.
+    """
+    expected = expected_size(session, index)
+    if len(data) != expected:
+        raise ValueError(f"chunk {index} must be {expected} bytes, got {len(data)}")
+    digest = hashlib.sha256(data).hexdigest()
+    if sha256 and sha256.lower() != digest:
+        raise ValueError(f"chunk {index} sha256 mismatch")
+    path = _chunk_path(session.id, index, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return digest
+
+
+def record_chunk(db: Session, session: models.UploadSession, index: int, size: int, sha256: str):
+    db.merge(models.UploadChunk(session_id=session.id, chunk_index=index, size=size, sha256=sha256,
+                                received_at=datetime.utcnow()))
+    session.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def received(db: Session, session: models.UploadSession) -> List[int]:
+    rows = db.query(models.UploadChunk.chunk_index).filter(models.UploadChunk.session_id == session.id).all()
+    return sorted(r[0] for r in rows)
+
+
+def missing(db: Session, session: models.UploadSession, root: str = None) -> List[int]:
+    """Chunk indexes still to be sent (recorded chunks whose file is gone count as missing)."""
+    have = {i for i in received(db, session) if os.path.exists(_chunk_path(session.id, i, root))}
+    return [i for i in range(session.total_chunks) if i not in have]
+
+
+def describe(db: Session, session: models.UploadSession, root: str = None) -> dict:
+    return {
+        "session_id": session.id,
+        "filename": session.filename,
+        "status": session.status,
+        "total_size": session.total_size,
+        "chunk_size": session.chunk_size,
+        "total_chunks": session.total_chunks,
+        "missing_chunks": missing(db, session, root) if session.status == "open" else [],
+        "case_id": session.result_case_id or session.case_id,
+        "expires_at": session.expires_at.isoformat() if session.expires_at else None,
+    }
+
+
+def begin_finalize(db: Session, session: models.UploadSession) -> bool:
+    """Move the session from open to finalizing; False if another request got there first."""
+    Upload = models.UploadSession
+    now = datetime.utcnow()
+    claimed = db.query(Upload).filter(
+        Upload.id == session.id,
+        or_(
+            Upload.status == "open",
+            and_(Upload.status == "finalizing", Upload.updated_at < now - timedelta(seconds=FINALIZE_LEASE_SECONDS)),
+        ),
+    ).update({Upload.status: "finalizing", Upload.updated_at: now}, synchronize_session=False)
+    db.commit()
+    db.refresh(session)
+    return claimed == 1
+
+
+def abort_finalize(db: Session, session: models.UploadSession):
+    session.status = "open"
+    db.commit()
+
+
+def ingest(session: models.UploadSession, budget: upload_ingest.IngestBudget,
+           root: str = None) -> Tuple[list, List[dict]]:
+    """
+    Stream the session's chunks, in order, through upload_ingest (blocking; run off the event
+    loop). Zip archives need random access, so their chunks are first joined into one temp file.
+    """
+    root = root or UPLOAD_DIR
+    paths = [_chunk_path(session.id, i, root) for i in range(session.total_chunks)]
+    if not session.filename.lower().endswith(".zip"):
+        reader = _ChunkReader(paths)
+        try:
+            return upload_ingest.ingest_fileobj(reader, root, session.filename, budget)
+        finally:
+            reader.close()
+
+    incoming = os.path.join(root, upload_ingest.INCOMING_DIRNAME)
+    os.makedirs(incoming, exist_ok=True)
+    joined = os.path.join(incoming, f"{session.id}.zip.part")
+    try:
+        with open(joined, "wb") as out:
+            for path in paths:
+                with open(path, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        with open(joined, "rb") as f:
+            return upload_ingest.ingest_fileobj(f, root, session.filename, budget)
+    finally:
+        try:
+            os.remove(joined)
+        except OSError:
+            pass
+
+
+def complete(db: Session, session: models.UploadSession, case_id: str, commit: bool = True):
+    """Mark the session finalized (in the caller's transaction when commit=False)."""
+    session.status = "finalized"
+    session.result_case_id = case_id
+    db.query(models.UploadChunk).filter(models.UploadChunk.session_id == session.id).delete(synchronize_session=False)
+    if commit:
+        db.commit()
+
+
+def discard_chunks(session_id: str, root: str = None):
+    shutil.rmtree(session_dir(session_id, root), ignore_errors=True)
+
+
+def expire(db: Session, root: str = None) -> int:
+    """
+    Drop the chunks of open sessions past their expiry, and of sessions stuck in finalizing (the
+    API died mid-finalize and the client never retried) for FINALIZE_LEASE_SECONDS plus the
+    session TTL. Returns the number expired.
+    """
+    Upload = models.UploadSession
+    now = datetime.utcnow()
+    abandoned = now - timedelta(seconds=FINALIZE_LEASE_SECONDS) - timedelta(hours=SESSION_TTL_HOURS)
+    stale = db.query(Upload).filter(or_(
+        and_(Upload.status == "open", Upload.expires_at < now),
+        and_(Upload.status == "finalizing", Upload.updated_at < abandoned),
+    )).all()
+    for session in stale:
+        session.status = "expired"
+        db.query(models.UploadChunk).filter(models.UploadChunk.session_id == session.id).delete(synchronize_session=False)
+    db.commit()
+    for session in stale:
+        discard_chunks(session.id, root)
+    return len(stale)
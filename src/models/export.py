@@ -0,0 +1,77 @@
+# src/models/export.py
+"""
+Export du modèle CNN (build_cnn) vers TFLite pour l'API.
+
+Usage:
+    python -m src.models.export --model src/api/models/cnn_parkinson_model.h5
+
+Par défaut l'artefact est écrit à côté du .h5 (même nom, extension .tflite), là où
+`cnn_predictor` le cherche en priorité. Les variantes quantifiées (voir quantization.py)
+sont écrites sous `<nom>.<variante>.tflite`.
+"""
+import argparse
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+QUANTIZATION_MODES = ("float16", "int8")
+
+
+def variant_path(base_path, quantization=None):
+    """Chemin de l'artefact TFLite pour une variante donnée (None = float32)."""
+    root = os.path.splitext(base_path)[0]
+    return f"{root}.{quantization}.tflite" if quantization else f"{root}.tflite"
+
+
+def export_tflite(model, output_path, quantization=None, representative_data=None, num_calibration=100):
+    """
+    Convertit un modèle Keras (objet ou chemin .h5) en fichier .tflite.
+    quantization: None (float32), "float16" (poids en float16) ou "int8" (poids et
+    activations en int8, entrées/sorties float32). Le mode int8 exige
+    `representative_data`, un tableau (N,128,128,3) issu des données d'entraînement.
+    Retourne le chemin écrit.
+    """
+    if isinstance(model, (str, os.PathLike)):
+        model = tf.keras.models.load_model(model, compile=False)
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if representative_data is None:
+            raise ValueError("int8 quantization needs representative_data for calibration")
+        calib = np.asarray(representative_data, dtype=np.float32)[:num_calibration]
+
+        def _representative_dataset():
+            for i in range(len(calib)):
+                yield [calib[i:i + 1]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = _representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif quantization is not None:
+        raise ValueError(f"unknown quantization mode: {quantization} (expected one of {QUANTIZATION_MODES})")
+    tflite_bytes = converter.convert()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "wb") as f:
+        f.write(tflite_bytes)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export du modèle CNN vers TFLite")
+    parser.add_argument("--model", required=True, help="chemin du modèle Keras (.h5)")
+    parser.add_argument("--output", default=None, help="chemin du fichier .tflite (défaut: à côté du .h5)")
+    args = parser.parse_args()
+
+    output = args.output or variant_path(args.model)
+    export_tflite(args.model, output)
+    print(f"✅ Modèle exporté : {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
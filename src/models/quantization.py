@@ -0,0 +1,122 @@
+# src/models/quantization.py
+"""
+Quantification post-entraînement (float16 / int8) avec garde-fou de précision.
+
+Chaque variante est convertie dans un fichier temporaire, évaluée sur le test set avec
+`compute_all_metrics`, puis publiée sous `<nom>.<variante>.tflite` SEULEMENT si la perte
+d'accuracy et de recall par rapport au modèle Keras reste sous les seuils configurés.
+
+Usage:
+    python -m src.models.quantization --model src/api/models/cnn_parkinson_model.h5 --modes int8 float16
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+from .export import QUANTIZATION_MODES, export_tflite, variant_path
+from ..utils.metrics import compute_all_metrics
+
+# Pertes maximales tolérées (en points absolus) avant de refuser la publication
+MAX_ACCURACY_DROP = float(os.getenv("QUANT_MAX_ACCURACY_DROP", "0.01"))
+MAX_RECALL_DROP = float(os.getenv("QUANT_MAX_RECALL_DROP", "0.01"))
+
+
+def _tflite_predict(tflite_path, X, batch_size=32):
+    interpreter = tf.lite.Interpreter(model_path=tflite_path)
+    inp = interpreter.get_input_details()[0]
+    out = interpreter.get_output_details()[0]
+    preds = []
+    for i in range(0, len(X), batch_size):
+        batch = np.asarray(X[i:i + batch_size], dtype=np.float32)
+        interpreter.resize_tensor_input(inp["index"], list(batch.shape))
+        interpreter.allocate_tensors()
+        interpreter.set_tensor(inp["index"], batch)
+        interpreter.invoke()
+        preds.append(np.array(interpreter.get_tensor(out["index"])))
+    return np.concatenate(preds, axis=0)
+
+
+def quantize_with_gate(model, X_calib, X_test, y_test, modes=QUANTIZATION_MODES, output_base=None,
+                       max_accuracy_drop=MAX_ACCURACY_DROP, max_recall_drop=MAX_RECALL_DROP):
+    """
+    Produit et évalue chaque variante de `modes`.
+    model: modèle Keras ou chemin .h5 (output_base par défaut = ce chemin).
+    Retourne un dict {"baseline": metrics, "variants": {mode: rapport}} où chaque rapport
+    contient les métriques, la taille, `published` et, en cas de refus, `reason`.
+    """
+    if isinstance(model, (str, os.PathLike)):
+        output_base = output_base or str(model)
+        model = tf.keras.models.load_model(model, compile=False)
+    if output_base is None:
+        raise ValueError("output_base is required when passing an in-memory model")
+
+    y_test = np.asarray(y_test).reshape(-1)
+    baseline_pred = np.argmax(model.predict(X_test, verbose=0), axis=1)
+    baseline = compute_all_metrics(y_test, baseline_pred)
+    report = {"baseline": baseline, "variants": {}}
+
+    for mode in modes:
+        final_path = variant_path(output_base, mode)
+        tmp_path = final_path + ".tmp"
+        export_tflite(model, tmp_path, quantization=mode, representative_data=X_calib)
+        pred = np.argmax(_tflite_predict(tmp_path, X_test), axis=1)
+        metrics = compute_all_metrics(y_test, pred)
+
+        acc_drop = baseline["accuracy"] - metrics["accuracy"]
+        rec_drop = baseline["recall"] - metrics["recall"]
+        entry = {
+            "metrics": metrics,
+            "accuracy_drop": float(acc_drop),
+            "recall_drop": float(rec_drop),
+            "size_bytes": os.path.getsize(tmp_path),
+            "path": final_path,
+            "published": False,
+        }
+        if acc_drop > max_accuracy_drop:
+            entry["reason"] = f"accuracy drop {acc_drop:.4f} > {max_accuracy_drop}"
+        elif rec_drop > max_recall_drop:
+            entry["reason"] = f"recall drop {rec_drop:.4f} > {max_recall_drop}"
+
+        if "reason" in entry:
+            os.remove(tmp_path)
+            print(f"❌ Variante {mode} refusée : {entry['reason']}")
+        else:
+            os.replace(tmp_path, final_path)
+            with open(final_path + ".json", "w") as f:
+                json.dump({"mode": mode, "baseline": baseline, **entry}, f, indent=2)
+            entry["published"] = True
+            print(f"✅ Variante {mode} publiée : {final_path} ({entry['size_bytes'] / 1e6:.1f} MB)")
+        report["variants"][mode] = entry
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantification post-entraînement du CNN")
+    parser.add_argument("--model", required=True, help="chemin du modèle Keras (.h5)")
+    parser.add_argument("--modes", nargs="+", default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    parser.add_argument("--num-calibration", type=int, default=100, help="images d'entraînement pour la calibration")
+    parser.add_argument("--max-accuracy-drop", type=float, default=MAX_ACCURACY_DROP)
+    parser.add_argument("--max-recall-drop", type=float, default=MAX_RECALL_DROP)
+    args = parser.parse_args()
+
+    from data.dataset import load_data_splits
+    X_train, _, X_test, _, _, y_test = load_data_splits()
+    rng = np.random.default_rng(0)
+    idx = rng.choice(len(X_train), size=min(args.num_calibration, len(X_train)), replace=False)
+
+    report = quantize_with_gate(
+        args.model, X_train[idx].astype("float32"), X_test.astype("float32"), y_test, modes=args.modes,
+        max_accuracy_drop=args.max_accuracy_drop, max_recall_drop=args.max_recall_drop,
+    )
+    print(json.dumps(report, indent=2))
+    if not all(v["published"] for v in report["variants"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# the API modules import each other as top-level modules (`import database`, `import models`)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'api')))
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    """Fresh in-memory SQLite schema installed as database.SessionLocal; yields the sessionmaker."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from sqlalchemy.pool import StaticPool
+    import database
+    import models  # noqa: F401  (registers the tables)
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    database.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(database, "engine", engine)
+    yield SessionLocal
+    engine.dispose()
@@ -0,0 +1,914 @@
+# tests/test_api.py
+from datetime import datetime, timedelta
+
+
+def _new_case(SessionLocal):
+    import models
+
+    db = SessionLocal()
+    case = models.MedicalCase(patient_id="p1", status="pending")
+    db.add(case)
+    db.commit()
+    case_id = case.id
+    db.close()
+    return case_id
+
+
+def test_job_queue_claims_once_and_retries_with_backoff(memory_db, monkeypatch):
+    import job_queue
+
+    monkeypatch.setattr(job_queue, "BACKOFF_SECONDS", 10)
+    case_id = _new_case(memory_db)
+    db = memory_db()
+    job = job_queue.enqueue(db, case_id)
+    # enqueueing the same case again reuses the pending job
+    assert job_queue.enqueue(db, case_id).id == job.id
+
+    claimed = job_queue.claim(db, "w1")
+    assert claimed.id == job.id and claimed.status == "running" and claimed.attempts == 1
+    assert job_queue.claim(db, "w2") is None
+
+    job_queue.fail(db, claimed, "boom")
+    assert claimed.status == "queued" and claimed.last_error == "boom"
+    assert claimed.run_after > datetime.utcnow() + timedelta(seconds=5)
+    assert job_queue.claim(db, "w2") is None  # still backing off
+
+    claimed.run_after = datetime.utcnow()
+    db.commit()
+    again = job_queue.claim(db, "w2")
+    assert again.attempts == 2
+    job_queue.complete(db, again)
+    assert job_queue.latest_for_case(db, case_id).status == "done"
+    assert job_queue.queue_depth(db) == 0
+    db.close()
+
+
+def test_enqueue_during_a_running_analysis_queues_a_follow_up_job(memory_db):
+    import job_queue
+
+    case_id = _new_case(memory_db)
+    db = memory_db()
+    running = job_queue.enqueue(db, case_id)
+    assert job_queue.claim(db, "w1").id == running.id
+    # slices added while the job runs: the running job already listed the case, so a new one is queued
+    follow_up = job_queue.enqueue(db, case_id)
+    assert follow_up.id != running.id and follow_up.status == "queued"
+    assert job_queue.enqueue(db, case_id).id == follow_up.id
+    # ...but it waits until the running job of the same case is finished
+    assert job_queue.claim(db, "w2") is None
+    job_queue.complete(db, running)
+    assert job_queue.claim(db, "w2").id == follow_up.id
+    db.close()
+
+
+def test_job_queue_marks_failed_after_max_attempts_and_reclaims_expired_leases(memory_db, monkeypatch):
+    import job_queue
+
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 1)
+    db = memory_db()
+    job = job_queue.enqueue(db, _new_case(memory_db))
+    job_queue.fail(db, job_queue.claim(db, "w1"), "boom")
+    assert job.status == "failed"
+
+    # a running job whose worker vanished is picked up again once the lease expires
+    monkeypatch.setattr(job_queue, "BACKOFF_SECONDS", 0)
+    other = job_queue.enqueue(db, _new_case(memory_db))
+    other.max_attempts = 2
+    db.commit()
+    job_queue.claim(db, "dead-worker")
+    other.locked_at = datetime.utcnow() - timedelta(seconds=job_queue.LEASE_SECONDS + 1)
+    db.commit()
+    assert job_queue.claim(db, "w2").id == other.id
+    db.close()
+
+
+def test_an_expired_lease_counts_as_a_failed_attempt(memory_db, monkeypatch):
+    import job_queue
+
+    monkeypatch.setattr(job_queue, "BACKOFF_SECONDS", 10)
+    monkeypatch.setattr(job_queue, "MAX_ATTEMPTS", 2)
+    stale = datetime.utcnow() - timedelta(seconds=job_queue.LEASE_SECONDS + 1)
+    db = memory_db()
+    job = job_queue.enqueue(db, _new_case(memory_db))
+    job_queue.claim(db, "dead-worker")
+    job.locked_at = stale
+    db.commit()
+    # the lost attempt is requeued with fail()'s backoff instead of being re-run immediately
+    assert job_queue.claim(db, "w2") is None
+    assert job.status == "queued" and job.locked_by is None and "expired" in job.last_error
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=5)
+
+    job.run_after = datetime.utcnow()
+    db.commit()
+    assert job_queue.claim(db, "w2").attempts == 2
+    job.locked_at = stale
+    db.commit()
+    # out of attempts: a job that keeps killing its worker ends up failed, not re-claimed forever
+    assert job_queue.claim(db, "w3") is None
+    assert job.status == "failed" and "w2" in job.last_error
+    assert job_queue.queue_depth(db) == 0
+    db.close()
+
+
+def test_heartbeat_keeps_a_long_job_and_a_lost_lease_does_not_overwrite_the_new_owner(memory_db, monkeypatch):
+    import job_queue
+
+    monkeypatch.setattr(job_queue, "BACKOFF_SECONDS", 0)
+
+    db = memory_db()
+    job = job_queue.enqueue(db, _new_case(memory_db))
+    first = job_queue.claim(db, "w1")
+    stale = datetime.utcnow() - timedelta(seconds=job_queue.LEASE_SECONDS + 1)
+    first.locked_at = stale
+    db.commit()
+    # a heartbeat renews the lease, so the job is not handed to a second worker
+    assert job_queue.heartbeat(db, job.id, "w1", 1)
+    assert job_queue.claim(db, "w2") is None
+
+    other = memory_db()
+    row = other.get(type(job), job.id)
+    row.locked_at = stale
+    other.commit()
+    second = job_queue.claim(other, "w2")
+    assert second.attempts == 2
+    # w1 finishes late: its heartbeat and result are rejected, w2's claim stands
+    assert not job_queue.heartbeat(db, job.id, "w1", 1)
+    assert not job_queue.complete(db, first)
+    assert first.status == "running" and first.locked_by == "w2"
+    assert job_queue.complete(other, second) and second.status == "done"
+    other.close()
+    db.close()
+
+
+def test_worker_runs_analysis_and_completes_job(memory_db, monkeypatch):
+    import analysis_worker
+    import cnn_predictor
+    import job_queue
+
+    ran = []
+    monkeypatch.setattr(cnn_predictor, "analyze_case", lambda case_id, raise_errors=False: ran.append(case_id))
+    case_id = _new_case(memory_db)
+    db = memory_db()
+    job = job_queue.enqueue(db, case_id)
+    db.close()
+
+    assert analysis_worker.run_one("w1")
+    assert not analysis_worker.run_one("w1")
+    assert ran == [case_id]
+    db = memory_db()
+    assert job_queue.latest_for_case(db, case_id).status == "done"
+    db.close()
+
+
+def test_upload_ingest_hashes_streams_and_enforces_limits(tmp_path, monkeypatch):
+    import asyncio
+    import hashlib
+    import io
+    import os
+
+    import pytest
+    from fastapi import UploadFile
+    from pydicom.errors import InvalidDicomError
+    import upload_ingest
+
+    monkeypatch.setattr(upload_ingest, "CHUNK_SIZE", 4)
+    data = b"0123456789abcdef"
+    budget = upload_ingest.IngestBudget(max_file_bytes=20, max_request_bytes=30)
+    # these are raw bytes, not DICOM: only the storage path is under test here
+    stored = asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(data), filename="a.dcm"), str(tmp_path),
+                                                     budget, validate=None))
+    assert stored.sha256 == hashlib.sha256(data).hexdigest() and stored.size == len(data)
+    assert stored.filename == stored.sha256 + ".dcm" and stored.url.startswith("/uploads/blobs/")
+    with open(stored.path, "rb") as f:
+        assert f.read() == data
+
+    # per-file limit
+    with pytest.raises(upload_ingest.UploadTooLarge):
+        asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(b"x" * 21), filename="b.dcm"),
+                                                str(tmp_path), upload_ingest.IngestBudget(20, 100), validate=None))
+    # per-request limit: 16 bytes already consumed by this budget
+    with pytest.raises(upload_ingest.UploadTooLarge):
+        asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(b"y" * 15), filename="c.dcm"), str(tmp_path),
+                                                budget, validate=None))
+    # a single file is validated like an archive entry: what is not a DICOM image is not stored
+    with pytest.raises(InvalidDicomError):
+        asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(b"not a dicom"), filename="d.dcm"),
+                                                str(tmp_path), upload_ingest.IngestBudget()))
+    # rejected uploads leave neither a partial nor a published file behind
+    assert os.listdir(tmp_path / upload_ingest.INCOMING_DIRNAME) == []
+    assert sorted(os.listdir(tmp_path)) == sorted([upload_ingest.INCOMING_DIRNAME, "blobs"])
+
+
+def test_rejected_upload_does_not_delete_a_blob_another_upload_references(tmp_path, memory_db, monkeypatch):
+    import asyncio
+    import io
+    import os
+
+    from fastapi import UploadFile
+    import blob_store
+    import models
+    import upload_ingest
+
+    def ingest(data, name):
+        return asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(data), filename=name), str(tmp_path),
+                                                       upload_ingest.IngestBudget(100, 1000), validate=None))
+
+    # request 1 creates two blobs, then hits 413; meanwhile request 2 dedupes against one and commits
+    shared, own = ingest(b"shared-bytes", "a.dcm"), ingest(b"own-bytes", "b.dcm")
+    again = ingest(b"shared-bytes", "c.dcm")
+    assert shared.created and not again.created
+    db = memory_db()
+    db.add(models.MRIImage(case_id="c2", filename=again.filename, file_path=again.url, content_hash=again.sha256))
+    db.commit()
+
+    assert upload_ingest.discard(db, [shared, own], str(tmp_path)) == []  # both inside the GC grace period
+    monkeypatch.setattr(blob_store, "GC_GRACE_SECONDS", 0)
+    assert upload_ingest.discard(db, [shared, own], str(tmp_path)) == [own.sha256]
+    assert os.path.exists(shared.path) and not os.path.exists(own.path)
+    db.close()
+
+
+def test_blob_of_a_rejected_upload_is_collected_by_the_periodic_gc(tmp_path, memory_db, monkeypatch):
+    import asyncio
+    import io
+    import os
+    import threading
+    import time
+
+    from fastapi import UploadFile
+    import blob_store
+    import main
+    import upload_ingest
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(blob_store, "GC_GRACE_SECONDS", 0.2)
+    stored = asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(b"rejected"), filename="a.dcm"),
+                                                     str(tmp_path), upload_ingest.IngestBudget(100, 1000), validate=None))
+    db = memory_db()
+    # the 413 path releases the blob while it is still inside its grace period
+    assert upload_ingest.discard(db, [stored], str(tmp_path)) == []
+    db.close()
+    assert os.path.exists(stored.path)
+
+    stop = threading.Event()
+    gc = threading.Thread(target=main._storage_gc_loop, args=(stop, 0.05), daemon=True)
+    gc.start()
+    try:
+        deadline = time.time() + 10
+        while os.path.exists(stored.path) and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        stop.set()
+        gc.join(timeout=10)
+    assert not os.path.exists(stored.path)
+
+
+def test_blob_store_deduplicates_and_collects_unreferenced_blobs(tmp_path, memory_db, monkeypatch):
+    import asyncio
+    import io
+    import os
+
+    from fastapi import UploadFile
+    import blob_store
+    import models
+    import upload_ingest
+
+    monkeypatch.setattr(blob_store, "GC_GRACE_SECONDS", 0)
+
+    def ingest(data):
+        return asyncio.run(upload_ingest.ingest_upload(UploadFile(io.BytesIO(data), filename="x.DCM"),
+                                                       str(tmp_path), upload_ingest.IngestBudget(), validate=None))
+
+    first, again, other = ingest(b"scan-a"), ingest(b"scan-a"), ingest(b"scan-b")
+    assert first.created and not again.created and first.path == again.path
+    assert blob_store.hash_for_path(first.url) == first.sha256
+    assert blob_store.find_blob(first.sha256, str(tmp_path)) == first.path
+
+    db = memory_db()
+    rows = [models.MRIImage(case_id="c1", filename=s.filename, file_path=s.url, content_hash=s.sha256)
+            for s in (first, again, other)]
+    db.add_all(rows)
+    db.commit()
+    preview = tmp_path / "previews" / f"{first.sha256}.png"
+    preview.parent.mkdir()
+    preview.write_bytes(b"png")
+
+    # still referenced by the second row
+    db.delete(rows[0])
+    db.commit()
+    assert blob_store.release(db, [first.sha256], str(tmp_path)) == []
+    assert os.path.exists(first.path)
+
+    db.delete(rows[1])
+    db.commit()
+    assert blob_store.release(db, [first.sha256], str(tmp_path)) == [first.sha256]
+    assert not os.path.exists(first.path) and not preview.exists()
+    # the sweep finds nothing else to collect while scan-b is referenced
+    assert blob_store.sweep(db, str(tmp_path))["blobs_removed"] == 0
+    assert os.path.exists(other.path)
+    db.close()
+
+
+def test_archive_upload_extracts_and_validates_each_entry(tmp_path):
+    import asyncio
+    import io
+    import tarfile
+    import zipfile
+
+    import numpy as np
+    from fastapi import UploadFile
+    import upload_ingest
+    from test_cnn_predictor import write_dicom
+
+    slices = [write_dicom(tmp_path / f"s{i}.dcm", np.full((8, 8), i, dtype=np.uint16)) for i in range(2)]
+    store = tmp_path / "store"
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        zf.writestr("series/", "")
+        for i, path in enumerate(slices):
+            zf.write(path, f"series/IM{i}")
+        zf.writestr("series/readme.txt", "not a dicom")
+        zf.writestr("__MACOSX/series/._IM0", "resource fork")
+    buf.seek(0)
+    stored, failed = asyncio.run(upload_ingest.ingest_archive(
+        UploadFile(buf, filename="study.zip"), str(store), upload_ingest.IngestBudget()))
+    assert [s.original_name for s in stored] == ["study.zip:series/IM0", "study.zip:series/IM1"]
+    assert all(s.filename.endswith(".dcm") for s in stored)
+    assert [f["filename"] for f in failed] == ["study.zip:series/readme.txt"]
+
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+        for i, path in enumerate(slices):
+            tf.add(path, f"IM{i}")
+    buf.seek(0)
+    stored_tar, failed_tar = asyncio.run(upload_ingest.ingest_archive(
+        UploadFile(buf, filename="study.tar.gz"), str(store), upload_ingest.IngestBudget()))
+    # same slices as the zip: deduplicated by the blob store
+    assert [s.sha256 for s in stored_tar] == [s.sha256 for s in stored] and failed_tar == []
+    assert not any(s.created for s in stored_tar)
+
+
+def test_upload_session_resumes_from_persisted_chunks(tmp_path, memory_db):
+    import hashlib
+
+    import numpy as np
+    import pytest
+    from test_cnn_predictor import write_dicom
+    import models
+    import upload_ingest
+    import upload_sessions
+
+    data = open(write_dicom(tmp_path / "scan.dcm", np.eye(30, dtype=np.uint16)), "rb").read()
+    assert 2000 < len(data) < 3000  # -> chunks of 1000, 1000 and the rest
+    db = memory_db()
+    session = upload_sessions.create(db, "u1", "scan.dcm", len(data), chunk_size=1000)
+    assert session.total_chunks == 3
+    chunks = [data[i:i + 1000] for i in range(0, len(data), 1000)]
+
+    with pytest.raises(ValueError):
+        upload_sessions.write_chunk(session, 2, chunks[0], root=str(tmp_path))  # wrong size for the last slot
+    with pytest.raises(ValueError):
+        upload_sessions.write_chunk(session, 0, chunks[0], sha256="0" * 64, root=str(tmp_path))
+    for i in (2, 0):
+        digest = upload_sessions.write_chunk(session, i, chunks[i], root=str(tmp_path))
+        upload_sessions.record_chunk(db, session, i, len(chunks[i]), digest)
+    db.close()
+
+    # "restart": state comes back from the database and the chunk directory
+    db = memory_db()
+    session = db.query(models.UploadSession).one()
+    assert upload_sessions.missing(db, session, str(tmp_path)) == [1]
+    digest = upload_sessions.write_chunk(session, 1, chunks[1], root=str(tmp_path))
+    upload_sessions.record_chunk(db, session, 1, len(chunks[1]), digest)
+    assert upload_sessions.missing(db, session, str(tmp_path)) == []
+
+    assert upload_sessions.begin_finalize(db, session)
+    assert not upload_sessions.begin_finalize(db, session)  # a concurrent finalize loses
+    stored, failed = upload_sessions.ingest(session, upload_ingest.IngestBudget(), str(tmp_path))
+    assert failed == [] and stored[0].sha256 == hashlib.sha256(data).hexdigest()
+    upload_sessions.complete(db, session, "case-1")
+    upload_sessions.discard_chunks(session.id, str(tmp_path))
+    assert session.status == "finalized" and upload_sessions.received(db, session) == []
+    db.close()
+
+
+def test_abandoned_upload_sessions_expire_and_their_chunks_are_never_served(tmp_path, memory_db):
+    import os
+    from fastapi.testclient import TestClient
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    import http_cache
+    import upload_sessions
+
+    db = memory_db()
+    session = upload_sessions.create(db, "u1", "scan.dcm", 10, chunk_size=10)
+    digest = upload_sessions.write_chunk(session, 0, b"0123456789", root=str(tmp_path))
+    upload_sessions.record_chunk(db, session, 0, 10, digest)
+    assert upload_sessions.begin_finalize(db, session)
+    (tmp_path / ".incoming").mkdir()
+    (tmp_path / ".incoming" / "x.part").write_bytes(b"partial")
+
+    # chunks and partial uploads live under the served folder but are not exposed by it
+    static = TestClient(Starlette(routes=[Mount("/uploads", app=http_cache.CachedStaticFiles(directory=str(tmp_path)))]))
+    chunk = os.path.relpath(upload_sessions._chunk_path(session.id, 0, str(tmp_path)), tmp_path).replace(os.sep, "/")
+    assert static.get(f"/uploads/{chunk}").status_code == 404
+    assert static.get("/uploads/.incoming/x.part").status_code == 404
+
+    # the API died mid-finalize and the client never came back: the session is still collected
+    assert upload_sessions.expire(db, str(tmp_path)) == 0
+    session.updated_at = datetime.utcnow() - timedelta(
+        seconds=upload_sessions.FINALIZE_LEASE_SECONDS, hours=upload_sessions.SESSION_TTL_HOURS, minutes=1)
+    db.commit()
+    assert upload_sessions.expire(db, str(tmp_path)) == 1
+    assert session.status == "expired" and upload_sessions.received(db, session) == []
+    assert not os.path.exists(upload_sessions.session_dir(session.id, str(tmp_path)))
+    db.close()
+
+
+def test_metrics_endpoint_reports_requests_queue_and_pool(memory_db, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    from sqlalchemy import create_engine
+    import database
+    import job_queue
+    import main
+
+    # a file database gets the default QueuePool, whose state is exported
+    monkeypatch.setattr(database, "engine", create_engine(f"sqlite:///{tmp_path / 'pool.db'}"))
+
+    db = memory_db()
+    job_queue.enqueue(db, _new_case(memory_db))
+    db.close()
+
+    client = TestClient(main.app)
+    assert client.get("/health").status_code == 200
+    client.get("/uploads/missing.dcm")
+    body = client.get("/metrics")
+    assert body.status_code == 200 and body.headers["content-type"].startswith("text/plain")
+    text = body.text
+    assert 'http_requests_total{method="GET",route="/health",status="200"}' in text
+    assert 'route="/uploads"' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"}' in text
+    assert "http_requests_in_flight 1" in text  # the scrape itself
+    assert 'analysis_queue_jobs{status="queued"} 1' in text
+    assert 'db_pool_connections{state="checkedout"} 0' in text
+
+
+def test_load_test_harness_reports_percentiles_per_route(tmp_path):
+    import json
+    import os
+    import subprocess
+    import sys
+
+    script = os.path.join(os.path.dirname(__file__), "..", "src", "api", "scripts", "load_test.py")
+    out = tmp_path / "report.json"
+    subprocess.run(
+        [sys.executable, script, "--requests", "24", "--warmup", "2", "--concurrency", "4", "--patients", "4",
+         "--neurologists", "1", "--slices-per-case", "2", "--distinct-slices", "4", "--upload-slices", "2",
+         "--slice-size", "32", "--llm-latency-ms", "1", "--analysis-workers", "0", "--out", str(out)],
+        check=True, capture_output=True, timeout=240,
+    )
+    report = json.loads(out.read_text())
+    assert report["seeded"] == {"users": 6, "cases": 8, "images": 16}
+    assert set(report["routes"]) == {"create_case", "neurologist_cases", "patients_archive", "chat"}
+    assert report["total"]["requests"] == 24 and report["total"]["errors"] == 0
+    for stats in report["routes"].values():
+        if stats["requests"]:
+            assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+
+
+def test_previews_are_rendered_off_the_request_path_and_served_precomputed(tmp_path, memory_db, monkeypatch):
+    import hashlib
+    import threading
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from PIL import Image
+    from test_cnn_predictor import write_dicom
+    import blob_store
+    import main
+    import previews
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    src = write_dicom(tmp_path / "in.dcm", np.arange(600 * 300, dtype=np.uint16).reshape(600, 300))
+    sha = hashlib.sha256(open(src, "rb").read()).hexdigest()
+    blob_store.put_file(str(src), sha, ".dcm", root=str(tmp_path))
+
+    client = TestClient(main.app)
+    # nothing rendered yet: the endpoint queues the work instead of decoding inline, and answers
+    # at once with an uncacheable placeholder image
+    gate = threading.Event()
+    real_render = previews.render
+    monkeypatch.setattr(previews, "render", lambda *a, **kw: gate.wait(30) and real_render(*a, **kw))
+    resp = client.get(f"/uploads/previews/{sha}.png")
+    assert resp.status_code == 200 and resp.headers["content-type"] == "image/png"
+    assert resp.content == previews.placeholder() and resp.headers["cache-control"] == "no-store"
+    gate.set()
+    future = previews.schedule(sha, root=str(tmp_path))
+    if future is not None:  # None when the render queued above already finished
+        future.result(timeout=30)
+    assert previews.is_complete(sha, str(tmp_path))
+
+    edges = {size: max(Image.open(previews.preview_path(sha, size, str(tmp_path))).size) for size in previews.SIZES}
+    assert edges == {"thumb": 128, "viewer": 512, "full": 600}
+    resp = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb"})
+    assert resp.status_code == 200 and resp.headers["content-type"] == "image/webp"
+    # the chat view requests `<stored basename>.png`, i.e. <sha>.dcm.png
+    same = client.get(f"/uploads/previews/{sha}.dcm.png", params={"size": "thumb"})
+    assert same.status_code == 200 and same.content == resp.content
+    assert client.get(f"/uploads/previews/{sha}.png", params={"size": "huge"}).status_code == 400
+    assert client.get(f"/uploads/previews/{'0' * 64}.png").status_code == 404
+
+    # a legacy upload gets the placeholder (no 503 for the <img>) until its render lands,
+    # and backfill catches the rest
+    write_dicom(tmp_path / "old.dcm", np.eye(32, dtype=np.uint16))
+    resp = client.get("/uploads/previews/old.png", params={"size": "thumb"})
+    assert resp.content == previews.placeholder() and resp.headers["retry-after"] == "1"
+    future = previews.schedule("old", root=str(tmp_path))
+    if future is not None:
+        future.result(timeout=30)
+    resp = client.get("/uploads/previews/old.png", params={"size": "thumb"})
+    assert resp.status_code == 200 and resp.headers["content-type"] == "image/webp"
+    assert client.get("/uploads/previews/old.dcm.png", params={"size": "thumb"}).content == resp.content
+    write_dicom(tmp_path / "older.dcm", np.eye(32, dtype=np.uint16))
+    assert previews.backfill(str(tmp_path)) == 1
+    previews.shutdown(wait=True)
+    assert previews.is_complete("older", str(tmp_path)) and previews.backfill(str(tmp_path)) == 0
+
+
+def test_preview_backfill_is_parallel_and_incremental(tmp_path):
+    import hashlib
+    import os
+    import subprocess
+    import sys
+    import numpy as np
+    from test_cnn_predictor import write_dicom
+    import blob_store
+    import previews
+
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    for i in range(2):
+        src = write_dicom(tmp_path / f"b{i}.dcm", np.full((16, 16), i, dtype=np.uint16))
+        blob_store.put_file(str(src), hashlib.sha256(open(src, "rb").read()).hexdigest(), ".dcm", root=str(uploads))
+    legacy = write_dicom(uploads / "legacy.dcm", np.eye(16, dtype=np.uint16))
+
+    script = os.path.join(os.path.dirname(__file__), "..", "src", "api", "scripts", "generate_previews.py")
+
+    def run(*extra):
+        cmd = [sys.executable, script, "--uploads", str(uploads), "--manifest", str(tmp_path / "m.json"), *extra]
+        return subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=120).stdout
+
+    assert "3 pending {'new': 3}" in run("--dry-run", "--samples", "1")
+    assert not os.path.exists(previews.preview_path("legacy", "thumb", str(uploads)))
+    assert "created=3" in run("--workers", "2")
+    assert previews.is_complete("legacy", str(uploads))
+    assert "3 up to date, 0 pending" in run()
+
+    os.utime(legacy, (1, 1))
+    os.remove(previews.preview_path("legacy", "full", str(uploads)))
+    assert "1 pending {'changed': 1}" in run("--dry-run")
+    assert "created=1" in run()
+    assert previews.is_complete("legacy", str(uploads))
+
+
+def test_uploads_and_previews_are_served_with_cache_validators_and_ranges(tmp_path, memory_db, monkeypatch):
+    import hashlib
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from starlette.applications import Starlette
+    from starlette.routing import Mount
+    from test_cnn_predictor import write_dicom
+    import blob_store
+    import http_cache
+    import main
+    import previews
+
+    src = write_dicom(tmp_path / "in.dcm", np.arange(64 * 64, dtype=np.uint16).reshape(64, 64))
+    data = open(src, "rb").read()
+    sha = hashlib.sha256(data).hexdigest()
+    relpath, _ = blob_store.put_file(str(src), sha, ".dcm", root=str(tmp_path))
+    (tmp_path / "legacy.dcm").write_bytes(data)
+
+    static = TestClient(Starlette(routes=[Mount("/uploads", app=http_cache.CachedStaticFiles(directory=str(tmp_path)))]))
+    resp = static.get(f"/uploads/{relpath}")
+    assert resp.status_code == 200 and resp.content == data
+    assert resp.headers["etag"] == f'"{sha}"' and "immutable" in resp.headers["cache-control"]
+    assert static.get(f"/uploads/{relpath}", headers={"If-None-Match": f'W/"{sha}"'}).status_code == 304
+    part = static.get(f"/uploads/{relpath}", headers={"Range": "bytes=128-255"})
+    assert part.status_code == 206 and part.content == data[128:256]
+    assert part.headers["content-range"] == f"bytes 128-255/{len(data)}"
+    assert static.get("/uploads/legacy.dcm").headers["cache-control"] == http_cache.REVALIDATE
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    previews.render(sha, blob_store.find_blob(sha, str(tmp_path)), str(tmp_path))
+    client = TestClient(main.app)
+    first = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb"})
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and etag.startswith(f'"{sha}.thumb.')
+    again = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.content == b""
+    # another size is another representation
+    other = client.get(f"/uploads/previews/{sha}.png", params={"size": "full"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200 and other.headers["etag"] != etag
+
+
+def test_rendering_applies_rescale_window_and_photometric_inversion(tmp_path):
+    import numpy as np
+    import pydicom
+    from test_cnn_predictor import write_dicom
+    import rendering
+
+    # CT-like: stored 0..2047, intercept -1024 -> -1024..1023 HU
+    path = write_dicom(tmp_path / "ct.dcm", np.arange(2048, dtype=np.uint16).reshape(32, 64))
+    ds = pydicom.dcmread(path)
+    ds.RescaleSlope, ds.RescaleIntercept = 1, -1024
+    ds.WindowCenter, ds.WindowWidth = 40, 80
+    out = rendering.render(ds)
+    hu = np.arange(2048).reshape(32, 64) - 1024
+    assert out.dtype == np.uint8
+    assert (out[hu <= 0] == 0).all() and (out[hu >= 80] == 255).all()
+    assert 100 < out[hu == 40][0] < 155
+    assert (rendering.render(ds, "brain") == out).all()
+
+    # "full" is the old min/max stretch; MONOCHROME1 flips it
+    full = rendering.render(ds, "full")
+    legacy = ((hu - hu.min()) * (255.0 / (hu.max() - hu.min()))).astype(np.uint8)
+    assert np.abs(full.astype(int) - legacy).max() <= 1
+    ds.PhotometricInterpretation = "MONOCHROME1"
+    assert (rendering.render(ds, "full") == 255 - full).all()
+
+    # without a window, "auto" clips outliers at the percentiles instead of stretching to them
+    flat = np.full((64, 64), 100, dtype=np.uint16)
+    flat[:32] = 200
+    flat[0, 0] = 60000
+    out = rendering.render(pydicom.dcmread(write_dicom(tmp_path / "mr.dcm", flat)))
+    assert out[0, 1] == 255 and out[40, 0] == 0
+    try:
+        rendering.render(ds, "nope")
+        assert False, "unknown preset accepted"
+    except ValueError:
+        pass
+
+
+def test_rendering_decodes_one_frame_of_a_multiframe_file(tmp_path):
+    import numpy as np
+    import pydicom
+    from test_cnn_predictor import write_dicom
+    import rendering
+
+    frames = np.stack([np.full((8, 8), i, dtype=np.uint16) for i in range(5)])
+    frames[:, 0, 0] = 100
+    path = write_dicom(tmp_path / "mf.dcm", frames.reshape(40, 8))
+    ds = pydicom.dcmread(path)
+    ds.Rows, ds.NumberOfFrames = 8, 5
+    assert rendering.frame_count(ds) == 5
+    assert (rendering.decode_frame(ds) == frames[2]).all()
+    assert (rendering.decode_frame(ds, 4) == frames[4]).all()
+    ds.WindowCenter, ds.WindowWidth = 2, 4
+    assert rendering.render(ds, frame=0)[1, 1] == 0
+    assert rendering.render(ds, frame=4)[1, 1] == 255
+
+
+def test_preview_window_presets_are_rendered_on_demand(tmp_path, memory_db, monkeypatch):
+    import hashlib
+    import os
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from test_cnn_predictor import write_dicom
+    import blob_store
+    import main
+    import previews
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    src = write_dicom(tmp_path / "in.dcm", np.arange(64 * 64, dtype=np.uint16).reshape(64, 64))
+    sha = hashlib.sha256(open(src, "rb").read()).hexdigest()
+    blob_store.put_file(str(src), sha, ".dcm", root=str(tmp_path))
+    previews.schedule(sha, root=str(tmp_path)).result(timeout=30)
+
+    client = TestClient(main.app)
+    default = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb"})
+    assert default.status_code == 200
+    assert client.get(f"/uploads/previews/{sha}.png", params={"preset": "nope"}).status_code == 400
+    # another preset is never substituted by the default rendering: it is queued on first request
+    assert not os.path.exists(previews.preview_path(sha, "thumb", str(tmp_path), "bone"))
+    assert previews.preview_path(sha, "thumb", str(tmp_path), "bone").endswith(
+        f"{sha}.thumb.bone.r{previews.RENDER_VERSION}.webp")
+    bone = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb", "preset": "bone"})
+    assert bone.content == previews.placeholder() and bone.headers["cache-control"] == "no-store"
+    future = previews.schedule(sha, root=str(tmp_path), preset="bone")
+    if future is not None:
+        future.result(timeout=30)
+    bone = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb", "preset": "bone"})
+    assert bone.status_code == 200 and bone.content != default.content
+    assert bone.headers["etag"] != default.headers["etag"]
+
+    # a RENDER_VERSION bump (i.e. a restart with new rendering code) never serves the old files
+    import preview_cache
+    old_bone = previews.preview_path(sha, "thumb", str(tmp_path), "bone")
+    monkeypatch.setattr(previews, "RENDER_VERSION", previews.RENDER_VERSION + 1)
+    preview_cache.CACHE.clear()
+    stale = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb", "preset": "bone"})
+    assert stale.content == previews.placeholder()
+    assert previews.backfill(str(tmp_path)) == 1  # the default preset is re-rendered without a request
+    future = previews.schedule(sha, root=str(tmp_path), preset="bone")
+    if future is not None:
+        future.result(timeout=30)
+    previews.shutdown(wait=True)
+    rerendered = client.get(f"/uploads/previews/{sha}.png", params={"size": "thumb", "preset": "bone"})
+    assert rerendered.status_code == 200 and rerendered.headers["etag"] != bone.headers["etag"]
+    # the previous version's files (default and bone) are removed once replaced
+    assert not os.path.exists(old_bone)
+    assert all(f".r{previews.RENDER_VERSION}." in n for n in os.listdir(tmp_path / "previews"))
+
+
+def test_preview_bytes_are_cached_in_memory_and_a_case_is_prefetched(tmp_path, memory_db, monkeypatch):
+    import hashlib
+    import os
+    import numpy as np
+    from fastapi.testclient import TestClient
+    from test_cnn_predictor import write_dicom
+    import blob_store
+    import main
+    import models
+    import preview_cache
+    import previews
+
+    # LRU by bytes: the least recently used entry goes first, oversized items are not kept
+    lru = preview_cache.ByteCache(max_bytes=10, max_item=6)
+    entry = lambda n: preview_cache.Entry(b"x" * n, "p", {})  # noqa: E731
+    lru.put(("r", "a", "s", "p"), entry(4))
+    lru.put(("r", "b", "s", "p"), entry(4))
+    assert lru.get(("r", "a", "s", "p"))
+    lru.put(("r", "c", "s", "p"), entry(4))
+    assert ("r", "b", "s", "p") not in lru and ("r", "a", "s", "p") in lru
+    assert not lru.put(("r", "d", "s", "p"), entry(7))
+    assert lru.stats() == {"entries": 2, "bytes": 8, "max_bytes": 10}
+
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(tmp_path))
+    db = memory_db()
+    case = models.MedicalCase(patient_id="p1", status="pending")
+    db.add(case)
+    db.commit()
+    keys = []
+    for i in range(3):
+        src = write_dicom(tmp_path / f"s{i}.dcm", np.full((16, 16), i * 100, dtype=np.uint16))
+        sha = hashlib.sha256(open(src, "rb").read()).hexdigest()
+        blob_store.put_file(str(src), sha, ".dcm", root=str(tmp_path))
+        previews.render(sha, blob_store.find_blob(sha, str(tmp_path)), str(tmp_path))
+        db.add(models.MRIImage(case_id=case.id, filename=f"slice{i}.dcm", content_hash=sha))
+        keys.append(sha)
+    db.commit()
+    db.close()
+
+    def lookups(result):
+        return preview_cache.LOOKUPS.value(result=result)
+
+    client = TestClient(main.app)
+    hits, misses = lookups("hit"), lookups("miss")
+    first = client.get(f"/uploads/previews/{keys[0]}.png")
+    assert first.status_code == 200 and lookups("miss") == misses + 1
+    preview_cache.shutdown(wait=True)  # let the prefetch of slices 1 and 2 finish
+    for key in keys[1:]:
+        assert (str(tmp_path), key, previews.DEFAULT_SIZE, previews.DEFAULT_PRESET) in preview_cache.CACHE
+
+    # served from memory even once the file is gone; validators still apply
+    os.remove(previews.preview_path(keys[1], previews.DEFAULT_SIZE, str(tmp_path)))
+    second = client.get(f"/uploads/previews/{keys[1]}.png")
+    assert second.status_code == 200 and second.content and lookups("hit") == hits + 1
+    again = client.get(f"/uploads/previews/{keys[0]}.png", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304 and again.content == b""
+    assert "preview_cache_lookups_total" in client.get("/metrics").text
+
+
+def _file_db(tmp_path, monkeypatch):
+    """File-backed SQLite installed as database.SessionLocal: unlike the in-memory StaticPool
+    fixture, a second session is a separate connection that only sees committed rows."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import database
+    import models  # noqa: F401
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'cases.db'}", connect_args={"check_same_thread": False})
+    database.Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", SessionLocal)
+    monkeypatch.setattr(database, "engine", engine)
+    return SessionLocal
+
+
+def _patient_client(SessionLocal, tmp_path, monkeypatch):
+    from fastapi.testclient import TestClient
+    import auth
+    import main
+    import models
+
+    db = SessionLocal()
+    patient = models.User(email="p@example.com", hashed_password="x", first_name="P", last_name="Q", role="patient")
+    db.add(patient)
+    db.commit()
+    db.refresh(patient)
+    db.expunge(patient)
+    db.close()
+    uploads = tmp_path / "uploads"
+    uploads.mkdir()
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(uploads))
+    monkeypatch.setitem(main.app.dependency_overrides, auth.get_current_user, lambda: patient)
+    return TestClient(main.app)
+
+
+def _series_upload(tmp_path):
+    """A standalone slice plus a zip holding two valid slices and one entry that is not a DICOM."""
+    import io
+    import zipfile
+    import numpy as np
+    from test_cnn_predictor import write_dicom
+
+    paths = [write_dicom(tmp_path / f"s{i}.dcm", np.full((8, 8), i, dtype=np.uint16)) for i in range(3)]
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.write(paths[1], "series/s1.dcm")
+        zf.writestr("series/broken.dcm", b"not a dicom")
+        zf.write(paths[2], "series/s2.dcm")
+    return [
+        ("files", ("s0.dcm", open(paths[0], "rb").read(), "application/dicom")),
+        ("files", ("series.zip", archive.getvalue(), "application/zip")),
+    ]
+
+
+def test_create_case_inserts_all_images_in_one_commit_and_reports_failures(tmp_path, monkeypatch):
+    from sqlalchemy import event
+    import models
+    import previews
+
+    SessionLocal = _file_db(tmp_path, monkeypatch)
+    client = _patient_client(SessionLocal, tmp_path, monkeypatch)
+    commits, visible_before_commit = [], []
+
+    def count_images():
+        other = SessionLocal()
+        try:
+            return other.query(models.MRIImage).count()
+        finally:
+            other.close()
+
+    event.listen(SessionLocal, "before_commit", lambda session: visible_before_commit.append(count_images()))
+    event.listen(SessionLocal, "after_commit", lambda session: commits.append(1))
+    resp = client.post("/cases/create", files=_series_upload(tmp_path), data={"description": "tremor"})
+    previews.shutdown(wait=True)
+
+    assert resp.status_code == 200, resp.text
+    body = resp.json()
+    assert len(body["images"]) == 3
+    assert [f["filename"] for f in body["failed"]] == ["series.zip:series/broken.dcm"]
+    # the case, its three rows and its job are committed together, once
+    assert len(commits) == 1 and visible_before_commit == [0]
+    db = SessionLocal()
+    rows = db.query(models.MRIImage).filter(models.MRIImage.case_id == body["case_id"]).all()
+    assert sorted(r.id for r in rows) == sorted(i["id"] for i in body["images"])
+    assert db.query(models.AnalysisJob).filter(models.AnalysisJob.case_id == body["case_id"]).count() == 1
+    db.close()
+
+
+def test_create_case_leaves_no_partial_rows_when_the_insert_fails(tmp_path, monkeypatch):
+    import uuid
+
+    import pytest
+    from sqlalchemy.exc import IntegrityError
+    import models
+
+    SessionLocal = _file_db(tmp_path, monkeypatch)
+    client = _patient_client(SessionLocal, tmp_path, monkeypatch)
+    # every generated id collides: the case row is flushed, then the image insert fails
+    fixed = uuid.uuid4()
+    monkeypatch.setattr(uuid, "uuid4", lambda: fixed)
+    with pytest.raises(IntegrityError, match="mri_images.id"):
+        client.post("/cases/create", files=_series_upload(tmp_path))
+
+    db = SessionLocal()
+    assert db.query(models.MedicalCase).count() == 0
+    assert db.query(models.MRIImage).count() == 0
+    assert db.query(models.AnalysisJob).count() == 0
+    db.close()
+
+
+def test_adding_images_to_a_case_queues_its_reanalysis(tmp_path, monkeypatch):
+    import numpy as np
+    import job_queue
+    import models
+    import previews
+    from test_cnn_predictor import write_dicom
+
+    SessionLocal = _file_db(tmp_path, monkeypatch)
+    client = _patient_client(SessionLocal, tmp_path, monkeypatch)
+    case_id = client.post("/cases/create", files=_series_upload(tmp_path)).json()["case_id"]
+    db = SessionLocal()
+    job_queue.complete(db, job_queue.claim(db, "w1"))
+
+    extra = write_dicom(tmp_path / "extra.dcm", np.full((8, 8), 7, dtype=np.uint16))
+    resp = client.post(f"/cases/{case_id}/images", files=[("files", ("extra.dcm", open(extra, "rb").read()))])
+    previews.shutdown(wait=True)
+    assert resp.status_code == 200, resp.text
+    job = job_queue.latest_for_case(db, case_id)
+    assert job.id == resp.json()["job_id"] and job.status == "queued"
+    assert db.query(models.MRIImage).filter(models.MRIImage.case_id == case_id).count() == 4
+    db.close()
@@ -0,0 +1,514 @@
+# tests/test_cnn_predictor.py
+import os
+import sys
+
+import numpy as np
+import pydicom
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+import cnn_predictor
+
+
+def write_dicom(path, pixels):
+    """Write a minimal single-frame MONOCHROME2 DICOM file with the given uint16 pixels."""
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = pydicom.uid.MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Rows, ds.Columns = pixels.shape
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = "MONOCHROME2"
+    ds.BitsAllocated = 16
+    ds.BitsStored = 16
+    ds.HighBit = 15
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.astype(np.uint16).tobytes()
+    ds.save_as(str(path), enforce_file_format=True)
+    return str(path)
+
+
+class FakeModel:
+    """Deterministic stand-in for the Keras model: per-image output depends only on that image."""
+
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, x, batch_size=None, verbose=0):
+        self.calls.append(len(x))
+        m = x.reshape(len(x), -1).mean(axis=1)
+        return np.stack([m, 1.0 - m], axis=1).astype(np.float32)
+
+
+def _make_series(tmp_path, n):
+    rng = np.random.default_rng(0)
+    return [write_dicom(tmp_path / f"s{i}.dcm", rng.integers(0, 4096, (64, 64))) for i in range(n)]
+
+
+def test_predict_filepaths_batches_and_matches_single_image(tmp_path):
+    paths = _make_series(tmp_path, 5)
+    model = FakeModel()
+    batched = cnn_predictor._predict_filepaths(model, paths, max_batch_size=2)
+
+    assert model.calls == [2, 2, 1]
+    assert [fp for fp, _ in batched] == paths
+    for fp, probs in batched:
+        single = model.predict(cnn_predictor._preprocess_from_path(fp))[0]
+        np.testing.assert_allclose(probs, single, rtol=0, atol=1e-7)
+
+
+def test_predict_filepaths_skips_unreadable_files(tmp_path):
+    paths = _make_series(tmp_path, 2)
+    bad = tmp_path / "broken.dcm"
+    bad.write_bytes(b"not a dicom")
+    out = cnn_predictor._predict_filepaths(FakeModel(), [paths[0], str(bad), paths[1]])
+    assert [fp for fp, _ in out] == paths
+
+
+def test_scheduler_merges_concurrent_requests():
+    import threading
+    from inference_scheduler import InferenceScheduler
+
+    model = FakeModel()
+    sched = InferenceScheduler(lambda b: model.predict(b), max_batch_size=8, max_wait_ms=50)
+    inputs = [np.full((2, 4, 4, 3), i / 10.0, dtype=np.float32) for i in range(4)]
+    results = [None] * len(inputs)
+
+    def worker(i):
+        results[i] = sched.predict(inputs[i])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(inputs))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sched.stop()
+
+    assert sum(model.calls) == 8
+    assert len(model.calls) < len(inputs)
+    for x, out in zip(inputs, results):
+        np.testing.assert_allclose(out, model.predict(x))
+
+
+def test_stopping_the_scheduler_while_submitting_never_strands_a_request():
+    import threading
+    from inference_scheduler import InferenceScheduler, SchedulerClosed
+
+    model = FakeModel()
+    sched = InferenceScheduler(lambda b: model.predict(b), max_batch_size=4, max_wait_ms=1)
+    futures, rejected = [], []
+    go = threading.Event()
+
+    def submitter():
+        go.wait()
+        for i in range(200):
+            try:
+                futures.append(sched.submit(np.full((1, 4, 4, 3), i / 200.0, dtype=np.float32)))
+            except SchedulerClosed:
+                rejected.append(i)
+
+    threads = [threading.Thread(target=submitter) for _ in range(4)]
+    for t in threads:
+        t.start()
+    go.set()
+    sched.stop(timeout=10)
+    for t in threads:
+        t.join()
+
+    # every accepted request was answered before the worker exited; the rest were refused
+    assert len(futures) + len(rejected) == 800
+    for f in futures:
+        assert f.result(timeout=5).shape == (1, 2)
+    # a stopped scheduler stays stopped instead of silently starting a new worker
+    with pytest.raises(SchedulerClosed):
+        sched.submit(np.zeros((1, 4, 4, 3), dtype=np.float32))
+    assert not sched.running and sched.closed
+
+
+def _use_models(monkeypatch, **versions):
+    """Install a fresh registry holding the given {version: model}; the first one is active."""
+    from model_registry import ModelRegistry, ModelVersion
+
+    registry = ModelRegistry()
+    for i, (version, model) in enumerate(versions.items()):
+        registry.register(ModelVersion(version, model), activate=(i == 0))
+    monkeypatch.setattr(cnn_predictor, "registry", registry)
+    monkeypatch.setattr(cnn_predictor, "_schedulers", {})
+    return registry
+
+
+def _setup_case(SessionLocal, tmp_path, monkeypatch, n_slices=3):
+    """Add one case whose slices live in tmp_path to the in-memory DB; returns (SessionLocal, case_id)."""
+    import models
+
+    monkeypatch.setattr(cnn_predictor, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(cnn_predictor, "SCHEDULER_ENABLED", False)
+
+    db = SessionLocal()
+    case = models.MedicalCase(patient_id="p1", status="pending")
+    db.add(case)
+    db.commit()
+    for p in _make_series(tmp_path, n_slices):
+        db.add(models.MRIImage(case_id=case.id, filename=os.path.basename(p), file_path=None))
+    db.commit()
+    case_id = case.id
+    db.close()
+    return SessionLocal, case_id
+
+
+def test_analyze_case_reuses_cached_predictions(memory_db, tmp_path, monkeypatch):
+    import models
+
+    SessionLocal, case_id = _setup_case(memory_db, tmp_path, monkeypatch)
+    monkeypatch.setattr(cnn_predictor.prediction_cache, "PRUNE_INTERVAL_SECONDS", 0)
+    model = FakeModel()
+    registry = _use_models(monkeypatch, v1=model)
+
+    cnn_predictor.analyze_case(case_id)
+    assert sum(model.calls) == 3
+    db = SessionLocal()
+    first = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first().cnn_prediction_num
+    assert db.query(models.PredictionCache).count() == 3
+    db.close()
+
+    cnn_predictor.analyze_case(case_id)
+    assert sum(model.calls) == 3  # every slice served from the cache
+    db = SessionLocal()
+    assert db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first().cnn_prediction_num == first
+    db.close()
+
+    # another process serving a different version (canary, staggered reload) keeps our rows
+    from model_registry import ModelVersion
+    _use_models(monkeypatch, v3=model)
+    cnn_predictor.analyze_case(case_id)
+    assert sum(model.calls) == 6
+    db = SessionLocal()
+    assert {r.model_version for r in db.query(models.PredictionCache)} == {"v1", "v3"}
+    db.close()
+
+    # a version's entries only go once it is explicitly retired
+    monkeypatch.setattr(cnn_predictor, "registry", registry)
+    registry.register(ModelVersion("v2", model), activate=True)
+    cnn_predictor.unload_version("v1")
+    cnn_predictor.analyze_case(case_id)
+    assert sum(model.calls) == 9
+    db = SessionLocal()
+    assert {r.model_version for r in db.query(models.PredictionCache)} == {"v2", "v3"}
+    db.close()
+
+
+def test_parallel_preprocessing_matches_serial_and_keeps_order(tmp_path):
+    import preprocessing
+
+    paths = _make_series(tmp_path, 6)
+    bad = tmp_path / "broken.dcm"
+    bad.write_bytes(b"not a dicom")
+    inputs = paths[:3] + [str(bad)] + paths[3:]
+
+    serial = list(preprocessing.iter_preprocessed(inputs, workers=1))
+    parallel = list(preprocessing.iter_preprocessed(inputs, workers=3, max_inflight=2))
+    assert [fp for fp, _ in parallel] == paths == [fp for fp, _ in serial]
+    for (_, a), (_, b) in zip(serial, parallel):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_buffered_preprocessing_matches_legacy(tmp_path, monkeypatch):
+    import preprocessing
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'api', 'scripts')))
+    from bench_preprocessing import legacy_preprocess
+
+    paths = _make_series(tmp_path, 3)
+    monkeypatch.setattr(preprocessing, "WORKERS", 1)
+    buf = preprocessing.BatchBuffer(4)
+    for fp, slice_2d in preprocessing.iter_preprocessed(paths, buffer=buf):
+        buf.add(fp, slice_2d)
+
+    batch = buf.view()
+    assert batch.shape == (3, 128, 128, 3)
+    assert batch.strides[-1] == 0  # channels are a broadcast view, not copies
+    legacy = np.concatenate([legacy_preprocess(p) for p in paths], axis=0)
+    # resizing before normalizing only differs by integer rounding of the resized slice
+    np.testing.assert_allclose(batch, legacy, atol=5e-4)
+
+
+def test_startup_warms_up_and_reports_readiness(memory_db, monkeypatch):
+    import model_deployment
+
+    model = FakeModel()
+    _use_models(monkeypatch, v1=model)
+    monkeypatch.setattr(cnn_predictor, "SCHEDULER_ENABLED", False)
+    monkeypatch.setattr(cnn_predictor, "ROUTING_POLL_SECONDS", 0)
+    monkeypatch.setattr(cnn_predictor, "_ready", cnn_predictor.threading.Event())
+    monkeypatch.setattr(cnn_predictor, "_readiness", dict(cnn_predictor._readiness))
+    assert not cnn_predictor.readiness()["ready"]
+
+    assert cnn_predictor.startup(batch_sizes=[1, 4])
+    assert model.calls == [1, 4]
+    state = cnn_predictor.readiness()
+    assert state["ready"] and state["state"] == "ready"
+    # the first process up publishes its model as the shared active version
+    db = memory_db()
+    assert model_deployment.desired(db)["active"].version == "v1"
+    db.close()
+
+
+def test_watcher_swap_retires_the_replaced_version(memory_db, tmp_path, monkeypatch):
+    import model_deployment
+
+    registry = _use_models(monkeypatch, v1=FakeModel())
+    monkeypatch.setattr(cnn_predictor, "_load_path", lambda path: (FakeModel(), "tflite"))
+    sched = cnn_predictor.get_scheduler()
+    artifact = tmp_path / "cnn_parkinson_model.tflite"
+    for i in range(3):  # frequent retrains: only the latest stays resident
+        artifact.write_bytes(b"weights-%d" % i)
+        entry = cnn_predictor._swap_to_artifact(str(artifact))
+        assert registry.version_ids() == [entry.version] and registry.active is entry
+    assert not sched.running and set(cnn_predictor._schedulers) <= {entry.version}
+    db = memory_db()
+    assert model_deployment.desired(db)["active"].version == entry.version
+    assert "v1" in model_deployment.retired(db) and len(model_deployment.retired(db)) == 3
+    db.close()
+
+
+def test_model_routing_is_shared_through_the_database(memory_db, tmp_path, monkeypatch):
+    import model_deployment
+
+    registry = _use_models(monkeypatch, v1=FakeModel())  # e.g. an analysis worker serving v1
+    artifact = tmp_path / "retrained.tflite"
+    artifact.write_bytes(b"weights-2")
+    monkeypatch.setattr(cnn_predictor, "_load_path", lambda path: (FakeModel(), "tflite"))
+    v2 = cnn_predictor._compute_model_version(str(artifact), "tflite")
+
+    # what the admin endpoints record in the API process
+    db = memory_db()
+    model_deployment.record(db, "v1")
+    model_deployment.set_active(db, "v1")
+    model_deployment.record(db, v2, str(artifact), "tflite")
+    model_deployment.set_canary(db, v2, 0.25)
+    with pytest.raises(ValueError):
+        model_deployment.set_canary(db, "v1", 0.5)
+
+    # the worker loads the canary from the shared path and routes to it
+    assert cnn_predictor.sync_routing()
+    assert registry.canary.version == v2 and registry.canary_fraction == 0.25
+    model_deployment.set_active(db, v2)
+    assert cnn_predictor.sync_routing()
+    assert registry.active.version == v2 and registry.canary is None
+    model_deployment.retire(db, "v1")
+    assert cnn_predictor.sync_routing() and "v1" not in registry
+    assert not cnn_predictor.sync_routing()  # converged
+    with pytest.raises(ValueError):
+        model_deployment.retire(db, v2)
+
+    # an artifact that changed on disk is not loaded under the recorded version
+    model_deployment.record(db, "v3", str(artifact), "tflite")
+    model_deployment.set_canary(db, "v3", 0.5)
+    assert not cnn_predictor.sync_routing() and registry.canary is None
+    db.close()
+
+
+def test_canary_version_scores_case_and_is_recorded(memory_db, tmp_path, monkeypatch):
+    import models
+
+    SessionLocal, case_id = _setup_case(memory_db, tmp_path, monkeypatch)
+    active, canary = FakeModel(), FakeModel()
+    registry = _use_models(monkeypatch, stable=active, candidate=canary)
+    registry.set_canary("candidate", 1.0)
+
+    cnn_predictor.analyze_case(case_id)
+    assert canary.calls and not active.calls
+    db = SessionLocal()
+    case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+    assert case.cnn_model_version == "candidate"
+    db.close()
+
+    # promoting the canary is a plain swap of the active version
+    registry.activate("candidate")
+    assert registry.active.version == "candidate" and registry.canary is None
+
+
+def _tagged(path, series_uid, z=None, instance=None):
+    ds = pydicom.dcmread(path)
+    ds.SeriesInstanceUID = series_uid
+    if z is not None:
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.ImagePositionPatient = [0, 0, z]
+    if instance is not None:
+        ds.InstanceNumber = instance
+    ds.save_as(path, enforce_file_format=True)
+    return path
+
+
+def _write_multiframe(path, frames):
+    """Write `frames` (n, rows, cols) as one multi-frame DICOM file."""
+    path = write_dicom(path, frames[0])
+    ds = pydicom.dcmread(path)
+    ds.NumberOfFrames = len(frames)
+    ds.PixelData = frames.astype(np.uint16).tobytes()
+    ds.save_as(path, enforce_file_format=True)
+    return path
+
+
+def test_cache_keys_of_blob_uploads_need_no_read_and_pruning_is_throttled(tmp_path, monkeypatch):
+    import hashlib
+    import blob_store
+    import prediction_cache
+
+    src = write_dicom(tmp_path / "in.dcm", np.eye(8, dtype=np.uint16))
+    sha = hashlib.sha256(open(src, "rb").read()).hexdigest()
+    relpath, _ = blob_store.put_file(src, sha, ".dcm", root=str(tmp_path))
+    blob = os.path.join(str(tmp_path), *relpath.split("/"))
+    legacy = write_dicom(tmp_path / "legacy.dcm", np.eye(8, dtype=np.uint16))
+    reads = []
+    real_dcmread = prediction_cache.pydicom.dcmread
+    monkeypatch.setattr(prediction_cache.pydicom, "dcmread", lambda path, **kw: reads.append(path) or real_dcmread(path, **kw))
+
+    # the blob is keyed by its content hash (MRIImage.content_hash), the CNN decodes it only once
+    hashes = prediction_cache.pixel_hashes([blob, f"{blob}#1", legacy])
+    assert hashes[blob] == sha and hashes[f"{blob}#1"] not in (None, sha)
+    assert reads == [legacy]
+
+    monkeypatch.setattr(prediction_cache, "PRUNE_INTERVAL_SECONDS", 3600)
+    monkeypatch.setattr(prediction_cache, "_last_prune", None)
+    assert prediction_cache.prune_due() and not prediction_cache.prune_due()
+
+
+def test_series_mode_groups_orders_expands_frames_and_samples(memory_db, tmp_path, monkeypatch):
+    import series
+
+    # series A: three slices written out of order; series B: one 4-frame file
+    a = [_tagged(write_dicom(tmp_path / f"a{z}.dcm", np.full((8, 8), z * 100, dtype=np.uint16)), "1.2.1", z=z)
+         for z in (2, 0, 1)]
+    frames = np.stack([np.full((8, 8), v, dtype=np.uint16) for v in (10, 20, 30, 40)])
+    frames[:, 0, 0] = 0  # keep min-max normalization non-degenerate
+    b = _tagged(_write_multiframe(tmp_path / "b.dcm", frames), "1.2.2")
+
+    volumes = series.discover(a + [b])
+    assert [v.uid for v in volumes] == ["1.2.1", "1.2.2"]
+    assert [os.path.basename(s.path) for s in volumes[0].slices] == ["a0.dcm", "a1.dcm", "a2.dcm"]
+    assert volumes[1].keys() == [f"{b}#{i}" for i in range(4)]
+    # a frame key decodes only that frame
+    assert cnn_predictor._preprocess_from_path(f"{b}#3").shape == (1, 128, 128, 3)
+
+    assert len(series.sample(range(100), max_slices=10, strategy="uniform")) == 10
+    centered = series.sample(list(range(10)), max_slices=0, strategy="center", center_fraction=0.6)
+    assert centered == [2, 3, 4, 5, 6, 7]
+    np.testing.assert_allclose(series.aggregate([[0.9, 0.1], [0.8, 0.2], [0.1, 0.9]], "vote"), [2 / 3, 1 / 3])
+    np.testing.assert_allclose(series.aggregate_groups([[[1.0, 0.0]], [[0.0, 1.0], [0.0, 1.0]]], "mean"), [0.5, 0.5])
+
+    # end to end: the case is scored per series on the sampled slices
+    import models
+    monkeypatch.setattr(cnn_predictor, "INFERENCE_MODE", "series")
+    monkeypatch.setattr(series, "SERIES_SAMPLING", "uniform")
+    monkeypatch.setattr(series, "SERIES_MAX_SLICES", 2)
+    monkeypatch.setattr(cnn_predictor, "SCHEDULER_ENABLED", False)
+    model = FakeModel()
+    _use_models(monkeypatch, v1=model)
+    db = memory_db()
+    case = models.MedicalCase(patient_id="p1", status="pending")
+    db.add(case)
+    db.commit()
+    for p in a + [b]:
+        db.add(models.MRIImage(case_id=case.id, filename=os.path.basename(p), file_path=None))
+    db.commit()
+    monkeypatch.setattr(cnn_predictor, "UPLOAD_DIR", str(tmp_path))
+    cnn_predictor.analyze_case(case.id)
+    assert sum(model.calls) == 4  # 2 sampled slices per series
+    db.refresh(case)
+    assert case.status == "analyzed" and case.cnn_prediction in ("Malade", "Sain")
+    db.close()
+
+
+def test_slices_mode_scores_every_frame_of_a_multi_frame_file(memory_db, tmp_path, monkeypatch):
+    import models
+
+    frames = np.stack([np.full((8, 8), v, dtype=np.uint16) for v in (10, 20, 30)])
+    frames[:, 0, 0] = 0
+    path = _write_multiframe(tmp_path / "cine.dcm", frames)
+    monkeypatch.setattr(cnn_predictor, "INFERENCE_MODE", "slices")
+    monkeypatch.setattr(cnn_predictor, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(cnn_predictor, "SCHEDULER_ENABLED", False)
+    model = FakeModel()
+    _use_models(monkeypatch, v1=model)
+    db = memory_db()
+    case = models.MedicalCase(patient_id="p1", status="pending")
+    db.add(case)
+    db.commit()
+    db.add(models.MRIImage(case_id=case.id, filename=os.path.basename(path), file_path=None))
+    db.commit()
+
+    # a case made only of a multi-frame file is analyzed frame by frame, not left pred_failed
+    cnn_predictor.analyze_case(case.id)
+    assert sum(model.calls) == 3
+    db.refresh(case)
+    assert case.status == "analyzed" and case.cnn_prediction in ("Malade", "Sain")
+    db.close()
+
+
+class _ConstantModel:
+    """Outputs P(class 0) = p for every slice, plus a little slice-dependent jitter."""
+
+    def __init__(self, p):
+        self.p = p
+        self.calls = []
+
+    def predict(self, x, batch_size=None, verbose=0):
+        self.calls.append(len(x))
+        jitter = (x.reshape(len(x), -1).mean(axis=1) - 0.5) * 0.02
+        p0 = self.p + jitter
+        return np.stack([p0, 1.0 - p0], axis=1).astype(np.float32)
+
+
+def test_early_exit_stops_once_verdict_is_stable_and_records_slices_scored(memory_db, tmp_path, monkeypatch):
+    import models
+
+    SessionLocal, case_id = _setup_case(memory_db, tmp_path, monkeypatch, n_slices=40)
+    monkeypatch.setattr(cnn_predictor, "EARLY_EXIT_ENABLED", True)
+    monkeypatch.setattr(cnn_predictor, "EARLY_EXIT_BATCH", 8)
+    monkeypatch.setattr(cnn_predictor, "EARLY_EXIT_MIN_SLICES", 8)
+    monkeypatch.setattr(cnn_predictor.prediction_cache, "ENABLED", False)
+
+    confident = _ConstantModel(0.9)
+    _use_models(monkeypatch, v1=confident)
+    cnn_predictor.analyze_case(case_id)
+    db = SessionLocal()
+    case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+    assert sum(confident.calls) == 8
+    assert (case.cnn_prediction, case.cnn_slices_scored, case.cnn_slices_total) == ("Malade", 8, 40)
+    db.close()
+
+    # near the decision boundary every slice is scored
+    undecided = _ConstantModel(0.5)
+    _use_models(monkeypatch, v2=undecided)
+    cnn_predictor.analyze_case(case_id)
+    db = SessionLocal()
+    case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+    assert sum(undecided.calls) == 40 and case.cnn_slices_scored == 40
+    db.close()
+
+
+def test_analyze_case_records_stage_timings(memory_db, tmp_path, monkeypatch):
+    import json
+    import metrics
+    import models
+
+    SessionLocal, case_id = _setup_case(memory_db, tmp_path, monkeypatch, n_slices=3)
+    monkeypatch.setattr(cnn_predictor, "STORE_TIMINGS", True)
+    _use_models(monkeypatch, v1=FakeModel())
+    before = {s: cnn_predictor.STAGE_SECONDS.count(stage=s) for s in ("discovery", "decode", "inference")}
+    cnn_predictor.analyze_case(case_id)
+
+    for stage, n in before.items():
+        assert cnn_predictor.STAGE_SECONDS.count(stage=stage) == n + 1
+    assert cnn_predictor.ANALYSIS_SECONDS.count(outcome="ok") >= 1
+    db = SessionLocal()
+    case = db.query(models.MedicalCase).filter(models.MedicalCase.id == case_id).first()
+    stored = json.loads(case.cnn_timings)
+    assert {"discovery", "decode", "preprocess", "inference", "aggregation"} <= set(stored)
+    db.close()
+    assert 'cnn_analysis_stage_seconds_bucket{stage="inference",le="+Inf"}' in metrics.render()
@@ -1,4 +1,5 @@
 # tests/test_models.py
+import os
 import numpy as np
 from src.models.architecture import build_cnn
 
@@ -10,3 +11,40 @@ def test_build_cnn_and_predict_shape():
     dummy = np.zeros((1,128,128,3), dtype=np.float32)
     preds = model.predict(dummy)
     assert preds.shape == (1,2)
+
+
+# Tolérance de parité Keras <-> TFLite (float32)
+TFLITE_PARITY_ATOL = 1e-4
+
+def test_export_tflite_matches_keras(tmp_path):
+    from src.models.export import export_tflite
+    from tflite_model import TFLiteModel
+
+    model = build_cnn(input_shape=(128,128,3), num_classes=2)
+    path = export_tflite(model, str(tmp_path / "cnn.tflite"))
+    lite = TFLiteModel(path)
+
+    x = np.random.default_rng(0).random((4,128,128,3), dtype=np.float32)
+    expected = model.predict(x, verbose=0)
+    np.testing.assert_allclose(lite.predict(x), expected, atol=TFLITE_PARITY_ATOL)
+    # batch size changes (resize) must still work
+    np.testing.assert_allclose(lite.predict(x[:1]), expected[:1], atol=TFLITE_PARITY_ATOL)
+
+
+def test_quantization_gate_publishes_or_refuses(tmp_path):
+    from src.models.quantization import quantize_with_gate
+
+    model = build_cnn(input_shape=(128,128,3), num_classes=2)
+    rng = np.random.default_rng(0)
+    X = rng.random((8,128,128,3), dtype=np.float32)
+    y = np.argmax(model.predict(X, verbose=0), axis=1)
+    base = str(tmp_path / "cnn.h5")
+
+    ok = quantize_with_gate(model, X, X, y, modes=["float16"], output_base=base, max_accuracy_drop=0.5, max_recall_drop=1.0)
+    assert ok["variants"]["float16"]["published"]
+    assert os.path.exists(str(tmp_path / "cnn.float16.tflite"))
+
+    # un seuil impossible doit bloquer la publication
+    refused = quantize_with_gate(model, X, X, y, modes=["int8"], output_base=base, max_accuracy_drop=-1.0)
+    assert not refused["variants"]["int8"]["published"]
+    assert not os.path.exists(str(tmp_path / "cnn.int8.tflite"))